@@ -15,7 +15,6 @@ interface Version {
   created_at: string
   created_by: string
   change_summary: string
-  content: any
 }
 
 interface EnhancedVersionHistoryProps {
@@ -26,6 +25,7 @@ interface EnhancedVersionHistoryProps {
 
 export default function EnhancedVersionHistory({ documentId, isOpen, onClose }: EnhancedVersionHistoryProps) {
   const [versions, setVersions] = useState<Version[]>([])
+  const [nextBefore, setNextBefore] = useState<number | null>(null)
   const [loading, setLoading] = useState(true)
   const [restoring, setRestoring] = useState<number | null>(null)
   const [selectedVersions, setSelectedVersions] = useState<[number | null, number | null]>([null, null])
@@ -38,11 +38,14 @@ export default function EnhancedVersionHistory({ documentId, isOpen, onClose }:
     }
   }, [isOpen, documentId])
 
-  const loadVersions = async () => {
+  // Versions come newest first, a page at a time
+  const loadVersions = async (before: number | null = null) => {
     try {
-      const response = await fetch(`/documents/api/versions/${documentId}/`)
+      const query = before === null ? "" : `?before=${before}`
+      const response = await fetch(`/documents/api/versions/${documentId}/${query}`)
       const data = await response.json()
-      setVersions(data.versions || [])
+      setVersions((loaded) => (before === null ? data.versions || [] : [...loaded, ...(data.versions || [])]))
+      setNextBefore(data.next ?? null)
     } catch (error) {
       console.error("[v0] Error loading versions:", error)
       toast({
@@ -167,6 +170,11 @@ export default function EnhancedVersionHistory({ documentId, isOpen, onClose }:
                         </div>
                       </div>
                     ))}
+                    {nextBefore !== null && (
+                      <Button variant="outline" size="sm" className="w-full" onClick={() => loadVersions(nextBefore)}>
+                        Load older versions
+                      </Button>
+                    )}
                   </div>
                 )}
               </ScrollArea>
@@ -232,13 +240,14 @@ export default function EnhancedVersionHistory({ documentId, isOpen, onClose }:
       {/* Version Comparison Dialog */}
       {selectedVersions[0] !== null && selectedVersions[1] !== null && (
         <VersionComparison
+          documentId={documentId}
           isOpen={showComparison}
           onClose={() => setShowComparison(false)}
           version1={
             getSelectedVersion(0)
               ? {
+                  id: getSelectedVersion(0)!.id,
                   number: getSelectedVersion(0)!.version_number,
-                  content: getSelectedVersion(0)!.content,
                   createdAt: getSelectedVersion(0)!.created_at,
                 }
               : null
@@ -246,8 +255,8 @@ export default function EnhancedVersionHistory({ documentId, isOpen, onClose }:
           version2={
             getSelectedVersion(1)
               ? {
+                  id: getSelectedVersion(1)!.id,
                   number: getSelectedVersion(1)!.version_number,
-                  content: getSelectedVersion(1)!.content,
                   createdAt: getSelectedVersion(1)!.created_at,
                 }
               : null
@@ -1,87 +1,146 @@
 "use client"
+import { useEffect, useState } from "react"
 import { Dialog, DialogContent, DialogDescription, DialogHeader, DialogTitle } from "@/components/ui/dialog"
 import { Button } from "@/components/ui/button"
 import { ScrollArea } from "@/components/ui/scroll-area"
-import { Tabs, TabsContent, TabsList, TabsTrigger } from "@/components/ui/tabs"
+
+interface ComparedVersion {
+  id: number
+  number: number
+  createdAt: string
+}
 
 interface VersionComparisonProps {
+  documentId: string
   isOpen: boolean
   onClose: () => void
-  version1: {
-    number: number
-    content: string
-    createdAt: string
-  } | null
-  version2: {
-    number: number
-    content: string
-    createdAt: string
-  } | null
+  version1: ComparedVersion | null
+  version2: ComparedVersion | null
+}
+
+interface InlineChange {
+  op: "equal" | "insert" | "delete"
+  text: string
+}
+
+interface DiffEntry {
+  op: "equal" | "added" | "removed" | "changed"
+  old_index?: number
+  new_index?: number
+  count?: number
+  type?: string
+  text?: string
+  inline?: InlineChange[]
+  format_changed?: boolean
+}
+
+interface Diff {
+  blocks: DiffEntry[]
+  summary: { added: number; removed: number; changed: number; unchanged: number }
 }
 
-export default function VersionComparison({ isOpen, onClose, version1, version2 }: VersionComparisonProps) {
-  if (!version1 || !version2) return null
+export default function VersionComparison({ documentId, isOpen, onClose, version1, version2 }: VersionComparisonProps) {
+  const [diff, setDiff] = useState<Diff | null>(null)
+  const [error, setError] = useState<string | null>(null)
+
+  // Always diff from the older version to the newer one
+  const [older, newer] =
+    version1 && version2 && version1.number > version2.number ? [version2, version1] : [version1, version2]
 
-  const extractText = (content: any): string => {
-    if (typeof content === "string") return content
-    if (typeof content === "object" && content.content) {
-      return content.content.map((node: any) => extractText(node)).join("\n")
+  useEffect(() => {
+    if (!isOpen || !older || !newer) return
+    let cancelled = false
+    setDiff(null)
+    setError(null)
+    fetch(`/documents/api/diff/${documentId}/?from=${older.id}&to=${newer.id}`)
+      .then(async (response) => {
+        const data = await response.json()
+        if (!response.ok) throw new Error(data.error || "Failed to load diff")
+        if (!cancelled) setDiff(data)
+      })
+      .catch((err) => {
+        console.error("[v0] Error loading diff:", err)
+        if (!cancelled) setError(err.message)
+      })
+    return () => {
+      cancelled = true
     }
-    return ""
-  }
+  }, [isOpen, documentId, older?.id, newer?.id])
 
-  const text1 = extractText(version1.content)
-  const text2 = extractText(version2.content)
+  if (!older || !newer) return null
+
+  const renderEntry = (entry: DiffEntry, index: number) => {
+    switch (entry.op) {
+      case "equal":
+        return (
+          <p key={index} className="text-muted-foreground italic">
+            {entry.count} unchanged block{entry.count === 1 ? "" : "s"}
+          </p>
+        )
+      case "added":
+        return (
+          <p key={index} className="whitespace-pre-wrap bg-green-50 text-green-700 border-l-2 border-green-500 pl-2">
+            + {entry.text}
+          </p>
+        )
+      case "removed":
+        return (
+          <p key={index} className="whitespace-pre-wrap bg-red-50 text-red-700 line-through border-l-2 border-red-500 pl-2">
+            - {entry.text}
+          </p>
+        )
+      case "changed":
+        return (
+          <p key={index} className="whitespace-pre-wrap border-l-2 border-yellow-500 pl-2">
+            {entry.inline?.map((change, i) =>
+              change.op === "insert" ? (
+                <ins key={i} className="bg-green-100 text-green-700 no-underline">
+                  {change.text}
+                </ins>
+              ) : change.op === "delete" ? (
+                <del key={i} className="bg-red-100 text-red-700">
+                  {change.text}
+                </del>
+              ) : (
+                <span key={i}>{change.text}</span>
+              ),
+            )}
+            {entry.format_changed && <span className="ml-2 text-xs text-muted-foreground">(formatting)</span>}
+          </p>
+        )
+    }
+  }
 
   return (
     <Dialog open={isOpen} onOpenChange={onClose}>
-      <DialogContent className="max-w-4xl max-h-96">
+      <DialogContent className="max-w-4xl">
         <DialogHeader>
           <DialogTitle>Compare Versions</DialogTitle>
           <DialogDescription>
-            Comparing v{version1.number} ({new Date(version1.createdAt).toLocaleString()}) with v{version2.number} (
-            {new Date(version2.createdAt).toLocaleString()})
+            Changes from v{older.number} ({new Date(older.createdAt).toLocaleString()}) to v{newer.number} (
+            {new Date(newer.createdAt).toLocaleString()})
           </DialogDescription>
         </DialogHeader>
 
-        <Tabs defaultValue="side-by-side" className="w-full">
-          <TabsList className="grid w-full grid-cols-2">
-            <TabsTrigger value="side-by-side">Side by Side</TabsTrigger>
-            <TabsTrigger value="unified">Unified</TabsTrigger>
-          </TabsList>
-
-          <TabsContent value="side-by-side" className="space-y-4">
-            <div className="grid grid-cols-2 gap-4">
-              <div>
-                <h3 className="font-semibold text-sm mb-2">Version {version1.number}</h3>
-                <ScrollArea className="h-64 border rounded-lg p-4 bg-muted">
-                  <p className="text-sm whitespace-pre-wrap">{text1}</p>
-                </ScrollArea>
-              </div>
-              <div>
-                <h3 className="font-semibold text-sm mb-2">Version {version2.number}</h3>
-                <ScrollArea className="h-64 border rounded-lg p-4 bg-muted">
-                  <p className="text-sm whitespace-pre-wrap">{text2}</p>
-                </ScrollArea>
-              </div>
-            </div>
-          </TabsContent>
+        {diff && (
+          <p className="text-sm">
+            <span className="text-green-700">{diff.summary.added} added</span>,{" "}
+            <span className="text-red-700">{diff.summary.removed} removed</span>,{" "}
+            <span className="text-yellow-700">{diff.summary.changed} changed</span>, {diff.summary.unchanged} unchanged
+          </p>
+        )}
 
-          <TabsContent value="unified" className="space-y-4">
-            <ScrollArea className="h-96 border rounded-lg p-4 bg-muted">
-              <div className="space-y-2 text-sm font-mono">
-                <div className="text-red-600">
-                  <p>--- Version {version1.number}</p>
-                  <p className="whitespace-pre-wrap">{text1}</p>
-                </div>
-                <div className="text-green-600">
-                  <p>+++ Version {version2.number}</p>
-                  <p className="whitespace-pre-wrap">{text2}</p>
-                </div>
-              </div>
-            </ScrollArea>
-          </TabsContent>
-        </Tabs>
+        <ScrollArea className="h-96 border rounded-lg p-4 bg-muted">
+          {error ? (
+            <p className="text-sm text-red-600">{error}</p>
+          ) : !diff ? (
+            <p className="text-sm text-muted-foreground">Loading changes...</p>
+          ) : diff.blocks.length === 0 || diff.blocks.every((entry) => entry.op === "equal") ? (
+            <p className="text-sm text-muted-foreground">No changes between these versions</p>
+          ) : (
+            <div className="space-y-2 text-sm">{diff.blocks.map(renderEntry)}</div>
+          )}
+        </ScrollArea>
 
         <div className="flex justify-end gap-2">
           <Button variant="outline" onClick={onClose}>
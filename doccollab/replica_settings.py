@@ -0,0 +1,27 @@
+"""
+Settings for running the test suite against a primary and a read replica,
+two local SQLite databases:
+
+    python manage.py test --settings=doccollab.replica_settings
+
+The replica gets its own test database (no ``MIRROR``), so a test can tell
+which database a read went to from the rows it sees. Replicas need a cache
+shared between processes; without CACHE_REDIS_URL a file cache stands in.
+"""
+import os
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, CACHES, DATABASES
+
+DATABASES['replica_1'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': BASE_DIR / 'replica.sqlite3',
+}
+DATABASE_REPLICAS = ['replica_1']
+
+if not os.getenv('CACHE_REDIS_URL'):
+    CACHES['default'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'doccollab-replica-cache'),
+    }
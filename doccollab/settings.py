@@ -52,6 +52,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'documents.replicas.RecentWriteMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -79,13 +80,41 @@ ASGI_APPLICATION = 'doccollab.asgi.application'
 # Database Configuration - Auto-switches between SQLite (local) and MySQL (Railway)
 import dj_database_url
 
+# MySQL connections are pooled per process (documents.backends.mysql_pool) and
+# returned to the pool after every request / consumer database call. With
+# DB_POOL off each thread keeps its own connection for DB_CONN_MAX_AGE seconds.
+DB_POOL = os.getenv('DB_POOL', 'true').lower() == 'true'
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', '600'))
+DB_POOL_OPTIONS = {
+    'size': int(os.getenv('DB_POOL_SIZE', '10')),
+    'max_overflow': int(os.getenv('DB_POOL_MAX_OVERFLOW', '10')),
+    'timeout': float(os.getenv('DB_POOL_TIMEOUT', '5')),
+    'recycle': float(os.getenv('DB_POOL_RECYCLE', '3600')),
+    'ping_after': float(os.getenv('DB_POOL_PING_AFTER', '30')),
+}
+
+
+def with_connection_reuse(config):
+    """Pool or persist connections of a MySQL database config"""
+    config['CONN_HEALTH_CHECKS'] = True
+    if config.get('ENGINE') != 'django.db.backends.mysql':
+        return config
+    if DB_POOL:
+        config['ENGINE'] = 'documents.backends.mysql_pool'
+        config['CONN_MAX_AGE'] = 0
+        config['POOL'] = dict(DB_POOL_OPTIONS)
+    else:
+        config['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+    return config
+
+
 # Temporary debug - add this to your settings.py
 # Try multiple connection methods
 def get_database_config():
     # Method 1: DATABASE_URL
     if 'DATABASE_URL' in os.environ:
         import dj_database_url
-        return dj_database_url.config(conn_max_age=600)
+        return with_connection_reuse(dj_database_url.config(conn_max_age=DB_CONN_MAX_AGE))
     
     # Method 2: Individual MySQL variables
     mysql_config = {
@@ -103,7 +132,7 @@ def get_database_config():
     
     # Check if we have at least the host (indicating Railway MySQL is available)
     if os.environ.get('MYSQLHOST') and os.environ.get('MYSQLHOST') != 'localhost':
-        return mysql_config
+        return with_connection_reuse(mysql_config)
     
     # Fallback to SQLite for local development
     return {
@@ -114,6 +143,22 @@ def get_database_config():
 DATABASES = {
     'default': get_database_config()
 }
+
+# Read replicas: comma-separated database URLs, registered as replica_1,
+# replica_2, ... Views marked with documents.replicas.replica_reads read
+# from them unless the user wrote in the last REPLICA_READ_YOUR_WRITES
+# seconds or the replicas lag more than REPLICA_MAX_LAG seconds. Startup
+# fails if replicas are set without CACHE_REDIS_URL.
+DATABASE_REPLICAS = []
+for index, url in enumerate(u.strip() for u in os.getenv('REPLICA_DATABASE_URLS', '').split(',') if u.strip()):
+    alias = f'replica_{index + 1}'
+    DATABASES[alias] = with_connection_reuse(dj_database_url.parse(url, conn_max_age=DB_CONN_MAX_AGE))
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ['documents.replicas.ReplicaRouter']
+REPLICA_READ_YOUR_WRITES = float(os.getenv('REPLICA_READ_YOUR_WRITES', '10'))
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', '2'))
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv('REPLICA_LAG_CHECK_INTERVAL', '5'))
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -150,15 +195,171 @@ if not DEBUG:
     ])
 
 # Channel layers for WebSockets
-CHANNEL_LAYERS = {
-    'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
-        'CONFIG': {
-            'hosts': [os.getenv('REDIS_URL', 'redis://localhost:6379')],  # Railway sets REDIS_URL
-        },
+REDIS_CHANNEL_LAYER = {
+    'BACKEND': 'channels_redis.core.RedisChannelLayer',
+    'CONFIG': {
+        'hosts': [os.getenv('REDIS_URL', 'redis://localhost:6379')],  # Railway sets REDIS_URL
     },
 }
 
+# Local-first by default: group messages reach members in this process
+# in-memory and go through Redis only when other processes have members.
+# Set CHANNEL_LAYER=redis to send everything through Redis.
+if os.getenv('CHANNEL_LAYER', 'hybrid') == 'redis':
+    CHANNEL_LAYERS = {'default': REDIS_CHANNEL_LAYER}
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'documents.channel_layers.HybridChannelLayer',
+            'CONFIG': {
+                'inner': REDIS_CHANNEL_LAYER,
+                'membership_url': os.getenv('REDIS_URL', 'redis://localhost:6379'),
+            },
+        },
+    }
+
+# Cache - shared Redis cache when configured, per-process memory otherwise
+if os.getenv('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_REDIS_URL'),
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
+# Public read-only pages: metadata/ETag lifetime and rendered HTML lifetime (seconds)
+PUBLIC_DOCUMENT_CACHE_TTL = int(os.getenv('PUBLIC_DOCUMENT_CACHE_TTL', '30'))
+RENDERED_HTML_CACHE_TTL = int(os.getenv('RENDERED_HTML_CACHE_TTL', '86400'))
+
+# Per-process LRU of rendered top-level blocks (entries, shared by all formats)
+RENDER_BLOCK_CACHE_SIZE = int(os.getenv('RENDER_BLOCK_CACHE_SIZE', '5000'))
+
+# Block storage: blocks sent with document_load, blocks per follow-up frame,
+# and seconds between refreshes of the materialized Document.content
+BLOCK_INITIAL_LOAD = int(os.getenv('BLOCK_INITIAL_LOAD', '40'))
+BLOCK_STREAM_CHUNK = int(os.getenv('BLOCK_STREAM_CHUNK', '200'))
+BLOCK_MATERIALIZE_INTERVAL = float(os.getenv('BLOCK_MATERIALIZE_INTERVAL', '60'))
+
+# Read-only viewers get coalesced snapshots at most once per interval (seconds)
+VIEWER_SNAPSHOT_INTERVAL = float(os.getenv('VIEWER_SNAPSHOT_INTERVAL', '1.0'))
+
+# Room affinity: comma-separated ids of the ASGI workers that own rooms, and
+# this process's id among them. Requires a shared (Redis) cache: startup
+# fails if it is on without CACHE_REDIS_URL.
+WORKER_ID = os.getenv('WORKER_ID', '')
+ROOM_WORKERS = [w.strip() for w in os.getenv('ROOM_WORKERS', '').split(',') if w.strip()]
+ROOM_AFFINITY = os.getenv('ROOM_AFFINITY', 'true' if ROOM_WORKERS else 'false').lower() == 'true'
+ROOM_HEARTBEAT_INTERVAL = float(os.getenv('ROOM_HEARTBEAT_INTERVAL', '10'))
+
+# Graceful drain: clients of a draining worker reconnect at a random point
+# within the window (seconds); the server stops DRAIN_GRACE seconds after
+# SIGTERM once they have been told
+DRAIN_RECONNECT_WINDOW = float(os.getenv('DRAIN_RECONNECT_WINDOW', '10'))
+DRAIN_GRACE = float(os.getenv('DRAIN_GRACE', '2'))
+DRAIN_ON_SIGTERM = os.getenv('DRAIN_ON_SIGTERM', 'true').lower() == 'true'
+
+# Room lifecycle: rooms without members are evicted after ROOM_IDLE_TTL
+# seconds (or beyond ROOM_MAX_WARM of them); presence rows not refreshed by
+# any worker for PRESENCE_STALE_AFTER seconds are removed
+ROOM_IDLE_TTL = float(os.getenv('ROOM_IDLE_TTL', '300'))
+ROOM_MAX_WARM = int(os.getenv('ROOM_MAX_WARM', '1000'))
+ROOM_SWEEP_INTERVAL = float(os.getenv('ROOM_SWEEP_INTERVAL', '60'))
+PRESENCE_STALE_AFTER = float(os.getenv('PRESENCE_STALE_AFTER', '180'))
+
+# Websocket frame rate limits as (tokens per second, burst), per connection
+# and per room. Over-limit edits are coalesced to the latest one, other
+# over-limit frames are dropped.
+WS_RATE_LIMITS = {
+    'edit': (10, 20),
+    'cursor': (20, 40),
+    'comment': (1, 5),
+}
+WS_ROOM_RATE_LIMITS = {
+    'edit': (50, 100),
+    'cursor': (100, 200),
+    'comment': (5, 20),
+}
+
+# Per-room work (saves, broadcasts, activity writes) is scheduled
+# round-robin across rooms with at most this many jobs in flight
+SCHEDULER_DB_CONCURRENCY = int(os.getenv('SCHEDULER_DB_CONCURRENCY', '4'))
+
+# Buffered edits: accepted edits are journaled under EDIT_JOURNAL_DIR/<WORKER_ID>
+# and written to the database every EDIT_FLUSH_INTERVAL seconds per document.
+# Needs one writer per document (a single worker, or ROOM_AFFINITY with a
+# stable WORKER_ID). Commits within EDIT_JOURNAL_FSYNC_INTERVAL seconds share
+# an fsync; without EDIT_JOURNAL_FSYNC edits survive a worker crash but not
+# a machine crash.
+EDIT_BUFFERING = os.getenv('EDIT_BUFFERING', 'false').lower() == 'true'
+EDIT_FLUSH_INTERVAL = float(os.getenv('EDIT_FLUSH_INTERVAL', '2'))
+EDIT_JOURNAL_DIR = os.getenv('EDIT_JOURNAL_DIR', str(BASE_DIR / 'journal'))
+EDIT_JOURNAL_SEGMENT_BYTES = int(os.getenv('EDIT_JOURNAL_SEGMENT_BYTES', str(16 * 1024 * 1024)))
+EDIT_JOURNAL_FSYNC = os.getenv('EDIT_JOURNAL_FSYNC', 'true').lower() == 'true'
+EDIT_JOURNAL_FSYNC_INTERVAL = float(os.getenv('EDIT_JOURNAL_FSYNC_INTERVAL', '0.005'))
+EDIT_JOURNAL_MMAP = os.getenv('EDIT_JOURNAL_MMAP', 'false').lower() == 'true'
+
+# Comment anchors are rebased in memory as edits are applied and the moved
+# ones written back every COMMENT_ANCHOR_FLUSH_INTERVAL seconds.
+# The comments API returns at most COMMENTS_PAGE_MAX per page
+COMMENT_ANCHOR_FLUSH_INTERVAL = float(os.getenv('COMMENT_ANCHOR_FLUSH_INTERVAL', '5'))
+COMMENTS_PAGE_SIZE = int(os.getenv('COMMENTS_PAGE_SIZE', '50'))
+COMMENTS_PAGE_MAX = int(os.getenv('COMMENTS_PAGE_MAX', '200'))
+
+# Activity feed: runs of one user's activity less than ACTIVITY_GROUP_GAP
+# seconds apart are folded into one entry; a page reads at most
+# ACTIVITY_SCAN_MAX rows. `archive_activity` moves rows older than
+# ACTIVITY_ARCHIVE_AFTER_DAYS into gzipped files under ACTIVITY_ARCHIVE_DIR
+ACTIVITY_PAGE_SIZE = int(os.getenv('ACTIVITY_PAGE_SIZE', '20'))
+ACTIVITY_PAGE_MAX = int(os.getenv('ACTIVITY_PAGE_MAX', '100'))
+ACTIVITY_GROUP_GAP = int(os.getenv('ACTIVITY_GROUP_GAP', '900'))
+ACTIVITY_SCAN_MAX = int(os.getenv('ACTIVITY_SCAN_MAX', '5000'))
+ACTIVITY_ARCHIVE_DIR = os.getenv('ACTIVITY_ARCHIVE_DIR', str(BASE_DIR / 'activity_archive'))
+ACTIVITY_ARCHIVE_AFTER_DAYS = int(os.getenv('ACTIVITY_ARCHIVE_AFTER_DAYS', '30'))
+
+# Bulk sharing: most (document, user-or-group) grants one request may make
+SHARE_BULK_MAX = int(os.getenv('SHARE_BULK_MAX', '50000'))
+
+# Version diffs are cached by the pair of content hashes for DIFF_CACHE_TTL
+# seconds (a pair's diff never changes, only eviction matters)
+DIFF_CACHE_TTL = int(os.getenv('DIFF_CACHE_TTL', '86400'))
+
+# Version history pages hold VERSIONS_PAGE_SIZE versions (at most
+# VERSIONS_PAGE_MAX). Playback streams read PLAYBACK_BATCH_SIZE versions per
+# query and send a full keyframe every PLAYBACK_KEYFRAME_INTERVAL versions
+VERSIONS_PAGE_SIZE = int(os.getenv('VERSIONS_PAGE_SIZE', '100'))
+VERSIONS_PAGE_MAX = int(os.getenv('VERSIONS_PAGE_MAX', '500'))
+PLAYBACK_BATCH_SIZE = int(os.getenv('PLAYBACK_BATCH_SIZE', '50'))
+PLAYBACK_KEYFRAME_INTERVAL = int(os.getenv('PLAYBACK_KEYFRAME_INTERVAL', '100'))
+
+# Imports: uploads are streamed to IMPORT_DIR and parsed in a pool of
+# IMPORT_WORKERS processes (recycled every IMPORT_TASKS_PER_CHILD files).
+# Single files may be IMPORT_MAX_FILE_SIZE bytes, ZIPs IMPORT_MAX_UPLOAD_SIZE
+# with up to IMPORT_MAX_ZIP_FILES files. Imported documents with at least
+# IMPORT_BLOCK_STORAGE_MIN top-level blocks go straight to block storage
+IMPORT_DIR = os.getenv('IMPORT_DIR', str(BASE_DIR / 'imports'))
+IMPORT_WORKERS = int(os.getenv('IMPORT_WORKERS', str(min(os.cpu_count() or 1, 4))))
+IMPORT_TASKS_PER_CHILD = int(os.getenv('IMPORT_TASKS_PER_CHILD', '200'))
+IMPORT_MAX_FILE_SIZE = int(os.getenv('IMPORT_MAX_FILE_SIZE', str(50 * 1024 * 1024)))
+IMPORT_MAX_UPLOAD_SIZE = int(os.getenv('IMPORT_MAX_UPLOAD_SIZE', str(4 * 1024 * 1024 * 1024)))
+IMPORT_MAX_ZIP_FILES = int(os.getenv('IMPORT_MAX_ZIP_FILES', '100000'))
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '50'))
+IMPORT_PROGRESS_INTERVAL = float(os.getenv('IMPORT_PROGRESS_INTERVAL', '1'))
+IMPORT_ERRORS_MAX = int(os.getenv('IMPORT_ERRORS_MAX', '100'))
+IMPORT_BLOCK_STORAGE_MIN = int(os.getenv('IMPORT_BLOCK_STORAGE_MIN', '2000'))
+# Running jobs heartbeat every IMPORT_PROGRESS_INTERVAL; jobs without one
+# for IMPORT_STALE_AFTER seconds (their process died) are resumed by
+# `manage.py resume_imports`
+IMPORT_STALE_AFTER = float(os.getenv('IMPORT_STALE_AFTER', '300'))
+
+# Most documents one request may create from a template
+TEMPLATE_BULK_MAX = int(os.getenv('TEMPLATE_BULK_MAX', '1000'))
+
 # Session configuration
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'
 SESSION_COOKIE_AGE = 1209600
@@ -0,0 +1,170 @@
+"""
+Document access control lists.
+
+Access comes from direct grants (``DocumentPermission``) and group grants
+(``DocumentGroupPermission``, one row for a whole team). Both are resolved
+into ``DocumentACL``, one row per (document, user) with the strongest
+permission the user has, so checking access is a single lookup on the
+(document, user) unique index. The owner and public access are checked on
+the ``Document`` row itself.
+
+The ACL of a document is rebuilt whenever its grants change through
+``grant``, and when group membership changes or a group is deleted (model
+signals, so changes made in the admin are covered too). ``rebuild_acl``
+rebuilds every document's ACL from the grant tables.
+"""
+import logging
+
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, pre_delete
+
+from .models import DocumentACL, DocumentActivity, DocumentGroupPermission, DocumentPermission, DocumentStats
+from .stats import count_of
+
+logger = logging.getLogger(__name__)
+
+# 'owner' rows in DocumentPermission grant editing, as they always have
+RANK = {'viewer': 1, 'editor': 2, 'owner': 2}
+
+
+def access(document, user):
+    """'owner', 'editor' or 'viewer' for ``user`` on ``document``, or None"""
+    if document.owner_id == user.id:
+        return 'owner'
+    permission = DocumentACL.objects.filter(document_id=document.id, user_id=user.id).values_list(
+        'permission', flat=True
+    ).first()
+    if permission is not None:
+        return permission
+    return 'viewer' if document.is_public else None
+
+
+def resolve(document_ids):
+    """{(document_id, user_id): permission} from both grant tables"""
+    effective = {}
+
+    def merge(document_id, user_id, permission):
+        permission = 'editor' if RANK.get(permission, 0) >= RANK['editor'] else 'viewer'
+        key = (document_id, user_id)
+        if RANK[permission] > RANK.get(effective.get(key), 0):
+            effective[key] = permission
+
+    for document_id, user_id, permission in DocumentPermission.objects.filter(
+        document_id__in=document_ids
+    ).values_list('document_id', 'user_id', 'permission'):
+        merge(document_id, user_id, permission)
+
+    group_grants = list(DocumentGroupPermission.objects.filter(document_id__in=document_ids).values_list(
+        'document_id', 'group_id', 'permission'
+    ))
+    if group_grants:
+        members = {}
+        for group_id, user_id in User.groups.through.objects.filter(
+            group_id__in={group_id for _, group_id, _ in group_grants}
+        ).values_list('group_id', 'user_id'):
+            members.setdefault(group_id, []).append(user_id)
+        for document_id, group_id, permission in group_grants:
+            for user_id in members.get(group_id, ()):
+                merge(document_id, user_id, permission)
+    return effective
+
+
+def rebuild(document_ids, batch_size=1000):
+    """Rebuild the ACL (and collaborator counts) of ``document_ids``"""
+    document_ids = list(set(document_ids))
+    if not document_ids:
+        return 0
+    with transaction.atomic():
+        effective = resolve(document_ids)
+        DocumentACL.objects.filter(document_id__in=document_ids).delete()
+        DocumentACL.objects.bulk_create([
+            DocumentACL(document_id=document_id, user_id=user_id, permission=permission)
+            for (document_id, user_id), permission in effective.items()
+        ], batch_size=batch_size)
+        DocumentStats.objects.filter(document_id__in=document_ids).update(
+            collaborator_count=count_of(DocumentACL.objects.all())
+        )
+    return len(effective)
+
+
+def grant(documents, by, users=(), groups=(), permission='editor', batch_size=1000):
+    """
+    Grant ``permission`` on every document in ``documents`` to ``users`` and
+    ``groups`` in one transaction; existing grants are updated. The owner of
+    a document is never given a grant on it. Returns the number of grants.
+    """
+    direct = [
+        DocumentPermission(document=document, user=user, permission=permission)
+        for document in documents for user in users if user.id != document.owner_id
+    ]
+    team = [
+        DocumentGroupPermission(document=document, group=group, permission=permission)
+        for document in documents for group in groups
+    ]
+    names = [user.username for user in users] + [f'group {group.name}' for group in groups]
+    shown = ', '.join(names[:5]) + (f' and {len(names) - 5} more' if len(names) > 5 else '')
+    with transaction.atomic():
+        DocumentPermission.objects.bulk_create(
+            direct, batch_size=batch_size,
+            update_conflicts=True, unique_fields=['document', 'user'], update_fields=['permission'],
+        )
+        DocumentGroupPermission.objects.bulk_create(
+            team, batch_size=batch_size,
+            update_conflicts=True, unique_fields=['document', 'group'], update_fields=['permission'],
+        )
+        rebuild([document.id for document in documents], batch_size)
+        DocumentActivity.objects.bulk_create([
+            DocumentActivity(
+                document=document,
+                user=by,
+                activity_type='share',
+                description=f'Shared with {shown} ({permission})'[:255],
+            )
+            for document in documents
+        ], batch_size=batch_size)
+    return len(direct) + len(team)
+
+
+def documents_of_groups(group_ids):
+    return list(DocumentGroupPermission.objects.filter(group_id__in=group_ids).values_list(
+        'document_id', flat=True
+    ).distinct())
+
+
+def membership_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """User.groups changed (from either side): rebuild the ACLs of the groups' documents"""
+    if action not in ('post_add', 'post_remove', 'pre_clear', 'post_clear'):
+        return
+    if action == 'pre_clear':
+        # The cleared groups are gone by post_clear: remember them now
+        if reverse:
+            instance._cleared_groups = [instance.pk]
+        else:
+            instance._cleared_groups = list(instance.groups.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        group_ids = getattr(instance, '_cleared_groups', [])
+    elif reverse:
+        group_ids = [instance.pk]
+    else:
+        group_ids = pk_set or []
+    document_ids = documents_of_groups(group_ids)
+    if document_ids:
+        transaction.on_commit(lambda: rebuild(document_ids))
+
+
+def group_deleting(sender, instance, **kwargs):
+    instance._acl_documents = documents_of_groups([instance.pk])
+
+
+def group_deleted(sender, instance, **kwargs):
+    document_ids = getattr(instance, '_acl_documents', [])
+    if document_ids:
+        transaction.on_commit(lambda: rebuild(document_ids))
+
+
+def connect():
+    m2m_changed.connect(membership_changed, sender=User.groups.through, dispatch_uid='documents.acl.membership')
+    pre_delete.connect(group_deleting, sender=Group, dispatch_uid='documents.acl.group_deleting')
+    post_delete.connect(group_deleted, sender=Group, dispatch_uid='documents.acl.group_deleted')
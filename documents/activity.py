@@ -0,0 +1,221 @@
+"""
+Activity feed: keyset pages, aggregation and the archive tier.
+
+The feed reads a document's activity newest first. ``before`` is the id of
+the oldest row the previous page covered, so every page starts with an
+index seek on (document, id) however far back it is.
+
+With aggregation on, consecutive rows of the same user and type less than
+``ACTIVITY_GROUP_GAP`` seconds apart are folded into one entry ("alice made
+140 edits between 10:02 and 10:40"). A page holds ``limit`` entries and
+never ends in the middle of a group, unless ``ACTIVITY_SCAN_MAX`` rows
+were read for it.
+
+``archive_activity`` moves rows older than a cutoff out of the
+``DocumentActivity`` table into gzipped JSON-lines files under
+``ACTIVITY_ARCHIVE_DIR``, one file per document and batch, indexed by
+``ActivityArchive``. When a page runs past the rows left in the table, the
+feed carries on into the archive files, newest first.
+"""
+import gzip
+import json
+import logging
+import os
+import shutil
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ActivityArchive, DocumentActivity
+
+logger = logging.getLogger(__name__)
+
+ROW_FIELDS = ('id', 'user_id', 'user__username', 'activity_type', 'description', 'created_at')
+
+# How a group of n activities of a type is summarized
+GROUP_PHRASES = {
+    'edit': 'made {n} edits',
+    'comment': 'added {n} comments',
+    'share': 'shared the document {n} times',
+    'join': 'joined {n} times',
+    'leave': 'left {n} times',
+}
+
+
+def archive_root():
+    return Path(getattr(settings, 'ACTIVITY_ARCHIVE_DIR', 'activity_archive'))
+
+
+def as_row(values):
+    """A feed row from ``values()`` of DocumentActivity or an archived line"""
+    created_at = values['created_at']
+    if isinstance(created_at, str):
+        created_at = parse_datetime(created_at)
+    return {
+        'id': values['id'],
+        'user_id': values['user_id'],
+        'username': values.get('username', values.get('user__username')),
+        'activity_type': values['activity_type'],
+        'description': values['description'],
+        'created_at': created_at,
+    }
+
+
+def read_archive(archive):
+    """Rows of an archive file, oldest first"""
+    with gzip.open(archive_root() / archive.path, 'rt', encoding='utf-8') as f:
+        return [as_row(json.loads(line)) for line in f if line.strip()]
+
+
+def iter_rows(document_id, before=None, batch_size=200):
+    """A document's activity rows newest first: the table, then its archive files"""
+    cursor = before
+    while True:
+        rows = DocumentActivity.objects.filter(document_id=document_id)
+        if cursor is not None:
+            rows = rows.filter(id__lt=cursor)
+        batch = list(rows.order_by('-id').values(*ROW_FIELDS)[:batch_size])
+        for values in batch:
+            yield as_row(values)
+        if len(batch) < batch_size:
+            break
+        cursor = batch[-1]['id']
+
+    archives = ActivityArchive.objects.filter(document_id=document_id)
+    if before is not None:
+        archives = archives.filter(first_id__lt=before)
+    for archive in archives.order_by('-last_id').iterator():
+        try:
+            rows = read_archive(archive)
+        except OSError as e:
+            logger.warning('Reading activity archive %s failed: %s', archive.path, e)
+            continue
+        for row in reversed(rows):
+            if before is None or row['id'] < before:
+                yield row
+
+
+def summarize(group):
+    """Description of a group of rows (newest first)"""
+    first, last = group[-1], group[0]
+    if len(group) == 1:
+        return first['description']
+    phrase = GROUP_PHRASES.get(first['activity_type'], 'had {n} ' + first['activity_type'] + ' activities')
+    started = timezone.localtime(first['created_at']).strftime('%H:%M')
+    ended = timezone.localtime(last['created_at']).strftime('%H:%M')
+    return f"{first['username']} {phrase.format(n=len(group))} between {started} and {ended}"
+
+
+def entry(group):
+    return {
+        'id': group[0]['id'],
+        'oldest_id': group[-1]['id'],
+        'username': group[0]['username'],
+        'user_id': group[0]['user_id'],
+        'activity_type': group[0]['activity_type'],
+        'count': len(group),
+        'first_at': group[-1]['created_at'],
+        'last_at': group[0]['created_at'],
+        'description': summarize(group),
+    }
+
+
+def feed(document_id, before=None, limit=20, aggregate=True):
+    """
+    One page of the feed: (entries, next cursor or None).
+
+    Without aggregation every row is its own entry.
+    """
+    gap = timedelta(seconds=getattr(settings, 'ACTIVITY_GROUP_GAP', 900))
+    scan_max = getattr(settings, 'ACTIVITY_SCAN_MAX', 5000)
+    entries = []
+    group = []
+    scanned = 0
+    rows = iter_rows(document_id, before)
+    for row in rows:
+        if group and aggregate and row['user_id'] == group[-1]['user_id'] \
+                and row['activity_type'] == group[-1]['activity_type'] \
+                and group[-1]['created_at'] - row['created_at'] <= gap:
+            group.append(row)
+        else:
+            if group:
+                entries.append(entry(group))
+            if len(entries) == limit:
+                # ``row`` starts the next page
+                rows.close()
+                return entries, entries[-1]['oldest_id']
+            group = [row]
+        scanned += 1
+        if scanned >= scan_max:
+            # Cut the group short rather than read without bound
+            entries.append(entry(group))
+            rows.close()
+            return entries, entries[-1]['oldest_id']
+    if group:
+        entries.append(entry(group))
+    return entries, None
+
+
+def write_archive(path, rows):
+    """Write ``rows`` gzipped, atomically: a crash leaves no partial file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb') as f:
+            for row in rows:
+                f.write(json.dumps(row, cls=DjangoJSONEncoder, separators=(',', ':')).encode('utf-8'))
+                f.write(b'\n')
+        raw.flush()
+        os.fsync(raw.fileno())
+    os.replace(tmp, path)
+
+
+def archive_document(document_id, cutoff, batch_size=5000):
+    """Archive a document's rows created before ``cutoff``; returns the number moved"""
+    moved = 0
+    while True:
+        rows = list(
+            DocumentActivity.objects.filter(document_id=document_id, created_at__lt=cutoff)
+            .order_by('id').values(*ROW_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return moved
+        first, last = rows[0], rows[-1]
+        relative = Path(str(document_id)) / f"{first['id']:012d}-{last['id']:012d}.jsonl.gz"
+        write_archive(archive_root() / relative, [as_row(row) for row in rows])
+        # The file is complete before the rows go; a crash in between only
+        # leaves a file no ActivityArchive points at, rewritten next run
+        with transaction.atomic():
+            ActivityArchive.objects.create(
+                document_id=document_id,
+                path=str(relative),
+                first_id=first['id'],
+                last_id=last['id'],
+                first_at=first['created_at'],
+                last_at=last['created_at'],
+                row_count=len(rows),
+            )
+            DocumentActivity.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        moved += len(rows)
+
+
+def archive_activity(cutoff, batch_size=5000):
+    """Archive every document's activity older than ``cutoff``; returns (documents, rows)"""
+    document_ids = list(
+        DocumentActivity.objects.filter(created_at__lt=cutoff).order_by()
+        .values_list('document_id', flat=True).distinct()
+    )
+    moved = 0
+    for document_id in document_ids:
+        moved += archive_document(document_id, cutoff, batch_size)
+    return len(document_ids), moved
+
+
+def drop_archives(document_id):
+    """Delete a deleted document's archive files"""
+    shutil.rmtree(archive_root() / str(document_id), ignore_errors=True)
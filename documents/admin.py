@@ -1,17 +1,47 @@
 from django.contrib import admin
-from .models import Document, DocumentPermission, DocumentVersion, DocumentComment, UserPresence, DocumentActivity
+from .acl import rebuild
+from .models import (
+    Document, DocumentPermission, DocumentVersion, DocumentComment, UserPresence, DocumentActivity, DocumentStats,
+    DocumentGroupPermission, DocumentACL, ImportJob, ContentBlob, DocumentTemplate,
+)
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('title', 'owner', 'created_at', 'updated_at', 'is_public')
-    list_filter = ('created_at', 'is_public')
+    list_display = ('title', 'owner', 'created_at', 'updated_at', 'is_public', 'storage_mode')
+    list_filter = ('created_at', 'is_public', 'storage_mode')
     search_fields = ('title', 'owner__username')
 
+class RebuildACLMixin:
+    """Grants edited here don't go through acl.grant: rebuild the document's ACL"""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        rebuild([obj.document_id])
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rebuild([obj.document_id])
+
+    def delete_queryset(self, request, queryset):
+        document_ids = list(queryset.values_list('document_id', flat=True))
+        super().delete_queryset(request, queryset)
+        rebuild(document_ids)
+
 @admin.register(DocumentPermission)
-class DocumentPermissionAdmin(admin.ModelAdmin):
+class DocumentPermissionAdmin(RebuildACLMixin, admin.ModelAdmin):
     list_display = ('document', 'user', 'permission', 'created_at')
     list_filter = ('permission', 'created_at')
 
+@admin.register(DocumentGroupPermission)
+class DocumentGroupPermissionAdmin(RebuildACLMixin, admin.ModelAdmin):
+    list_display = ('document', 'group', 'permission', 'created_at')
+    list_filter = ('permission', 'created_at')
+
+@admin.register(DocumentACL)
+class DocumentACLAdmin(admin.ModelAdmin):
+    list_display = ('document', 'user', 'permission')
+    list_filter = ('permission',)
+
 @admin.register(DocumentVersion)
 class DocumentVersionAdmin(admin.ModelAdmin):
     list_display = ('document', 'version_number', 'created_by', 'created_at')
@@ -30,3 +60,22 @@ class UserPresenceAdmin(admin.ModelAdmin):
 class DocumentActivityAdmin(admin.ModelAdmin):
     list_display = ('document', 'user', 'activity_type', 'created_at')
     list_filter = ('activity_type', 'created_at')
+
+@admin.register(DocumentStats)
+class DocumentStatsAdmin(admin.ModelAdmin):
+    list_display = ('document', 'version_count', 'comment_count', 'unresolved_comment_count',
+                    'collaborator_count', 'word_count', 'updated_at')
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'owner', 'kind', 'status', 'processed', 'total', 'created', 'failed', 'created_at')
+    list_filter = ('status', 'kind')
+
+@admin.register(DocumentTemplate)
+class DocumentTemplateAdmin(admin.ModelAdmin):
+    list_display = ('name', 'owner', 'is_public', 'created_at')
+    list_filter = ('is_public',)
+
+@admin.register(ContentBlob)
+class ContentBlobAdmin(admin.ModelAdmin):
+    list_display = ('hash', 'created_at')
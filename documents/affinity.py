@@ -0,0 +1,401 @@
+"""
+Room affinity: each document's live room is owned by one ASGI worker.
+
+Workers listed in ``ROOM_WORKERS`` heartbeat into the shared cache, and a
+consistent-hash ring over the live ones assigns every document an owner.
+The editor page points its websocket at the owner (``?worker=<id>``, which
+the load balancer routes on), and a client that lands elsewhere gets a
+``redirect`` frame. On the owner, room broadcasts are delivered to local
+members in-process; the channel layer is only used when members are
+connected to other workers (load balancer ignored the hint, or a hand-off
+is in progress). Those "forwarded" members announce themselves to the
+owner over a per-worker control group, and re-announce every heartbeat so
+a new owner learns about them after a hand-off.
+
+When workers join or leave, the ring changes: rooms that move away from a
+worker are handed off (members are flushed and redirected), and for a
+grace period every worker forwards through the channel layer so no member
+misses events while announcements catch up.
+"""
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+
+logger = logging.getLogger(__name__)
+
+
+def default_worker_id():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def worker_id():
+    """This process's id on the ring"""
+    return getattr(settings, 'WORKER_ID', None) or default_worker_id()
+
+
+def worker_group_name(worker):
+    """Channel layer group of a worker's control channel"""
+    return f'room_worker_{worker}'
+
+
+# Cache backends that live inside one process: heartbeats stored there are
+# invisible to the other workers
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def check_shared_cache():
+    """Refuse to start with room affinity on and a cache other workers can't see"""
+    if not getattr(settings, 'ROOM_AFFINITY', False):
+        return
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            f'ROOM_AFFINITY needs a cache shared by all ROOM_WORKERS (set CACHE_REDIS_URL), not {backend}: '
+            'every worker would only see its own heartbeat and treat every room as its own'
+        )
+
+
+class HashRing:
+    """Consistent-hash ring with ``replicas`` virtual nodes per worker"""
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self._keys = []
+        self._owners = {}
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.md5(str(value).encode('utf-8')).digest()[:8], 'big')
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            key = self.hash(f'{node}#{replica}')
+            self._owners[key] = node
+            bisect.insort(self._keys, key)
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.discard(node)
+        for replica in range(self.replicas):
+            key = self.hash(f'{node}#{replica}')
+            if self._owners.pop(key, None) is not None:
+                self._keys.remove(key)
+
+    def owner(self, key):
+        """The node owning ``key``, or None if the ring is empty"""
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, self.hash(key)) % len(self._keys)
+        return self._owners[self._keys[index]]
+
+
+class WorkerRegistry:
+    """Liveness of the configured workers, via heartbeat keys in the shared cache"""
+
+    def __init__(self, worker, candidates, ttl, include_self=True):
+        self.worker = worker
+        self.candidates = list(candidates)
+        self.ttl = ttl
+        self.include_self = include_self
+
+    @staticmethod
+    def key(worker):
+        return f'room_worker:{worker}'
+
+    def heartbeat(self):
+        cache.set(self.key(self.worker), time.time(), self.ttl)
+
+    def leave(self):
+        cache.delete(self.key(self.worker))
+
+    def live_workers(self):
+        alive = cache.get_many([self.key(worker) for worker in self.candidates])
+        workers = {worker for worker in self.candidates if self.key(worker) in alive}
+        if self.include_self and self.worker in self.candidates:
+            workers.add(self.worker)
+        else:
+            workers.discard(self.worker)
+        return workers
+
+
+class RoomRouter:
+    """
+    Ownership, local delivery and hand-off for document rooms on this worker.
+
+    Consumers register with ``join``/``leave`` and broadcast through
+    ``broadcast``; a consumer must implement ``handoff(new_owner)``. With
+    ``ROOM_AFFINITY`` off every broadcast is a plain ``group_send``.
+    """
+
+    def __init__(self, worker=None, channel_layer=None):
+        self._worker = worker
+        self._channel_layer = channel_layer
+        self.rooms = {}
+        # str(document_id) -> {worker: expiry} of workers with forwarded members
+        self.remote = {}
+        self.ring = None
+        self.refreshed_at = 0
+        self.grace_until = 0
+        # Rooms whose ownership moved away in a ring change, with the new owner
+        self.pending_handoffs = {}
+        self.control_channel = None
+        self._tasks = []
+        # Set once this worker has left the ring (drain / shutdown)
+        self.stopped = False
+
+    @property
+    def worker(self):
+        if self._worker is None:
+            self._worker = worker_id()
+        return self._worker
+
+    @property
+    def channel_layer(self):
+        if self._channel_layer is None:
+            self._channel_layer = get_channel_layer()
+        return self._channel_layer
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'ROOM_AFFINITY', False)
+
+    @property
+    def interval(self):
+        return getattr(settings, 'ROOM_HEARTBEAT_INTERVAL', 10)
+
+    def registry(self):
+        return WorkerRegistry(
+            self.worker,
+            getattr(settings, 'ROOM_WORKERS', []),
+            ttl=self.interval * 3,
+            include_self=not self.stopped,
+        )
+
+    def refresh_ring(self):
+        """Heartbeat and rebuild the ring from live workers; returns True if membership changed"""
+        registry = self.registry()
+        if self.worker in registry.candidates and not self.stopped:
+            registry.heartbeat()
+        workers = registry.live_workers()
+        self.refreshed_at = time.monotonic()
+        if self.ring is not None and self.ring.nodes == workers:
+            return False
+        previous, self.ring = self.ring, HashRing(sorted(workers))
+        self.grace_until = time.monotonic() + self.interval * 3
+        if previous is not None:
+            for document_id in self.rooms:
+                new_owner = self.ring.owner(document_id)
+                if previous.owner(document_id) == self.worker and new_owner != self.worker:
+                    self.pending_handoffs[document_id] = new_owner
+        return True
+
+    def owner(self, document_id):
+        if not self.enabled:
+            return self.worker
+        if self.ring is None or time.monotonic() - self.refreshed_at >= self.interval:
+            self.refresh_ring()
+        return self.ring.owner(document_id)
+
+    def is_owner(self, document_id):
+        return self.owner(document_id) == self.worker
+
+    def should_redirect(self, document_id, hint):
+        """
+        True if a client connecting here should move to the owner.
+
+        A hint naming another worker means the load balancer did not honour
+        it; redirecting again would loop, so such clients stay as forwarded
+        members.
+        """
+        if not self.enabled:
+            return False
+        owner = self.owner(document_id)
+        if owner is None or owner == self.worker:
+            return False
+        return not hint or hint == self.worker
+
+    def has_remote_members(self, document_id):
+        if time.monotonic() < self.grace_until:
+            return True
+        now = time.monotonic()
+        workers = self.remote.get(str(document_id))
+        if not workers:
+            return False
+        for worker, expires in list(workers.items()):
+            if expires < now:
+                del workers[worker]
+        if not workers:
+            self.remote.pop(str(document_id), None)
+        return bool(workers)
+
+    async def start(self):
+        """Join the control group and start heartbeats (idempotent)"""
+        if not self.enabled or self._tasks or self.stopped:
+            return
+        self.refresh_ring()
+        self.control_channel = await self.channel_layer.new_channel()
+        await self.channel_layer.group_add(worker_group_name(self.worker), self.control_channel)
+        self._tasks = [
+            asyncio.ensure_future(self._control_loop()),
+            asyncio.ensure_future(self._maintenance_loop()),
+        ]
+
+    async def stop(self):
+        """Leave the ring; other workers take over this worker's rooms"""
+        self.stopped = True
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self.control_channel is not None:
+            await self.channel_layer.group_discard(worker_group_name(self.worker), self.control_channel)
+            self.control_channel = None
+        if self.enabled:
+            self.registry().leave()
+            self.refresh_ring()
+
+    async def join(self, consumer):
+        await self.start()
+        document_id = consumer.document_id
+        self.rooms.setdefault(document_id, set()).add(consumer)
+        if self.enabled and not self.is_owner(document_id):
+            await self.announce(document_id, 'room.member_join')
+
+    async def leave(self, consumer):
+        document_id = consumer.document_id
+        members = self.rooms.get(document_id)
+        if members is None:
+            return
+        members.discard(consumer)
+        if not members:
+            del self.rooms[document_id]
+            if self.enabled and not self.is_owner(document_id):
+                await self.announce(document_id, 'room.member_leave')
+
+    def forget(self, document_id):
+        """Drop what this worker knows about a room nobody here uses any more"""
+        self.remote.pop(str(document_id), None)
+        self.pending_handoffs.pop(document_id, None)
+
+    def prune_remote(self):
+        """Drop forwarded-member entries whose announcements stopped"""
+        now = time.monotonic()
+        for document_id, workers in list(self.remote.items()):
+            for worker, expires in list(workers.items()):
+                if expires < now:
+                    del workers[worker]
+            if not workers:
+                del self.remote[document_id]
+
+    def local_members(self, document_id):
+        return list(self.rooms.get(document_id, ()))
+
+    async def broadcast(self, document_id, group, event):
+        """
+        Deliver a group event to every member of a room.
+
+        On the owner, local members get it in-process and the channel layer
+        copy (marked ``delivered_by`` so local members skip it) is only sent
+        if other workers have members.
+        """
+        if not self.enabled or not self.is_owner(document_id):
+            await self.channel_layer.group_send(group, event)
+            return
+        for member in self.local_members(document_id):
+            try:
+                await member.dispatch(event)
+            except Exception as e:
+                logger.warning('Local delivery to %s failed: %s', member.channel_name, e)
+        if self.has_remote_members(document_id):
+            await self.channel_layer.group_send(group, dict(event, delivered_by=self.worker))
+
+    def delivered_locally(self, event):
+        """True for channel layer copies of events this worker already delivered"""
+        return event.get('delivered_by') == self.worker
+
+    async def announce(self, document_id, message_type):
+        owner = self.owner(document_id)
+        if owner is None or owner == self.worker:
+            return
+        try:
+            await self.channel_layer.group_send(worker_group_name(owner), {
+                'type': message_type,
+                'document_id': document_id,
+                'worker': self.worker,
+            })
+        except Exception as e:
+            logger.warning('Announcing room %s to %s failed: %s', document_id, owner, e)
+
+    async def _control_loop(self):
+        while True:
+            try:
+                message = await self.channel_layer.receive(self.control_channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Room control channel failed: %s', e)
+                await asyncio.sleep(1)
+                continue
+            self.handle_control(message)
+
+    def handle_control(self, message):
+        document_id = str(message.get('document_id'))
+        worker = message.get('worker')
+        if message.get('type') == 'room.member_join':
+            expires = time.monotonic() + self.interval * 3
+            self.remote.setdefault(document_id, {})[worker] = expires
+        elif message.get('type') == 'room.member_leave':
+            workers = self.remote.get(document_id, {})
+            workers.pop(worker, None)
+            if not workers:
+                self.remote.pop(document_id, None)
+
+    async def _maintenance_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.maintain()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Room maintenance failed: %s', e)
+
+    async def maintain(self):
+        """Heartbeat, hand off rooms this worker no longer owns, re-announce forwarded ones"""
+        self.refresh_ring()
+        self.prune_remote()
+        handoffs, self.pending_handoffs = self.pending_handoffs, {}
+        for document_id, new_owner in handoffs.items():
+            await self.handoff(document_id, new_owner)
+        for document_id in list(self.rooms):
+            if not self.is_owner(document_id):
+                await self.announce(document_id, 'room.member_join')
+
+    async def handoff(self, document_id, new_owner):
+        logger.info('Handing off room %s to %s', document_id, new_owner)
+        for member in self.local_members(document_id):
+            try:
+                await member.handoff(new_owner)
+            except Exception as e:
+                logger.warning('Hand-off of %s failed: %s', member.channel_name, e)
+
+
+room_router = RoomRouter()
@@ -0,0 +1,231 @@
+"""
+Comment anchors that follow the text they point at.
+
+A comment's ``position`` is a character offset into the document's text,
+the same offsets the editor's caret positions count. When an edit is
+applied, the span that changed between the previous and the new text is
+found (longest common prefix and suffix) and every anchor of the document
+is moved in one pass: anchors before the span stay, anchors after it shift
+by the change in length, anchors inside it move to its start. Positions
+the client sends refer to the text it had, which is the text the room's
+edits have reached when the comment is handled.
+
+Anchors of active rooms are kept in memory on the worker that applies the
+room's edits, and the ones that moved are written back in one bulk update
+every ``COMMENT_ANCHOR_FLUSH_INTERVAL`` seconds, and when the room is
+evicted or the worker drains. ``anchor_revision`` records the document
+revision a stored position refers to; a worker never overwrites positions
+stored for a newer revision than its own, and reloads the room instead.
+"""
+import asyncio
+import logging
+import re
+from html import unescape
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Case, IntegerField, Value, When
+
+from . import blocks as block_storage
+from .buffering import edit_buffer
+from .models import Document, DocumentComment
+from .rendering import node_text
+
+logger = logging.getLogger(__name__)
+
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def anchor_text(content):
+    """The text caret offsets count: the editor's textContent"""
+    if isinstance(content, str):
+        return unescape(TAG_RE.sub('', content))
+    if isinstance(content, dict):
+        return node_text(content)
+    return ''
+
+
+def common_prefix(old, new):
+    """Length of the longest common prefix, by bisecting on C-level slice compares"""
+    low, high = 0, min(len(old), len(new))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if old[:middle] == new[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def changed_span(old, new):
+    """(start, old_end, new_end) of the edited region, or None if the texts are equal"""
+    if old == new:
+        return None
+    start = common_prefix(old, new)
+    limit = min(len(old), len(new)) - start
+    suffix = common_prefix(old[::-1][:limit], new[::-1][:limit])
+    return start, len(old) - suffix, len(new) - suffix
+
+
+def rebase(position, span):
+    """An anchor at an insertion point stays with the text after it"""
+    start, old_end, new_end = span
+    if position < start:
+        return position
+    if position >= old_end:
+        return position + new_end - old_end
+    return start
+
+
+class RoomAnchors:
+    __slots__ = ('text', 'revision', 'positions', 'dirty')
+
+    def __init__(self, text, revision, positions):
+        self.text = text
+        self.revision = revision
+        # comment id -> position
+        self.positions = positions
+        # comment ids whose position hasn't been written back
+        self.dirty = set()
+
+
+def load_anchors(document_id):
+    row = Document.objects.filter(id=document_id).values_list('storage_mode', 'revision').first()
+    if row is None:
+        return None
+    storage_mode, revision = row
+    text = anchor_text(block_storage.current_content(document_id, storage_mode))
+    positions = dict(DocumentComment.objects.filter(document_id=document_id).values_list('id', 'position'))
+    return RoomAnchors(text, revision, positions)
+
+
+def store_anchors(positions, revision, batch_size=500):
+    """
+    Write anchor positions rebased to ``revision``; returns how many were written.
+
+    Rows already rebased to a newer revision, by a worker that saw more
+    edits, are left alone.
+    """
+    items = list(positions.items())
+    written = 0
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        written += DocumentComment.objects.filter(
+            id__in=[comment_id for comment_id, _ in batch], anchor_revision__lte=revision,
+        ).update(
+            position=Case(
+                *[When(id=comment_id, then=Value(position)) for comment_id, position in batch],
+                output_field=IntegerField(),
+            ),
+            anchor_revision=revision,
+        )
+    return written
+
+
+class AnchorTracker:
+    def __init__(self):
+        self.rooms = {}
+        self._task = None
+
+    @property
+    def interval(self):
+        return getattr(settings, 'COMMENT_ANCHOR_FLUSH_INTERVAL', 5)
+
+    async def track(self, document_id):
+        """Start tracking a room before its first edit is applied"""
+        if document_id in self.rooms:
+            return
+        self.start()
+        room = await database_sync_to_async(load_anchors)(document_id)
+        if room is None:
+            return
+        buffered = edit_buffer.documents.get(document_id)
+        if buffered is not None and buffered.revision > room.revision:
+            # Edits not yet flushed are the text the next edit applies to
+            room.text, room.revision = anchor_text(buffered.content), buffered.revision
+        self.rooms.setdefault(document_id, room)
+
+    def edited(self, document_id, content, revision):
+        """Move the room's anchors through an applied edit"""
+        room = self.rooms.get(document_id)
+        if room is None:
+            return
+        try:
+            text = anchor_text(content)
+        except Exception as e:
+            # Malformed content: the edit is already saved and must still be
+            # broadcast. Reload the anchors from the database next time
+            logger.warning('Comment anchors of document %s not moved: %s', document_id, e)
+            del self.rooms[document_id]
+            return
+        if revision is not None and room.revision is not None and revision != room.revision + 1:
+            # A write this worker didn't see (e.g. a restore): anchors can't
+            # be moved through it, start again from the new text
+            logger.info('Anchors of document %s skipped revisions %s..%s', document_id, room.revision, revision)
+        else:
+            span = changed_span(room.text, text)
+            if span is not None:
+                for comment_id, position in room.positions.items():
+                    moved = rebase(position, span)
+                    if moved != position:
+                        room.positions[comment_id] = moved
+                        room.dirty.add(comment_id)
+        room.text, room.revision = text, revision
+
+    def added(self, document_id, comment_id, position):
+        room = self.rooms.get(document_id)
+        if room is not None:
+            room.positions[comment_id] = position
+            room.dirty.add(comment_id)
+
+    def position(self, document_id, comment_id, default=None):
+        room = self.rooms.get(document_id)
+        if room is None:
+            return default
+        return room.positions.get(comment_id, default)
+
+    async def flush(self, document_id):
+        room = self.rooms.get(document_id)
+        if room is None or not room.dirty:
+            return
+        dirty, room.dirty = room.dirty, set()
+        positions = {comment_id: room.positions[comment_id] for comment_id in dirty if comment_id in room.positions}
+        try:
+            written = await database_sync_to_async(store_anchors)(positions, room.revision)
+        except Exception:
+            room.dirty |= dirty
+            raise
+        if written < len(positions) and self.rooms.get(document_id) is room:
+            # Another worker stored newer positions (or the comments are
+            # gone): reload from the database before the next edit
+            del self.rooms[document_id]
+
+    async def flush_all(self):
+        for document_id in [d for d, room in self.rooms.items() if room.dirty]:
+            try:
+                await self.flush(document_id)
+            except Exception as e:
+                logger.warning('Storing comment anchors of document %s failed: %s', document_id, e)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Comment anchor flush failed: %s', e)
+
+    def forget(self, document_id):
+        """Drop an evicted room's anchors (flushed first by the lifecycle manager)"""
+        room = self.rooms.get(document_id)
+        if room is not None and not room.dirty:
+            del self.rooms[document_id]
+
+
+anchor_tracker = AnchorTracker()
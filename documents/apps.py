@@ -3,3 +3,9 @@ from django.apps import AppConfig
 class DocumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'documents'
+
+    def ready(self):
+        from . import acl, affinity, replicas
+        acl.connect()
+        affinity.check_shared_cache()
+        replicas.check_shared_cache()
@@ -0,0 +1,53 @@
+"""
+MySQL backend that borrows connections from a process-wide pool.
+
+Use it as the ``ENGINE`` with ``CONN_MAX_AGE = 0``: Django then "closes"
+the connection after every request and every ``database_sync_to_async``
+call, which returns it to the pool instead of hanging up. Pool options go
+in the database's ``POOL`` dict (``size``, ``max_overflow``, ``timeout``,
+``recycle``, ``ping_after``); see ``documents.backends.pool``.
+"""
+from functools import partial
+
+from django.db.backends.mysql import base as mysql
+from django.utils.asyncio import async_unsafe
+
+from ..pool import ConnectionPool, get_pool
+
+
+def ping(connection):
+    connection.ping()
+
+
+def reset(connection):
+    # Don't hand the next thread an open transaction
+    connection.rollback()
+
+
+class DatabaseWrapper(mysql.DatabaseWrapper):
+    def pool(self, conn_params):
+        return get_pool(self.alias, lambda: ConnectionPool(
+            partial(mysql.DatabaseWrapper.get_new_connection, self, conn_params),
+            ping=ping,
+            reset=reset,
+            name=self.alias,
+            **self.settings_dict.get('POOL', {})
+        ))
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        connection, self.fresh_connection = self.pool(conn_params).acquire()
+        return connection
+
+    def init_connection_state(self):
+        # Session settings survive in the pool; only new connections need them
+        if getattr(self, 'fresh_connection', True):
+            super().init_connection_state()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # Abandoned mid-transaction or broken: don't put it back
+        discard = self.in_atomic_block or (self.errors_occurred and not self.is_usable())
+        with self.wrap_database_errors:
+            get_pool(self.alias, None).release(self.connection, discard=discard)
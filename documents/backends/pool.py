@@ -0,0 +1,174 @@
+"""
+Process-wide database connection pool.
+
+Django opens one connection per thread and, with ``CONN_MAX_AGE = 0``,
+closes it after every request and every ``database_sync_to_async`` call.
+Under a join storm that is a TCP + auth handshake per query batch. The pool
+keeps up to ``size`` idle connections per database alias and hands them to
+whichever thread asks next; up to ``max_overflow`` more are opened under
+load and closed again when returned.
+
+Connections are health-checked when checked out: one idle for longer than
+``ping_after`` seconds is pinged, one older than ``recycle`` seconds is
+replaced. A caller that finds the pool exhausted waits up to ``timeout``
+seconds; waits are recorded for ``stats()`` and the worker stats endpoint.
+"""
+import logging
+import threading
+import time
+from collections import deque
+
+from ..metrics import metrics
+from ..scheduler import LatencyStats
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(Exception):
+    """No connection was free within the pool timeout"""
+
+
+class ConnectionPool:
+    def __init__(self, connect, ping=None, reset=None, size=10, max_overflow=10,
+                 timeout=5, recycle=3600, ping_after=30, name='default'):
+        self.connect = connect
+        self.ping = ping
+        self.reset = reset
+        self.size = size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.ping_after = ping_after
+        self.name = name
+        self.lock = threading.Condition()
+        # (connection, returned_at), most recently returned last
+        self.idle = deque()
+        # id(connection) -> opened_at, for connections open or checked out
+        self.opened_at = {}
+        # Connections open or being opened; never above size + max_overflow
+        self.slots = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.waits = LatencyStats(size=2048)
+
+    def acquire(self):
+        """Check out a connection, opening one if none is idle; returns (connection, fresh)"""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self.lock:
+            while not self.idle and self.slots >= self.size + self.max_overflow:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    metrics.incr('db_pool_timeouts', alias=self.name)
+                    raise PoolTimeout(f'No {self.name} database connection free after {self.timeout}s')
+                self.lock.wait(remaining)
+            if self.idle:
+                connection, returned_at = self.idle.pop()
+            else:
+                connection = returned_at = None
+                self.slots += 1
+            self.in_use += 1
+            self.checkouts += 1
+        wait = time.monotonic() - started
+        self.waits.record(wait, 0)
+        if wait >= 0.001:
+            metrics.incr('db_pool_waits', alias=self.name)
+
+        try:
+            if connection is not None and self.healthy(connection, returned_at):
+                return connection, False
+            if connection is not None:
+                self.discard(connection)
+            connection = self.connect()
+        except Exception:
+            with self.lock:
+                self.slots -= 1
+                self.in_use -= 1
+                self.lock.notify()
+            raise
+        with self.lock:
+            self.opened_at[id(connection)] = time.monotonic()
+        metrics.incr('db_pool_connects', alias=self.name)
+        return connection, True
+
+    def healthy(self, connection, returned_at):
+        """False if ``connection`` is too old to reuse or fails its ping"""
+        now = time.monotonic()
+        if now - self.opened_at.get(id(connection), now) >= self.recycle:
+            return False
+        if self.ping is None or now - returned_at < self.ping_after:
+            return True
+        try:
+            self.ping(connection)
+            return True
+        except Exception as e:
+            logger.info('Dropping dead %s database connection: %s', self.name, e)
+            return False
+
+    def release(self, connection, discard=False):
+        """Return a checked-out connection; ``discard`` closes it instead"""
+        if not discard and self.reset is not None:
+            try:
+                self.reset(connection)
+            except Exception as e:
+                logger.info('Dropping %s database connection that failed to reset: %s', self.name, e)
+                discard = True
+        with self.lock:
+            self.in_use -= 1
+            # Overflow connections are closed once the rush is over
+            keep = not discard and len(self.idle) < self.size
+            if keep:
+                self.idle.append((connection, time.monotonic()))
+            else:
+                self.slots -= 1
+            self.lock.notify()
+        if not keep:
+            self.discard(connection)
+
+    def discard(self, connection):
+        with self.lock:
+            self.opened_at.pop(id(connection), None)
+            self.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self.lock:
+            stats = {
+                'size': self.size,
+                'max_overflow': self.max_overflow,
+                'open': self.slots,
+                'idle': len(self.idle),
+                'in_use': self.in_use,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'discarded': self.discarded,
+            }
+        stats['wait_p50_ms'] = round(LatencyStats.percentile(self.waits.waits, 0.5) * 1000, 2)
+        stats['wait_p95_ms'] = round(LatencyStats.percentile(self.waits.waits, 0.95) * 1000, 2)
+        return stats
+
+
+# alias -> ConnectionPool, shared by every thread of the process
+pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, factory):
+    """The pool of database ``alias``, created with ``factory()`` on first use"""
+    pool = pools.get(alias)
+    if pool is None:
+        with _pools_lock:
+            pool = pools.get(alias)
+            if pool is None:
+                pool = pools[alias] = factory()
+    return pool
+
+
+def pool_stats():
+    return {alias: pool.stats() for alias, pool in pools.items()}
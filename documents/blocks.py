@@ -0,0 +1,225 @@
+"""
+Block-level chunked storage for large documents.
+
+Documents with ``storage_mode='blocks'`` keep their top-level Tiptap nodes
+as ordered ``DocumentBlock`` rows with stable ids. A save diffs the incoming
+blocks against the stored hashes and writes only inserted, modified and
+moved blocks. ``Document.content`` stays as a materialized copy that is
+refreshed at most every ``BLOCK_MATERIALIZE_INTERVAL`` seconds per worker
+and when the last editor leaves, so existing readers keep working.
+"""
+import time
+import uuid
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, JSONField, When
+from django.utils import timezone
+
+from .hashing import content_hash
+from .models import Document, DocumentBlock
+
+# Per-worker time of the last materialization of each block-mode document
+_last_materialized = {}
+
+
+def split_blocks(content):
+    """Top-level nodes of a Tiptap doc, or None if ``content`` can't be chunked"""
+    if isinstance(content, dict) and content.get('type') == 'doc':
+        blocks = content.get('content') or []
+        if isinstance(blocks, list) and all(isinstance(block, dict) for block in blocks):
+            return blocks
+    return None
+
+
+def join_blocks(blocks):
+    return {'type': 'doc', 'content': list(blocks)}
+
+
+def plan_blocks(existing, blocks):
+    """
+    Match incoming ``blocks`` to ``existing`` (block_id, position, hash) rows.
+
+    Unchanged blocks keep their id wherever they moved to. A changed block
+    reuses the id of the unmatched block that followed its predecessor (or,
+    failing that, sat at the same index), so an edit below an insertion
+    still updates the original row. Returns (creates, updates, moves,
+    deletes): lists of DocumentBlock field dicts for the first three and of
+    block ids for the last.
+    """
+    hashes = [content_hash(block) for block in blocks]
+    by_hash = defaultdict(deque)
+    for block_id, position, digest in existing:
+        by_hash[digest].append((block_id, position))
+
+    assigned = [None] * len(blocks)
+    used = set()
+    for index, digest in enumerate(hashes):
+        if by_hash[digest]:
+            assigned[index] = by_hash[digest].popleft()
+            used.add(assigned[index][0])
+
+    free_by_position = {position: block_id for block_id, position, _ in existing if block_id not in used}
+    creates, updates, moves = [], [], []
+    previous_position = -1
+    for index, (block, digest) in enumerate(zip(blocks, hashes)):
+        if assigned[index] is not None:
+            block_id, previous_position = assigned[index]
+            if previous_position != index:
+                moves.append({'block_id': block_id, 'position': index})
+            continue
+        fields = {'position': index, 'content': block, 'content_hash': digest}
+        for candidate in (previous_position + 1, index):
+            block_id = free_by_position.pop(candidate, None)
+            if block_id is not None:
+                previous_position = candidate
+                used.add(block_id)
+                updates.append(dict(fields, block_id=block_id))
+                break
+        else:
+            creates.append(dict(fields, block_id=uuid.uuid4().hex))
+
+    deletes = [block_id for block_id, _, _ in existing if block_id not in used]
+    return creates, updates, moves, deletes
+
+
+def save_blocks(document_id, blocks, digest=None):
+    """
+    Write only the blocks that changed; returns the number of rows touched.
+
+    ``digest`` is the content hash of the whole document, recorded on the
+    Document row so change detection works before the next materialization.
+    """
+    with transaction.atomic():
+        rows = DocumentBlock.objects.filter(document_id=document_id).values_list(
+            'id', 'block_id', 'position', 'content_hash'
+        )
+        pks = {}
+        existing = []
+        for pk, block_id, position, stored_hash in rows:
+            pks[block_id] = pk
+            existing.append((block_id, position, stored_hash))
+        creates, updates, moves, deletes = plan_blocks(existing, blocks)
+
+        if deletes:
+            DocumentBlock.objects.filter(document_id=document_id, block_id__in=deletes).delete()
+        if creates:
+            DocumentBlock.objects.bulk_create([
+                DocumentBlock(document_id=document_id, **fields) for fields in creates
+            ])
+        if updates:
+            DocumentBlock.objects.bulk_update([
+                DocumentBlock(id=pks[fields['block_id']], document_id=document_id, **fields)
+                for fields in updates
+            ], ['position', 'content', 'content_hash'])
+        if moves:
+            DocumentBlock.objects.bulk_update([
+                DocumentBlock(id=pks[fields['block_id']], **fields) for fields in moves
+            ], ['position'])
+        touched = len(creates) + len(updates) + len(moves) + len(deletes)
+        if touched:
+            fields = {'updated_at': timezone.now()}
+            if digest is not None:
+                fields['content_hash'] = digest
+            Document.objects.filter(id=document_id).update(**fields)
+    return touched
+
+
+def load_blocks(document_id, start=0, stop=None):
+    """Block contents of ``document_id`` in order, optionally a [start, stop) slice"""
+    queryset = DocumentBlock.objects.filter(document_id=document_id, position__gte=start)
+    if stop is not None:
+        queryset = queryset.filter(position__lt=stop)
+    return list(queryset.order_by('position').values_list('content', flat=True))
+
+
+def iter_block_chunks(document_id, start, chunk_size):
+    """Yield the blocks from ``start`` on in lists of at most ``chunk_size``"""
+    queryset = DocumentBlock.objects.filter(
+        document_id=document_id, position__gte=start
+    ).order_by('position').values_list('content', flat=True)
+    chunk = []
+    for block in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(block)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def inline_content():
+    """
+    Expression for a non-block document's content: the shared ContentBlob
+    of a copy-on-write clone that hasn't been edited, else ``content``
+    """
+    return Case(
+        When(blob_id=F('content_hash'), then=F('blob__content')),
+        default=F('content'),
+        output_field=JSONField(),
+    )
+
+
+def current_content(document_id, storage_mode):
+    """The live content of a document, assembled from blocks when needed"""
+    if storage_mode == 'blocks':
+        return join_blocks(load_blocks(document_id))
+    return Document.objects.values_list(inline_content(), flat=True).get(id=document_id)
+
+
+def materialize(document_id):
+    """Rebuild ``Document.content`` from the block table; returns the content"""
+    content = join_blocks(load_blocks(document_id))
+    Document.objects.filter(id=document_id).update(content=content, content_hash=content_hash(content))
+    _last_materialized[document_id] = time.monotonic()
+    return content
+
+
+def materialize_due(document_id):
+    """True if ``document_id`` has not been materialized on this worker recently"""
+    elapsed = time.monotonic() - _last_materialized.get(document_id, 0)
+    return elapsed >= settings.BLOCK_MATERIALIZE_INTERVAL
+
+
+def forget(document_id):
+    _last_materialized.pop(document_id, None)
+
+
+def drop_blocks(document_id):
+    """Discard the block table of ``document_id`` and return it to inline storage"""
+    with transaction.atomic():
+        DocumentBlock.objects.filter(document_id=document_id).delete()
+        Document.objects.filter(id=document_id).update(storage_mode='inline')
+    forget(document_id)
+
+
+def convert_to_blocks(document):
+    """Switch ``document`` to block storage; returns False if its content can't be chunked"""
+    content = current_content(document.id, 'inline') if document.shares_content else document.content
+    blocks = split_blocks(content)
+    if blocks is None:
+        return False
+    with transaction.atomic():
+        DocumentBlock.objects.filter(document=document).delete()
+        DocumentBlock.objects.bulk_create([
+            DocumentBlock(
+                document=document,
+                block_id=uuid.uuid4().hex,
+                position=index,
+                content=block,
+                content_hash=content_hash(block),
+            )
+            for index, block in enumerate(blocks)
+        ])
+        Document.objects.filter(id=document.id).update(storage_mode='blocks')
+    document.storage_mode = 'blocks'
+    return True
+
+
+def convert_to_inline(document):
+    """Switch ``document`` back to a single JSON column"""
+    with transaction.atomic():
+        document.content = materialize(document.id)
+        drop_blocks(document.id)
+    document.storage_mode = 'inline'
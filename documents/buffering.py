@@ -0,0 +1,281 @@
+"""
+Buffered document writes, made crash-safe by the edit journal.
+
+With ``EDIT_BUFFERING`` on, an accepted edit to an inline document is
+appended to this worker's journal and acknowledged once the record is
+durable. The latest content and revision are kept in memory, and the
+``Document`` row is written at most once every ``EDIT_FLUSH_INTERVAL``
+seconds per document instead of once per edit. After a flush the journal
+segments it covered are deleted. On startup the worker replays what is
+left of its journal before it accepts any edit.
+
+Buffering assumes that one worker writes each document: a single worker,
+or room affinity (``ROOM_AFFINITY``) with a stable ``WORKER_ID`` per worker
+so the journal is found again after a restart. Rooms are flushed before
+they are handed off, evicted or drained. A write made through another path
+while edits are buffered (a version restore) wins: the buffered edits are
+dropped at the next flush and the room's clients resync on their next
+edit. Block-mode documents are always written directly.
+"""
+import asyncio
+import logging
+from pathlib import Path
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import blocks as block_storage
+from .affinity import room_router
+from .caching import invalidate_document
+from .hashing import content_hash
+from .journal import EditJournal, replay_directory
+from .metrics import metrics
+from .models import Document
+from .scheduler import room_scheduler
+from .stats import record, set_word_count
+from .versions import create_version
+
+logger = logging.getLogger(__name__)
+
+
+class BufferedDocument:
+    __slots__ = (
+        'document_id', 'content', 'hash', 'revision', 'user',
+        'db_hash', 'db_revision', 'first_seq',
+    )
+
+    def __init__(self, document_id, content, digest, revision):
+        self.document_id = document_id
+        self.content = content
+        self.hash = self.db_hash = digest
+        self.revision = self.db_revision = revision
+        self.user = None
+        # First journal record not yet in the database, or None when clean
+        self.first_seq = None
+
+    @property
+    def dirty(self):
+        return self.first_seq is not None
+
+
+def load_buffered(document_id):
+    """Buffer state of an inline document, or None if it must be written directly"""
+    row = Document.objects.filter(id=document_id).values_list(
+        'storage_mode', block_storage.inline_content(), 'content_hash', 'revision'
+    ).first()
+    if row is None or row[0] == 'blocks':
+        return None
+    storage_mode, content, digest, revision = row
+    return BufferedDocument(document_id, content, digest, revision)
+
+
+def write_buffered(document_id, content, digest, revision, db_hash, user):
+    """
+    Write buffered content to the document row.
+
+    Returns ('flushed', revision) or, when the content was changed through
+    another path since it was buffered, ('superseded', revision) after
+    moving the revision past every buffered one.
+    """
+    with transaction.atomic():
+        row = Document.objects.select_for_update().filter(id=document_id).values_list(
+            'content_hash', 'revision'
+        ).first()
+        if row is None:
+            return 'missing', None
+        old_hash, current = row
+        if old_hash != db_hash:
+            new_revision = max(current, revision) + 1
+            Document.objects.filter(id=document_id).update(revision=new_revision)
+            return 'superseded', new_revision
+        # Read apart from the locking query, which would lock a clone's shared blob too
+        old_content = block_storage.current_content(document_id, 'inline')
+        new_revision = max(current, revision)
+        Document.objects.filter(id=document_id).update(
+            content=content,
+            content_hash=digest,
+            revision=new_revision,
+            updated_at=timezone.now(),
+        )
+    invalidate_document(document_id)
+    create_version(document_id, old_content, user, digest=old_hash or None)
+    record(set_word_count, document_id, content)
+    return 'flushed', new_revision
+
+
+class EditBuffer:
+    def __init__(self):
+        self.documents = {}
+        self.journal = None
+        self.flushes = 0
+        self._started = None
+        self._task = None
+
+    @property
+    def enabled(self):
+        return getattr(settings, 'EDIT_BUFFERING', False)
+
+    @property
+    def interval(self):
+        return getattr(settings, 'EDIT_FLUSH_INTERVAL', 2)
+
+    def journal_dir(self):
+        return Path(getattr(settings, 'EDIT_JOURNAL_DIR', 'journal')) / room_router.worker
+
+    async def start(self):
+        """Replay this worker's journal and open a new one (idempotent; runs on first connect)"""
+        if not self.enabled:
+            return
+        if self._started is None:
+            self._started = asyncio.ensure_future(self._start())
+        await asyncio.shield(self._started)
+
+    async def _start(self):
+        directory = self.journal_dir()
+        use_mmap = getattr(settings, 'EDIT_JOURNAL_MMAP', False)
+        try:
+            records, applied = await database_sync_to_async(replay_directory)(directory, use_mmap)
+            if records:
+                logger.info('Replayed %s journal records into %s documents', records, applied)
+        except Exception as e:
+            # Segments are kept and replayed on the next start
+            logger.error('Replaying journal %s failed: %s', directory, e)
+        self.journal = EditJournal(
+            directory,
+            segment_bytes=getattr(settings, 'EDIT_JOURNAL_SEGMENT_BYTES', 16 * 1024 * 1024),
+            fsync=getattr(settings, 'EDIT_JOURNAL_FSYNC', True),
+            fsync_interval=getattr(settings, 'EDIT_JOURNAL_FSYNC_INTERVAL', 0.005),
+            use_mmap=use_mmap,
+        )
+        self.journal.open()
+        self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def save(self, consumer, content, base_revision=None):
+        """
+        Buffer an edit the way ``DocumentConsumer.save_document`` writes one.
+
+        Returns the same status dict, or None if the document is not
+        buffered and the caller has to write it directly. Must run in the
+        room's scheduler turn, which orders it with the room's flushes.
+        """
+        if not self.enabled or self.journal is None:
+            return None
+        document_id = consumer.document_id
+        state = self.documents.get(document_id)
+        if state is None:
+            state = await database_sync_to_async(load_buffered)(document_id)
+            if state is None:
+                return None
+            self.documents[document_id] = state
+
+        digest = content_hash(content)
+        if digest == state.hash:
+            return {'status': 'unchanged', 'revision': state.revision}
+        if not consumer.is_current(base_revision, state.revision):
+            return {
+                'type': 'conflict',
+                'status': 'conflict',
+                'revision': state.revision,
+                'content': state.content,
+            }
+
+        revision = state.revision + 1
+        try:
+            seq = self.journal.append({
+                'document_id': state.document_id,
+                'revision': revision,
+                'hash': digest,
+                'base_hash': state.db_hash,
+                'user_id': consumer.user.id,
+                'content': content,
+            })
+            await self.journal.commit(seq)
+        except Exception as e:
+            logger.error('Journaling edit to document %s failed: %s', document_id, e)
+            return {'status': 'error', 'revision': None}
+
+        state.content, state.hash, state.revision = content, digest, revision
+        state.user = consumer.user
+        if state.first_seq is None:
+            state.first_seq = seq
+        consumer.own_revisions.append(revision)
+        metrics.incr('edits_buffered')
+        return {'status': 'saved', 'revision': revision}
+
+    def payload(self, document_id, payload, resume_revision=None):
+        """``payload`` for document_load, with buffered content that is newer than the row"""
+        state = self.documents.get(document_id)
+        if state is None or state.revision <= payload.get('revision', 0):
+            return payload
+        if resume_revision is not None and resume_revision == state.revision:
+            return {'title': payload['title'], 'revision': state.revision, 'unchanged': True}
+        return {'title': payload['title'], 'revision': state.revision, 'content': state.content}
+
+    async def flush(self, document_id):
+        """Write a document's buffered edits to the database, in the room's turn"""
+        state = self.documents.get(document_id)
+        if state is None or not state.dirty:
+            return
+        await room_scheduler.run(document_id, self._flush_state, state)
+
+    async def _flush_state(self, state):
+        # Saves to the room wait for this turn, so the state can't change meanwhile
+        if not state.dirty:
+            return
+        outcome, new_revision = await database_sync_to_async(write_buffered)(
+            state.document_id, state.content, state.hash, state.revision, state.db_hash, state.user
+        )
+        self.flushes += 1
+        metrics.incr('edit_buffer_flushes', outcome=outcome)
+        if outcome != 'flushed':
+            logger.warning('Buffered edits to document %s %s at revision %s', state.document_id, outcome, new_revision)
+            self.documents.pop(state.document_id, None)
+            return
+        state.db_hash = state.hash
+        state.revision = state.db_revision = new_revision
+        state.first_seq = None
+
+    async def flush_all(self):
+        for document_id in [d for d, state in self.documents.items() if state.dirty]:
+            try:
+                await self.flush(document_id)
+            except Exception as e:
+                logger.warning('Flushing buffered document %s failed: %s', document_id, e)
+        self.trim()
+
+    def trim(self):
+        """Delete journal segments every buffered document has flushed"""
+        if self.journal is None:
+            return
+        pending = [state.first_seq for state in self.documents.values() if state.dirty]
+        self.journal.trim(min(pending) if pending else self.journal.written_seq + 1)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Edit buffer flush failed: %s', e)
+
+    def forget(self, document_id):
+        """Drop a flushed document's state (evicted or handed off); dirty state is kept"""
+        state = self.documents.get(document_id)
+        if state is not None and not state.dirty:
+            del self.documents[document_id]
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'documents': len(self.documents),
+            'dirty': sum(1 for state in self.documents.values() if state.dirty),
+            'flushes': self.flushes,
+            'journal': self.journal.stats() if self.journal is not None else None,
+        }
+
+
+edit_buffer = EditBuffer()
@@ -0,0 +1,42 @@
+"""
+Cache keys and helpers for rendered document output.
+
+Rendered HTML is keyed by content hash, so identical content is rendered
+once and never goes stale. The small per-document metadata record (ETag,
+Last-Modified, title, hash) is what lets the public endpoint answer
+conditional GETs without touching the database; it is short-lived and
+explicitly invalidated by the write paths.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+
+def public_meta_key(document_id):
+    return f'public_document:{document_id}'
+
+
+def rendered_html_key(digest):
+    # v2: legacy HTML is sanitized; don't serve entries rendered before that
+    return f'rendered_html:v2:{digest}'
+
+
+def get_public_meta(document_id):
+    return cache.get(public_meta_key(document_id))
+
+
+def set_public_meta(document_id, meta):
+    cache.set(public_meta_key(document_id), meta, settings.PUBLIC_DOCUMENT_CACHE_TTL)
+
+
+def invalidate_document(document_id):
+    """Forget cached metadata for ``document_id`` after its content or visibility changed"""
+    cache.delete(public_meta_key(document_id))
+
+
+def get_rendered_html(digest):
+    return cache.get(rendered_html_key(digest))
+
+
+def get_or_render_html(digest, render):
+    """Return cached HTML for ``digest``, calling ``render()`` on a miss"""
+    return cache.get_or_set(rendered_html_key(digest), render, settings.RENDERED_HTML_CACHE_TTL)
@@ -0,0 +1,273 @@
+"""
+Local-first channel layer.
+
+``HybridChannelLayer`` wraps a network layer (channels_redis by default)
+and delivers to channels created in this process through in-memory queues,
+without serializing the message. Group membership of local channels is
+kept in process; the network layer only learns that *this process* has
+members of a group, through one relay channel per group. A ``group_send``
+reaches the local members directly and is published to the network layer
+only if another process has members of the group.
+
+Which processes have members of a group is tracked in a membership store
+(a Redis set per group), cached per process and refreshed immediately
+when a remote process announces its first member of a group. Only
+processes with members of the group hear that announcement, so the
+others don't cache "no remote members".
+
+Configure with::
+
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'documents.channel_layers.HybridChannelLayer',
+            'CONFIG': {
+                'inner': {'BACKEND': 'channels_redis.core.RedisChannelLayer', 'CONFIG': {...}},
+                'membership_url': 'redis://localhost:6379',
+            },
+        },
+    }
+"""
+import asyncio
+import logging
+import time
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Control message a process sends to a group's relays when it gains its
+# first member of the group; never delivered to consumers
+MEMBERSHIP_MESSAGE = 'hybrid.membership'
+
+
+class RedisMembershipStore:
+    """
+    Which processes have members of which group: one Redis set per group.
+
+    ``client`` is any object with the async ``sadd``/``srem``/``smembers``/
+    ``expire`` methods of ``redis.asyncio.Redis``; pass a stand-in to run
+    without a server.
+    """
+
+    def __init__(self, client=None, url=None, prefix='hybrid', expiry=86400):
+        if client is None:
+            import redis.asyncio
+            client = redis.asyncio.Redis.from_url(url or 'redis://localhost:6379')
+        self.client = client
+        self.prefix = prefix
+        self.expiry = expiry
+
+    def key(self, group):
+        return f'{self.prefix}:members:{group}'
+
+    async def add(self, group, process):
+        key = self.key(group)
+        await self.client.sadd(key, process)
+        await self.client.expire(key, self.expiry)
+
+    async def remove(self, group, process):
+        await self.client.srem(self.key(group), process)
+
+    async def members(self, group):
+        return {
+            member.decode('utf-8') if isinstance(member, bytes) else member
+            for member in await self.client.smembers(self.key(group))
+        }
+
+
+class HybridChannelLayer(BaseChannelLayer):
+    """Delivers in process when possible, through ``inner`` when necessary"""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, inner=None, membership_url=None, membership_store=None,
+                 membership_cache_ttl=5, expiry=60, capacity=100, channel_capacity=None):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        if isinstance(inner, dict):
+            inner = import_string(inner['BACKEND'])(**inner.get('CONFIG', {}))
+        self.inner = inner
+        self.membership = membership_store or RedisMembershipStore(url=membership_url)
+        self.membership_cache_ttl = membership_cache_ttl
+        self.process = uuid.uuid4().hex
+        # channel -> queue, for channels created by this process
+        self.local_channels = {}
+        # group -> set of local channels
+        self.local_groups = {}
+        # group -> (relay channel on the inner layer, relay task)
+        self.relays = {}
+        # group -> (fetched_at, set of other processes with members)
+        self.remote_cache = {}
+        # channel -> pending inner.receive task
+        self.pending_receives = {}
+
+    # Channels
+
+    async def new_channel(self, prefix='specific'):
+        channel = await self.inner.new_channel(prefix)
+        self.local_channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return channel
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        queue = self.local_channels.get(channel)
+        if queue is None:
+            await self.inner.send(channel, message)
+            return
+        if queue.full():
+            raise ChannelFull(channel)
+        queue.put_nowait(message)
+
+    async def receive(self, channel):
+        queue = self.local_channels.get(channel)
+        if queue is None:
+            return await self.inner.receive(channel)
+        if not queue.empty():
+            return queue.get_nowait()
+
+        # Wait on local delivery and the network at once. An unfinished
+        # network receive is kept for the next call instead of cancelled,
+        # so a message it is already reading is never lost.
+        remote = self.pending_receives.get(channel)
+        if remote is None:
+            remote = asyncio.ensure_future(self.inner.receive(channel))
+            self.pending_receives[channel] = remote
+        local = asyncio.ensure_future(queue.get())
+        try:
+            await asyncio.wait([local, remote], return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # Consumers only cancel their receive when they shut down
+            local.cancel()
+            self.discard_channel(channel)
+            raise
+        if local.done():
+            return local.result()
+        local.cancel()
+        del self.pending_receives[channel]
+        return remote.result()
+
+    def discard_channel(self, channel):
+        """Forget a local channel whose consumer has gone away"""
+        self.local_channels.pop(channel, None)
+        remote = self.pending_receives.pop(channel, None)
+        if remote is not None:
+            remote.cancel()
+
+    # Groups
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        # Channels of other processes are members of the inner group directly
+        if channel not in self.local_channels:
+            await self.inner.group_add(group, channel)
+            return
+        members = self.local_groups.setdefault(group, set())
+        members.add(channel)
+        if group not in self.relays:
+            await self.start_relay(group)
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        if channel not in self.local_channels and channel not in self.local_groups.get(group, ()):
+            await self.inner.group_discard(group, channel)
+            return
+        members = self.local_groups.get(group)
+        if members is None:
+            return
+        members.discard(channel)
+        if not members:
+            del self.local_groups[group]
+            await self.stop_relay(group)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_group_name(group), 'Group name not valid'
+        self.deliver_local(group, message)
+        if await self.remote_processes(group):
+            await self.inner.group_send(group, dict(message, __hybrid_origin=self.process))
+
+    def deliver_local(self, group, message):
+        for channel in self.local_groups.get(group, ()):
+            queue = self.local_channels.get(channel)
+            if queue is None or queue.full():
+                # Same as a full channel in any other layer: drop for this member
+                continue
+            # Shallow copy so members can't see each other's changes; no serialization
+            queue.put_nowait(dict(message))
+
+    async def remote_processes(self, group):
+        """Other processes with members of ``group`` (cached for ``membership_cache_ttl``)"""
+        cached = self.remote_cache.get(group)
+        if cached is not None and time.monotonic() - cached[0] < self.membership_cache_ttl:
+            return cached[1]
+        try:
+            processes = await self.membership.members(group)
+        except Exception as e:
+            logger.warning('Membership lookup for %s failed, publishing anyway: %s', group, e)
+            return {None}
+        processes.discard(self.process)
+        # Joins are announced on the relay: without one, a cached empty set
+        # would hide a member that joins elsewhere until the entry expires
+        if processes or group in self.relays:
+            self.remote_cache[group] = (time.monotonic(), processes)
+        return processes
+
+    # Relays: this process's single member of a group on the inner layer
+
+    async def start_relay(self, group):
+        relay = await self.inner.new_channel('hybrid')
+        self.relays[group] = (relay, asyncio.ensure_future(self.relay_loop(group, relay)))
+        await self.inner.group_add(group, relay)
+        await self.membership.add(group, self.process)
+        await self.inner.group_send(group, {
+            'type': MEMBERSHIP_MESSAGE,
+            '__hybrid_origin': self.process,
+        })
+
+    async def stop_relay(self, group):
+        relay, task = self.relays.pop(group)
+        task.cancel()
+        await self.inner.group_discard(group, relay)
+        await self.membership.remove(group, self.process)
+
+    async def relay_loop(self, group, relay):
+        while True:
+            try:
+                message = await self.inner.receive(relay)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if asyncio.current_task().cancelling():
+                    # Stopped while the inner layer was failing or cleaning
+                    # up: don't retry, or stop_relay/flush never finishes
+                    return
+                logger.warning('Relay for %s failed: %s', group, e)
+                await asyncio.sleep(1)
+                continue
+            origin = message.pop('__hybrid_origin', None)
+            if origin == self.process:
+                # Our own publish, already delivered locally
+                continue
+            if message.get('type') == MEMBERSHIP_MESSAGE:
+                # Another process gained members: look them up on the next send
+                self.remote_cache.pop(group, None)
+                continue
+            self.deliver_local(group, message)
+
+    # Flush extension
+
+    async def flush(self):
+        tasks = [task for _, task in self.relays.values()] + list(self.pending_receives.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.local_channels = {}
+        self.local_groups = {}
+        self.relays = {}
+        self.remote_cache = {}
+        self.pending_receives = {}
+        if hasattr(self.inner, 'flush'):
+            await self.inner.flush()
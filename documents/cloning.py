@@ -0,0 +1,92 @@
+"""
+Copy-on-write document clones and templates.
+
+Content to be shared is stored once as a ``ContentBlob`` keyed by its
+canonical hash, so the same template saved twice, or a document cloned a
+hundred times, is one row. A clone is a ``Document`` whose ``blob`` is that
+row, whose ``content_hash`` is the blob's hash and whose ``content`` is left
+empty: nothing is copied. Readers go through ``blocks.current_content`` /
+``blocks.inline_content``, which read the blob while the two hashes match.
+The first edit writes real content and a new hash like any other write, and
+from then on the document reads its own ``content``; no write path needs
+to know about clones.
+
+Cloning a clone that hasn't been edited reuses its blob without reading
+it. ``gc_content_blobs`` drops references of edited clones and deletes
+blobs nothing uses any more.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from . import blocks as block_storage
+from .hashing import content_hash
+from .models import ContentBlob, Document, DocumentActivity, DocumentStats, DocumentTemplate
+from .stats import word_count
+
+
+def intern(content, digest=None):
+    """Store ``content`` as a blob (once); returns its hash"""
+    digest = digest or content_hash(content)
+    ContentBlob.objects.bulk_create([ContentBlob(hash=digest, content=content)], ignore_conflicts=True)
+    return digest
+
+
+def snapshot(document):
+    """Hash of a blob holding ``document``'s current content"""
+    if document.shares_content:
+        return document.blob_id
+    if document.storage_mode != 'blocks' and document.content_hash \
+            and ContentBlob.objects.filter(hash=document.content_hash).exists():
+        # Already stored (e.g. cloned before, unchanged since)
+        return document.content_hash
+    content = block_storage.current_content(document.id, document.storage_mode)
+    return intern(content)
+
+
+def create_from_blob(digest, owner, titles, description):
+    """Documents sharing the blob ``digest``, one per title, created in one transaction"""
+    words = word_count(ContentBlob.objects.values_list('content', flat=True).get(hash=digest))
+    with transaction.atomic():
+        # bulk_create skips save(), which would hash the empty content
+        documents = Document.objects.bulk_create([
+            Document(title=title[:255], owner=owner, content={}, content_hash=digest, blob_id=digest)
+            for title in titles
+        ], batch_size=500)
+        DocumentStats.objects.bulk_create([
+            DocumentStats(document=document, word_count=words) for document in documents
+        ])
+        DocumentActivity.objects.bulk_create([
+            DocumentActivity(document=document, user=owner, activity_type='edit', description=description[:255])
+            for document in documents
+        ])
+    return documents
+
+
+def clone(document, owner, title=None):
+    """A copy-on-write copy of ``document`` owned by ``owner``"""
+    copy, = create_from_blob(
+        snapshot(document), owner, [title or f'Copy of {document.title}'], f'Copied from {document.title}',
+    )
+    return copy
+
+
+def save_template(document, owner, name, description='', is_public=False):
+    return DocumentTemplate.objects.create(
+        name=name[:255], description=description[:255], owner=owner, blob_id=snapshot(document), is_public=is_public,
+    )
+
+
+def instantiate(template, owner, titles):
+    """Documents created from ``template``, one per title"""
+    return create_from_blob(template.blob_id, owner, titles, f'Created from template {template.name}')
+
+
+def collect_garbage():
+    """Forget the blobs of edited clones and delete unused blobs; returns (released, deleted)"""
+    released = Document.objects.filter(blob__isnull=False).exclude(blob_id=F('content_hash')).update(blob=None)
+    deleted, _ = ContentBlob.objects.exclude(
+        hash__in=Document.objects.filter(blob__isnull=False).values('blob_id')
+    ).exclude(
+        hash__in=DocumentTemplate.objects.values('blob_id')
+    ).delete()
+    return released, deleted
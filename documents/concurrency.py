@@ -0,0 +1,63 @@
+"""
+Optimistic concurrency control for Document writes.
+
+Every content write is a conditional UPDATE guarded by the revision the
+writer read (compare-and-set). The UPDATE touches only the fields being
+changed plus ``revision`` and ``updated_at``; if another worker wrote in
+the meantime no row matches and the caller gets a RevisionConflict
+instead of silently overwriting the other write. No row locks are held
+between the read and the write.
+"""
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Document
+
+
+class RevisionConflict(Exception):
+    """The document's revision moved on since the writer read it"""
+
+    def __init__(self, document_id, expected, current):
+        self.document_id = document_id
+        self.expected = expected
+        self.current = current
+        super().__init__(
+            f'Document {document_id} is at revision {current}, expected {expected}'
+        )
+
+
+def current_revision(document_id):
+    return Document.objects.filter(id=document_id).values_list('revision', flat=True).first()
+
+
+def compare_and_set(document_id, expected_revision, **fields):
+    """
+    Apply ``fields`` to the document only if it is still at ``expected_revision``.
+
+    Returns the new revision, or raises RevisionConflict carrying the
+    revision actually found.
+    """
+    updated = Document.objects.filter(id=document_id, revision=expected_revision).update(
+        revision=F('revision') + 1,
+        updated_at=timezone.now(),
+        **fields
+    )
+    if not updated:
+        raise RevisionConflict(document_id, expected_revision, current_revision(document_id))
+    return expected_revision + 1
+
+
+def update_with_retry(document_id, attempts=3, **fields):
+    """
+    Compare-and-set ``fields`` against whatever revision is current.
+
+    For writes that don't depend on the previous content (visibility,
+    restores), a conflict just means re-reading the revision; give up after
+    ``attempts`` so a hot document can't stall the caller.
+    """
+    for _ in range(attempts - 1):
+        try:
+            return compare_and_set(document_id, current_revision(document_id), **fields)
+        except RevisionConflict:
+            continue
+    return compare_and_set(document_id, current_revision(document_id), **fields)
@@ -262,9 +262,31 @@ class DocumentConsumer(AsyncWebsocketConsumer):
 
 import json
 import asyncio
+from collections import deque
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from .models import Document, UserPresence, DocumentActivity, DocumentVersion, DocumentPermission
+from django.db import transaction
+from .models import Document, UserPresence, DocumentActivity, DocumentVersion
+from . import blocks as block_storage
+from .caching import invalidate_document
+from .fanout import viewer_fanout, viewer_group_name
+from .frames import dumps, group_event
+from .acl import access
+from .affinity import room_router
+from .anchors import anchor_tracker
+from .buffering import edit_buffer
+from .concurrency import compare_and_set, RevisionConflict
+from .drain import drain_controller, worker_clients_group
+from .metrics import metrics
+from .ratelimit import rate_limiter
+from .replicas import mark_write
+from .rooms import room_lifecycle
+from .scheduler import room_scheduler
+from .stats import bump, record, set_word_count
+from .hashing import content_hash
+from .versions import create_version
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 
@@ -330,8 +352,20 @@ class YjsRelayConsumer(AsyncWebsocketConsumer):
 
 
 
+# Message types subject to WS_RATE_LIMITS / WS_ROOM_RATE_LIMITS
+RATE_LIMITED_TYPES = ('edit', 'cursor', 'comment')
+
+
 class DocumentConsumer(AsyncWebsocketConsumer):
+    # Revisions this connection wrote; edits based on an older revision only
+    # conflict if someone else wrote in between
+    OWN_REVISION_HISTORY = 64
+
     async def connect(self):
+        self.own_revisions = deque(maxlen=self.OWN_REVISION_HISTORY)
+        # Latest over-limit edit waiting for a rate limit token
+        self.pending_edit = None
+        self.pending_edit_timer = None
         print(f"[v1] WebSocket connection attempt - User: {self.scope['user']}, Document: {self.scope['url_route']['kwargs']['document_id']}")
         
         self.document_id = self.scope['url_route']['kwargs']['document_id']
@@ -344,58 +378,158 @@ class DocumentConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
+        # A draining worker takes no new rooms: move the client on before any DB work
+        await drain_controller.start()
+        await edit_buffer.start()
+        if drain_controller.draining:
+            self.redirected = True
+            await self.accept()
+            await self.reconnect_elsewhere(drain_controller.window, self.resume_revision())
+            return
+        
         # Check permissions with better error handling
-        has_permission = await self.check_permission()
-        if not has_permission:
+        access_level = await self.get_access_level()
+        if access_level is None:
             print(f"[v1] Rejecting connection: User {self.user.username} has no permission for document {self.document_id}")
             await self.close()
             return
         
+        # Read-only users go to the throttled viewer tier, not the editor room
+        self.is_viewer = access_level == 'viewer'
+        if self.is_viewer:
+            await self.connect_viewer()
+            return
+        
+        # Send clients that landed on the wrong worker to the room's owner
+        if room_router.should_redirect(self.document_id, self.query_param('worker')):
+            self.redirected = True
+            await self.accept()
+            await self.redirect(room_router.owner(self.document_id))
+            return
+        
         try:
             # Add to channel group
             await self.channel_layer.group_add(
                 self.room_group_name,
                 self.channel_name
             )
+            await room_router.join(self)
             
             # Add user presence
             await self.add_user_presence()
             await self.accept()
+            await self.channel_layer.group_add(worker_clients_group(room_router.worker), self.channel_name)
+            await room_lifecycle.enter(self.document_id, self.user.id)
+            self.entered_room = True
             
             print(f"[v1] WebSocket connected: User {self.user.username} to document {self.document_id}")
             
             # Notify others about new user (excluding self)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
+            await self.room_send(
+                group_event('user_joined', {
                     'type': 'user_joined',
                     'username': self.user.username,
                     'user_id': self.user.id,
-                }
+                }, sender_id=self.user.id)
             )
             
             # Send document content to new user
-            document = await self.get_document()
+            resume_revision = self.resume_revision()
+            payload = edit_buffer.payload(
+                self.document_id, await self.get_document_payload(resume_revision), resume_revision
+            )
             active_users = await self.get_active_users()
             
-            await self.send(text_data=json.dumps({
-                'type': 'document_load',
-                'content': document.content,
-                'title': document.title,
-                'active_users': active_users,
-            }))
+            await self.send(text_data=dumps(dict(payload,
+                type='document_load',
+                active_users=active_users,
+            )))
+            await self.stream_remaining_blocks(payload)
             
-            # Log activity
-            await self.log_activity('join', f'{self.user.username} joined the document')
+            # Log activity (a client resuming after a reconnect never left)
+            if resume_revision is None:
+                await self.log_activity('join', f'{self.user.username} joined the document')
             
         except Exception as e:
             print(f"[v1] Error in connect: {str(e)}")
             await self.close()
 
+    async def connect_viewer(self):
+        """Join the viewer tier: no presence, no activity, throttled snapshots"""
+        self.viewer_group_name = viewer_group_name(self.document_id)
+        try:
+            await self.channel_layer.group_add(
+                self.viewer_group_name,
+                self.channel_name
+            )
+            await self.accept()
+            await self.channel_layer.group_add(worker_clients_group(room_router.worker), self.channel_name)
+            await room_lifecycle.enter(self.document_id)
+            self.entered_room = True
+            
+            resume_revision = self.resume_revision()
+            payload = edit_buffer.payload(
+                self.document_id, await self.get_document_payload(resume_revision), resume_revision
+            )
+            await self.send(text_data=dumps(dict(payload,
+                type='document_load',
+                active_users=[],
+                read_only=True,
+            )))
+            await self.stream_remaining_blocks(payload)
+        except Exception as e:
+            print(f"[v1] Error in connect_viewer: {str(e)}")
+            await self.close()
+
+    async def stream_remaining_blocks(self, payload):
+        """Send the blocks after the first screenful of a block-mode document"""
+        offset = payload.get('loaded_blocks')
+        if offset is None:
+            return
+        chunk_size = settings.BLOCK_STREAM_CHUNK
+        while offset < payload['total_blocks']:
+            chunk = await self.get_blocks(offset, offset + chunk_size)
+            if not chunk:
+                break
+            await self.send(text_data=dumps({
+                'type': 'document_blocks',
+                'offset': offset,
+                'blocks': chunk,
+                'done': offset + len(chunk) >= payload['total_blocks'],
+            }))
+            offset += len(chunk)
+
     async def disconnect(self, close_code):
         print(f"[v1] WebSocket disconnecting: User {self.user.username}, Code: {close_code}")
         
+        # Redirected before joining the room: nothing to clean up
+        if getattr(self, 'redirected', False):
+            return
+        
+        await self.channel_layer.group_discard(worker_clients_group(room_router.worker), self.channel_name)
+        if getattr(self, 'entered_room', False):
+            await room_lifecycle.leave(self.document_id, None if self.is_viewer else self.user.id)
+        
+        if getattr(self, 'is_viewer', False):
+            await self.channel_layer.group_discard(
+                self.viewer_group_name,
+                self.channel_name
+            )
+            return
+        
         try:
+            # Don't lose the client's last edit if it was still being held back
+            if self.pending_edit_timer is not None:
+                self.pending_edit_timer.cancel()
+            await self.flush_pending_edit(force=True)
+            await room_router.leave(self)
+            
+            # Moved off a draining worker: the client resumes elsewhere in a
+            # moment, so keep its presence and skip leave notifications
+            if getattr(self, 'drained', False):
+                await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+                return
+            
             await self.remove_user_presence()
             
             if hasattr(self, 'room_group_name'):
@@ -405,15 +539,15 @@ class DocumentConsumer(AsyncWebsocketConsumer):
                 )
                 
                 # Notify others about user leaving (excluding self)
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
+                await self.room_send(
+                    group_event('user_left', {
                         'type': 'user_left',
                         'username': self.user.username,
                         'user_id': self.user.id,
-                    }
+                    }, sender_id=self.user.id)
                 )
                 
+            await self.materialize_blocks()
             await self.log_activity('leave', f'{self.user.username} left the document')
             
         except Exception as e:
@@ -426,48 +560,40 @@ class DocumentConsumer(AsyncWebsocketConsumer):
             
             print(f"[v1] Received message type: {message_type} from user {self.user.username}")
             
-            if message_type == 'edit':
-                content = data.get('content', '')
-                
-                # Validate content
-                if content is None:
+            # Viewers are read-only and never publish to the editor room
+            if getattr(self, 'is_viewer', False):
+                return
+            room_lifecycle.touch(self.document_id)
+            
+            if message_type in RATE_LIMITED_TYPES:
+                metrics.incr('ws_frames', type=message_type)
+                if not await self.admit(message_type, data):
                     return
-                
-                # Save to database first
-                await self.save_document(content)
-                
-                # Then broadcast to all users (including sender for sync)
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'document_edit',
-                        'content': content,
-                        'username': self.user.username,
-                        'user_id': self.user.id,
-                        'timestamp': timezone.now().isoformat(),
-                    }
-                )
-                
-                await self.log_activity('edit', f'{self.user.username} edited the document')
+            
+            if message_type == 'edit':
+                await self.handle_edit(data)
             
             elif message_type == 'cursor':
                 # Broadcast cursor position to other users only
-                await self.channel_layer.group_send(
-                    self.room_group_name,
-                    {
-                        'type': 'cursor_update',
+                await self.room_send(
+                    group_event('cursor_update', {
+                        'type': 'cursor',
                         'username': self.user.username,
                         'user_id': self.user.id,
                         'position': data.get('position', 0),
                         'selection_start': data.get('selection_start', 0),
                         'selection_end': data.get('selection_end', 0),
-                    }
+                    }, sender_id=self.user.id)
                 )
                 
-                await self.update_cursor_position(
+                # Background write; a newer position replaces one still queued
+                room_scheduler.submit(
+                    self.document_id,
+                    self.update_cursor_position,
                     data.get('position', 0),
                     data.get('selection_start', 0),
-                    data.get('selection_end', 0)
+                    data.get('selection_end', 0),
+                    key=('cursor', self.channel_name),
                 )
             
             elif message_type == 'comment':
@@ -476,107 +602,269 @@ class DocumentConsumer(AsyncWebsocketConsumer):
                 
                 if comment_content:
                     # Save comment
-                    await self.save_comment(comment_content, position)
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'comment_added',
+                    comment_id = await room_scheduler.run(self.document_id, self.save_comment, comment_content, position)
+                    if comment_id is None:
+                        return
+                    await anchor_tracker.track(self.document_id)
+                    anchor_tracker.added(self.document_id, comment_id, position)
+                    await self.room_send(
+                        group_event('comment_added', {
+                            'type': 'comment',
+                            'id': comment_id,
                             'username': self.user.username,
                             'user_id': self.user.id,
                             'content': comment_content,
                             'position': position,
-                        }
+                        }, sender_id=self.user.id)
                     )
-                    await self.log_activity('comment', f'{self.user.username} added a comment')
+                    room_scheduler.submit(self.document_id, self.log_activity, 'comment', f'{self.user.username} added a comment')
         
         except json.JSONDecodeError as e:
             print(f"[v1] JSON decode error: {str(e)}")
         except Exception as e:
             print(f"[v1] Error in receive: {str(e)}")
 
+    async def handle_edit(self, data):
+        # Saves and broadcasts take this room's turn in the worker's scheduler
+        await room_scheduler.run(self.document_id, self.apply_edit, data)
+
+    async def apply_edit(self, data):
+        content = data.get('content', '')
+        
+        # Validate content
+        if content is None:
+            return
+        
+        # Comment anchors are moved from the text this edit applies to
+        await anchor_tracker.track(self.document_id)
+        
+        # Save first: journaled and buffered when EDIT_BUFFERING is on,
+        # otherwise straight to the database
+        result = await edit_buffer.save(self, content, data.get('revision'))
+        if result is None:
+            result = await self.save_document(content, data.get('revision'))
+        if result['status'] == 'conflict':
+            # Someone else wrote since this client's base revision:
+            # resync the sender instead of overwriting their write
+            await self.send(text_data=dumps(result))
+            return
+        if result['status'] == 'error':
+            return
+        
+        # Keep this user's page loads on the primary until replicas catch up
+        mark_write(self.user.id)
+        if result['status'] == 'saved':
+            anchor_tracker.edited(self.document_id, content, result['revision'])
+        
+        # Then broadcast to all users (including sender for sync)
+        await self.room_send(
+            group_event('document_edit', {
+                'type': 'edit',
+                'content': content,
+                'revision': result['revision'],
+                'username': self.user.username,
+                'user_id': self.user.id,
+                'timestamp': timezone.now().isoformat(),
+            }, sender_id=self.user.id)
+        )
+        await viewer_fanout.publish(self.document_id, content, revision=result['revision'])
+        
+        room_scheduler.submit(self.document_id, self.log_activity, 'edit', f'{self.user.username} edited the document')
+
+    async def admit(self, message_type, data):
+        """
+        Apply the connection and room token buckets to an incoming frame.
+
+        Edits carry the whole document, so an over-limit edit is coalesced:
+        it replaces any edit already waiting and is applied once a token is
+        free. Other over-limit frames are dropped.
+        """
+        if message_type == 'edit' and self.pending_edit is not None:
+            # Keep edits in order behind the one already waiting
+            self.pending_edit = data
+            metrics.incr('ws_frames_coalesced', type=message_type)
+            return False
+        if rate_limiter.allow(self, message_type):
+            return True
+        if message_type != 'edit':
+            metrics.incr('ws_frames_dropped', type=message_type)
+            return False
+        self.pending_edit = data
+        metrics.incr('ws_frames_coalesced', type=message_type)
+        self.schedule_pending_edit()
+        return False
+
+    def schedule_pending_edit(self):
+        delay = rate_limiter.retry_after(self, 'edit')
+        self.pending_edit_timer = asyncio.get_running_loop().call_later(
+            delay, lambda: asyncio.ensure_future(self.flush_pending_edit())
+        )
+
+    async def flush_pending_edit(self, force=False):
+        """Apply the coalesced edit when the buckets allow (or now, when ``force``)"""
+        self.pending_edit_timer = None
+        if self.pending_edit is None:
+            return
+        if not force and not rate_limiter.allow(self, 'edit'):
+            self.schedule_pending_edit()
+            return
+        data, self.pending_edit = self.pending_edit, None
+        try:
+            await self.handle_edit(data)
+        except Exception as e:
+            print(f"[v1] Error applying coalesced edit: {str(e)}")
+
+    async def room_send(self, event):
+        """Broadcast a group event to the room, in-process where possible"""
+        await room_router.broadcast(self.document_id, self.room_group_name, event)
+
+    async def dispatch(self, message):
+        # Channel layer copies of events this worker already delivered in-process
+        if room_router.delivered_locally(message):
+            return
+        await super().dispatch(message)
+
+    def query_param(self, name):
+        """A query string parameter of the websocket URL, e.g. the ``worker`` routing hint"""
+        query = parse_qs(self.scope.get('query_string', b'').decode('latin-1'))
+        return (query.get(name) or [None])[0]
+
+    def resume_revision(self):
+        """Revision a reconnecting client already has, or None for a fresh join"""
+        try:
+            return int(self.query_param('resume'))
+        except (TypeError, ValueError):
+            return None
+
+    async def reconnect_elsewhere(self, window, revision):
+        """Tell the client to reconnect after a jittered delay and close"""
+        await self.send(text_data=dumps({
+            'type': 'reconnect',
+            'delay': drain_controller.reconnect_delay(window),
+            'revision': revision,
+            'worker': room_router.owner(self.document_id) if room_router.enabled else '',
+        }))
+        await self.close(code=4002)
+
+    async def redirect(self, worker):
+        """Tell the client to reconnect to ``worker`` and close"""
+        await self.send(text_data=dumps({'type': 'redirect', 'worker': worker}))
+        await self.close(code=4001)
+
+    async def handoff(self, new_owner):
+        """Flush room state and move this client to the room's new owner"""
+        print(f"[v1] Handing off user {self.user.username} on document {self.document_id} to {new_owner}")
+        await viewer_fanout.flush(self.document_id)
+        await edit_buffer.flush(self.document_id)
+        edit_buffer.forget(self.document_id)
+        await anchor_tracker.flush(self.document_id)
+        anchor_tracker.forget(self.document_id)
+        await self.materialize_blocks()
+        await self.redirect(new_owner)
+
+    # Group event handlers only filter and forward: the frame was encoded
+    # once by the sender (see frames.group_event), not once per member.
+
     # Handler for document edits - sends to ALL users including sender
     async def document_edit(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'edit',
-            'content': event['content'],
-            'username': event['username'],
-            'user_id': event['user_id'],
-            'timestamp': event.get('timestamp'),
-        }))
+        await self.send(text_data=event['frame'])
 
     # Handler for cursor updates - sends to OTHER users only
     async def cursor_update(self, event):
-        # Only send cursor updates from other users
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'cursor',
-                'username': event['username'],
-                'user_id': event['user_id'],
-                'position': event['position'],
-                'selection_start': event.get('selection_start', 0),
-                'selection_end': event.get('selection_end', 0),
-            }))
+            await self.send(text_data=event['frame'])
 
     # Handler for user joined - sends to OTHER users only
     async def user_joined(self, event):
-        # Only notify about other users joining
         if event['user_id'] != self.user.id:
-            await self.send(text_data=json.dumps({
-                'type': 'user_joined',
-                'username': event['username'],
-                'user_id': event['user_id'],
-            }))
+            await self.send(text_data=event['frame'])
 
     # Handler for user left - sends to ALL remaining users
     async def user_left(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'user_left',
-            'username': event['username'],
-            'user_id': event['user_id'],
-        }))
+        await self.send(text_data=event['frame'])
 
     # Handler for comments - sends to ALL users
     async def comment_added(self, event):
-        await self.send(text_data=json.dumps({
-            'type': 'comment',
-            'username': event['username'],
-            'user_id': event['user_id'],
-            'content': event['content'],
-            'position': event['position'],
-        }))
+        await self.send(text_data=event['frame'])
+
+    # Handler for throttled viewer snapshots - viewer tier only
+    async def viewer_snapshot(self, event):
+        await self.send(text_data=event['frame'])
+
+    # Handler for worker drain - room state was already flushed by the worker
+    async def worker_drain(self, event):
+        self.drained = True
+        revision = event.get('revisions', {}).get(str(self.document_id))
+        await self.reconnect_elsewhere(event.get('window'), revision)
 
     @database_sync_to_async
-    def check_permission(self):
-        """Check if user has permission to access this document"""
+    def get_access_level(self):
+        """Return 'owner', 'editor' or 'viewer' for this user, or None if denied"""
         try:
-            document = Document.objects.get(id=self.document_id)
+            document = Document.objects.only('owner_id', 'is_public').get(id=self.document_id)
             
-            # User is owner
-            if document.owner == self.user:
-                return True
-                
-            # Document is public
-            if document.is_public:
-                return True
-                
-            # User has explicit permission
-            if DocumentPermission.objects.filter(document=document, user=self.user).exists():
-                return True
+            # Owner, then the materialized ACL (direct and group grants),
+            # then public documents - readable by anyone signed in
+            level = access(document, self.user)
+            if level is not None:
+                return level
                 
             print(f"[v1] Permission denied: User {self.user.username} for document {self.document_id}")
-            return False
+            return None
             
         except Document.DoesNotExist:
             print(f"[v1] Document {self.document_id} not found")
-            return False
+            return None
         except Exception as e:
-            print(f"[v1] Error in check_permission: {str(e)}")
-            return False
+            print(f"[v1] Error in get_access_level: {str(e)}")
+            return None
 
     @database_sync_to_async
     def get_document(self):
         return Document.objects.get(id=self.document_id)
 
+    @database_sync_to_async
+    def get_document_payload(self, resume_revision=None):
+        """
+        Title and content for document_load.
+
+        Block-mode documents only load the first BLOCK_INITIAL_LOAD blocks
+        here; the rest follow as document_blocks frames. A client resuming
+        at the current revision already has the content and gets none.
+        """
+        document = Document.objects.defer('content').get(id=self.document_id)
+        if resume_revision is not None and resume_revision == document.revision:
+            return {'title': document.title, 'revision': document.revision, 'unchanged': True}
+        if document.storage_mode != 'blocks':
+            return {'title': document.title, 'revision': document.revision, 'content': Document.objects.values_list(
+                block_storage.inline_content(), flat=True
+            ).get(id=self.document_id)}
+        
+        initial = block_storage.load_blocks(self.document_id, 0, settings.BLOCK_INITIAL_LOAD)
+        total = document.blocks.count()
+        return {
+            'title': document.title,
+            'revision': document.revision,
+            'content': block_storage.join_blocks(initial),
+            'partial': total > len(initial),
+            'loaded_blocks': len(initial),
+            'total_blocks': total,
+        }
+
+    @database_sync_to_async
+    def get_blocks(self, start, stop):
+        return block_storage.load_blocks(self.document_id, start, stop)
+
+    @database_sync_to_async
+    def materialize_blocks(self):
+        """Refresh Document.content from the block table for block-mode documents"""
+        try:
+            if Document.objects.filter(id=self.document_id, storage_mode='blocks').exists():
+                block_storage.materialize(self.document_id)
+                invalidate_document(self.document_id)
+        except Exception as e:
+            print(f"[v1] Error materializing blocks: {str(e)}")
+
     @database_sync_to_async
     def get_active_users(self):
         """Get currently active users in the document"""
@@ -600,31 +888,107 @@ class DocumentConsumer(AsyncWebsocketConsumer):
             return []
 
     @database_sync_to_async
-    def save_document(self, content):
-        """Save document content and create version history"""
+    def save_document(self, content, base_revision=None):
+        """
+        Save document content and create version history.
+        
+        Writes are compare-and-set on Document.revision. ``base_revision`` is
+        the revision the client's edit was based on; it conflicts only if a
+        write from another connection landed after it. Returns a dict with
+        'status' ('saved', 'unchanged', 'conflict' or 'error') and 'revision'.
+        """
         try:
-            document = Document.objects.get(id=self.document_id)
-            old_content = document.content
+            digest = content_hash(content)
+            row = Document.objects.filter(id=self.document_id).values_list(
+                'storage_mode', 'content_hash', 'revision'
+            ).first()
+            if row is None:
+                return {'status': 'error', 'revision': None}
+            storage_mode, stored_hash, revision = row
             
-            # Only save if content actually changed
-            if old_content != content:
-                document.content = content
-                document.modified_at = timezone.now()
-                document.last_modified_by = self.user
-                document.save()
-                
-                # Create version history
-                DocumentVersion.objects.create(
-                    document=document,
-                    content=old_content,
-                    created_by=self.user,
-                    version_number=(DocumentVersion.objects.filter(document=document).count() + 1)
-                )
-                
-                print(f"[v1] Document {self.document_id} saved by {self.user.username}")
-                
+            # Only save if content actually changed - an O(1) hash comparison
+            # instead of loading and deep-comparing the stored JSON
+            if stored_hash == digest:
+                return {'status': 'unchanged', 'revision': revision}
+            if not self.is_current(base_revision, revision):
+                return self.conflict(revision, storage_mode)
+            
+            if storage_mode == 'blocks':
+                blocks = block_storage.split_blocks(content)
+                if blocks is not None:
+                    return self.save_document_blocks(blocks, digest, revision)
+
+            # Read before the blocks are dropped: in block mode Document.content
+            # lags behind the block table until the next materialize
+            old_content = block_storage.current_content(self.document_id, storage_mode)
+            fields = {'content': content, 'content_hash': digest, 'storage_mode': 'inline'}
+            if storage_mode == 'blocks':
+                # Content that can't be chunked (e.g. raw HTML) goes back inline.
+                # One transaction, so a conflict rolls back the dropped blocks too
+                with transaction.atomic():
+                    block_storage.drop_blocks(self.document_id)
+                    new_revision = compare_and_set(self.document_id, revision, **fields)
+            else:
+                new_revision = compare_and_set(self.document_id, revision, **fields)
+            self.own_revisions.append(new_revision)
+            invalidate_document(self.document_id)
+            
+            # Create version history (skipped if the last snapshot is identical)
+            create_version(self.document_id, old_content, self.user, digest=stored_hash or None)
+            record(set_word_count, self.document_id, content)
+            
+            print(f"[v1] Document {self.document_id} saved by {self.user.username}")
+            return {'status': 'saved', 'revision': new_revision}
+        
+        except RevisionConflict as e:
+            return self.conflict(e.current)
         except Exception as e:
             print(f"[v1] Error saving document: {str(e)}")
+            return {'status': 'error', 'revision': None}
+
+    def is_current(self, base_revision, revision):
+        """True if every write after ``base_revision`` came from this connection"""
+        if base_revision is None:
+            # Legacy clients don't send a base revision: last writer wins
+            return True
+        try:
+            base_revision = int(base_revision)
+        except (TypeError, ValueError):
+            return True
+        return all(r in self.own_revisions for r in range(base_revision + 1, revision + 1))
+
+    def conflict(self, revision, storage_mode=None):
+        """The 'conflict' frame for the sender, carrying the current content"""
+        if storage_mode is None:
+            storage_mode = Document.objects.filter(id=self.document_id).values_list(
+                'storage_mode', flat=True
+            ).first()
+        return {
+            'type': 'conflict',
+            'status': 'conflict',
+            'revision': revision,
+            'content': block_storage.current_content(self.document_id, storage_mode),
+        }
+
+    def save_document_blocks(self, blocks, digest, revision):
+        """
+        Block-mode save: write only changed blocks.
+        
+        The compare-and-set on the Document row runs first in the same
+        transaction, so concurrent block writers serialize on it. Document.content
+        and the version history are refreshed when the materialized copy is
+        due, not on every edit.
+        """
+        with transaction.atomic():
+            new_revision = compare_and_set(self.document_id, revision, content_hash=digest)
+            block_storage.save_blocks(self.document_id, blocks, digest)
+        self.own_revisions.append(new_revision)
+        invalidate_document(self.document_id)
+        if block_storage.materialize_due(self.document_id):
+            content = block_storage.materialize(self.document_id)
+            create_version(self.document_id, content, self.user, digest=digest)
+            record(set_word_count, self.document_id, content)
+        return {'status': 'saved', 'revision': new_revision}
 
     @database_sync_to_async
     def add_user_presence(self):
@@ -636,7 +1000,6 @@ class DocumentConsumer(AsyncWebsocketConsumer):
                 defaults={
                     'cursor_position': 0,
                     'last_seen': timezone.now(),
-                    'is_online': True
                 }
             )
             print(f"[v1] User presence added: {self.user.username} for document {self.document_id}")
@@ -673,18 +1036,21 @@ class DocumentConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def save_comment(self, content, position):
-        """Save document comment"""
+        """Save document comment; returns its id, or None if it wasn't saved"""
         from .models import DocumentComment
         try:
-            DocumentComment.objects.create(
+            comment = DocumentComment.objects.create(
                 document_id=self.document_id,
                 user=self.user,
                 content=content,
                 position=position
             )
+            record(bump, self.document_id, comment_count=1, unresolved_comment_count=1)
             print(f"[v1] Comment saved by {self.user.username}")
+            return comment.id
         except Exception as e:
             print(f"[v1] Error saving comment: {str(e)}")
+            return None
 
     @database_sync_to_async
     def log_activity(self, activity_type, description):
@@ -0,0 +1,228 @@
+"""
+Structural diffs between two versions of a document.
+
+Both sides are split into top-level blocks (Tiptap nodes, or the lines of
+legacy HTML content) and each block is reduced to its canonical content
+hash. Blocks are matched on those hashes: common leading and trailing
+blocks are trimmed, then the blocks that occur exactly once on each side
+anchor the match (patience diff, an O(n log n) longest increasing
+subsequence over the anchors) and the gaps between anchors are matched the
+same way, recursively. The cost grows with the document size plus the
+size of the change, not with its square.
+
+Unmatched blocks in a gap are paired in order with unmatched blocks of the
+same type on the other side as ``changed`` blocks, which get a word-level
+inline diff; the rest are ``added`` or ``removed``. Runs of unchanged
+blocks are collapsed into one ``equal`` entry.
+
+A diff depends only on the two contents, so it is cached under the pair of
+content hashes for ``DIFF_CACHE_TTL`` seconds.
+"""
+import re
+from bisect import bisect_left
+from collections import Counter, deque
+from difflib import SequenceMatcher
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .blocks import split_blocks
+from .hashing import content_hash
+from .rendering import html_to_text, node_text
+
+TOKEN_RE = re.compile(r'\w+|\s+|[^\w\s]')
+
+# Gaps nested deeper than this are left unmatched (added/removed/changed)
+MAX_DEPTH = 64
+
+# Bump when the diff format changes, so cached diffs of the old format go
+DIFF_FORMAT = 1
+
+
+def diff_key(old_hash, new_hash):
+    return f'diff:{DIFF_FORMAT}:{old_hash}:{new_hash}'
+
+
+class Block:
+    __slots__ = ('type', 'text', 'hash')
+
+    def __init__(self, type, text, digest):
+        self.type = type
+        self.text = text
+        self.hash = digest
+
+
+def to_blocks(content):
+    """The blocks of stored content (Tiptap JSON or legacy HTML)"""
+    nodes = split_blocks(content)
+    if nodes is not None:
+        return [Block(node.get('type', ''), node_text(node), content_hash(node)) for node in nodes]
+    if isinstance(content, str):
+        return [
+            Block('line', line, content_hash(line))
+            for line in html_to_text(content).split('\n')
+        ]
+    return []
+
+
+def longest_increasing(pairs):
+    """Longest chain of (i, j) pairs, increasing in both, from pairs sorted by i"""
+    tails = []   # j of the last pair of the best chain of each length
+    tail_index = []
+    previous = [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        length = bisect_left(tails, j)
+        if length == len(tails):
+            tails.append(j)
+            tail_index.append(index)
+        else:
+            tails[length] = j
+            tail_index[length] = index
+        previous[index] = tail_index[length - 1] if length else None
+    chain = []
+    index = tail_index[-1] if tail_index else None
+    while index is not None:
+        chain.append(pairs[index])
+        index = previous[index]
+    return chain[::-1]
+
+
+def match(old, new, old_lo, old_hi, new_lo, new_hi, matched, depth=0):
+    """Append matching (old index, new index) pairs of the two ranges to ``matched``, in order"""
+    # Common prefix and suffix
+    while old_lo < old_hi and new_lo < new_hi and old[old_lo] == new[new_lo]:
+        matched.append((old_lo, new_lo))
+        old_lo += 1
+        new_lo += 1
+    suffix = []
+    while old_lo < old_hi and new_lo < new_hi and old[old_hi - 1] == new[new_hi - 1]:
+        old_hi -= 1
+        new_hi -= 1
+        suffix.append((old_hi, new_hi))
+    if old_lo < old_hi and new_lo < new_hi and depth < MAX_DEPTH:
+        old_counts = Counter(old[old_lo:old_hi])
+        new_counts = Counter(new[new_lo:new_hi])
+        new_unique = {
+            new[j]: j for j in range(new_lo, new_hi)
+            if new_counts[new[j]] == 1 and old_counts[new[j]] == 1
+        }
+        anchors = longest_increasing([
+            (i, new_unique[old[i]]) for i in range(old_lo, old_hi) if old[i] in new_unique
+        ])
+        if anchors:
+            for i, j in anchors:
+                match(old, new, old_lo, i, new_lo, j, matched, depth + 1)
+                matched.append((i, j))
+                old_lo, new_lo = i + 1, j + 1
+            match(old, new, old_lo, old_hi, new_lo, new_hi, matched, depth + 1)
+    matched.extend(reversed(suffix))
+
+
+def inline_diff(old_text, new_text):
+    """Word-level operations turning ``old_text`` into ``new_text``"""
+    old_tokens = TOKEN_RE.findall(old_text)
+    new_tokens = TOKEN_RE.findall(new_text)
+    operations = []
+    matcher = SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            operations.append({'op': 'equal', 'text': ''.join(old_tokens[i1:i2])})
+            continue
+        if i1 < i2:
+            operations.append({'op': 'delete', 'text': ''.join(old_tokens[i1:i2])})
+        if j1 < j2:
+            operations.append({'op': 'insert', 'text': ''.join(new_tokens[j1:j2])})
+    return operations
+
+
+def gap_entries(old_blocks, new_blocks, old_range, new_range):
+    """Entries for the unmatched blocks between two matches, in document order"""
+    # Pair removed and added blocks of the same type, in order, as edits of
+    # one another
+    added_by_type = {}
+    for j in new_range:
+        added_by_type.setdefault(new_blocks[j].type, deque()).append(j)
+    pairs = {}
+    last = -1
+    for i in old_range:
+        candidates = added_by_type.get(old_blocks[i].type)
+        while candidates and candidates[0] < last:
+            candidates.popleft()
+        if candidates:
+            pairs[i] = last = candidates.popleft()
+    paired = set(pairs.values())
+
+    entries = []
+    added = iter(j for j in new_range if j not in paired)
+    next_added = next(added, None)
+    for i in old_range:
+        j = pairs.get(i)
+        if j is None:
+            entries.append({'op': 'removed', 'old_index': i, 'type': old_blocks[i].type, 'text': old_blocks[i].text})
+            continue
+        while next_added is not None and next_added < j:
+            entries.append(added_entry(new_blocks, next_added))
+            next_added = next(added, None)
+        old, new = old_blocks[i], new_blocks[j]
+        entry = {'op': 'changed', 'old_index': i, 'new_index': j, 'type': new.type}
+        if old.text == new.text:
+            # Same words, different formatting or attributes
+            entry['inline'] = [{'op': 'equal', 'text': new.text}]
+            entry['format_changed'] = True
+        else:
+            entry['inline'] = inline_diff(old.text, new.text)
+        entries.append(entry)
+    while next_added is not None:
+        entries.append(added_entry(new_blocks, next_added))
+        next_added = next(added, None)
+    return entries
+
+
+def added_entry(new_blocks, j):
+    return {'op': 'added', 'new_index': j, 'type': new_blocks[j].type, 'text': new_blocks[j].text}
+
+
+def diff_contents(old_content, new_content):
+    """Block-level and inline changes from ``old_content`` to ``new_content``"""
+    old_blocks = to_blocks(old_content)
+    new_blocks = to_blocks(new_content)
+    old_hashes = [block.hash for block in old_blocks]
+    new_hashes = [block.hash for block in new_blocks]
+    matched = []
+    match(old_hashes, new_hashes, 0, len(old_hashes), 0, len(new_hashes), matched)
+    matched.append((len(old_hashes), len(new_hashes)))
+
+    entries = []
+    old_at = new_at = 0
+    for i, j in matched:
+        entries.extend(gap_entries(old_blocks, new_blocks, range(old_at, i), range(new_at, j)))
+        if i < len(old_hashes):
+            if entries and entries[-1]['op'] == 'equal':
+                entries[-1]['count'] += 1
+            else:
+                entries.append({'op': 'equal', 'old_index': i, 'new_index': j, 'count': 1})
+        old_at, new_at = i + 1, j + 1
+
+    counts = Counter(entry['op'] for entry in entries)
+    return {
+        'blocks': entries,
+        'summary': {
+            'added': counts['added'],
+            'removed': counts['removed'],
+            'changed': counts['changed'],
+            'unchanged': sum(entry['count'] for entry in entries if entry['op'] == 'equal'),
+        },
+    }
+
+
+def cached_diff(old_hash, new_hash, load_old, load_new):
+    """
+    The diff between two contents by hash, computed from ``load_old()`` and
+    ``load_new()`` only on a cache miss
+    """
+    key = diff_key(old_hash, new_hash)
+    diff = cache.get(key)
+    if diff is None:
+        diff = diff_contents(load_old(), load_new())
+        cache.set(key, diff, getattr(settings, 'DIFF_CACHE_TTL', 86400))
+    return diff
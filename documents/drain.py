@@ -0,0 +1,179 @@
+"""
+Graceful drain of an ASGI worker before a deploy stops it.
+
+Draining a worker:
+
+1. stops accepting rooms: new connections are told to reconnect elsewhere
+2. leaves the room-affinity ring, so its rooms get new owners
+3. flushes pending room state (viewer snapshots, buffered edits, comment
+   anchors, block materialization)
+4. tells every connected client to reconnect after a random delay within
+   ``DRAIN_RECONNECT_WINDOW`` seconds, with the document revision it has,
+   instead of everyone reconnecting at once
+
+Clients reconnect with ``?resume=<revision>``; if the document has not
+moved on they get a content-less ``document_load``, and resumed sessions
+write no join/leave activity rows. A drain is triggered by SIGTERM (the
+handler is chained in front of the server's own) or by the
+``drain_worker`` management command.
+"""
+import asyncio
+import logging
+import os
+import random
+import signal
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import blocks as block_storage
+from .affinity import room_router
+from .anchors import anchor_tracker
+from .buffering import edit_buffer
+from .caching import invalidate_document
+from .fanout import viewer_fanout
+from .models import Document
+
+logger = logging.getLogger(__name__)
+
+
+def worker_clients_group(worker):
+    """Group of every websocket connected to ``worker``"""
+    return f'worker_{worker}'
+
+
+def drain_control_group(worker):
+    """Group the drain controller of ``worker`` listens on"""
+    return f'worker_{worker}_drain'
+
+
+def flush_document(document_id):
+    """Write out state a block-mode document only keeps in its block table"""
+    if Document.objects.filter(id=document_id, storage_mode='blocks').exists():
+        block_storage.materialize(document_id)
+        invalidate_document(document_id)
+
+
+def document_revisions(document_ids):
+    return {
+        str(document_id): revision
+        for document_id, revision in Document.objects.filter(id__in=document_ids).values_list('id', 'revision')
+    }
+
+
+class DrainController:
+    def __init__(self, channel_layer=None):
+        self._channel_layer = channel_layer
+        self.draining = False
+        self.loop = None
+        self.control_channel = None
+        self._task = None
+
+    @property
+    def channel_layer(self):
+        if self._channel_layer is None:
+            self._channel_layer = get_channel_layer()
+        return self._channel_layer
+
+    @property
+    def window(self):
+        return getattr(settings, 'DRAIN_RECONNECT_WINDOW', 10)
+
+    def reconnect_delay(self, window=None):
+        """Random reconnect delay in milliseconds, spreading clients over the window"""
+        window = self.window if window is None else window
+        return int(random.uniform(0.5, max(window, 0.5)) * 1000)
+
+    async def start(self):
+        """Listen for drain requests and hook SIGTERM (idempotent; runs on first connect)"""
+        if self._task is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.control_channel = await self.channel_layer.new_channel()
+        await self.channel_layer.group_add(drain_control_group(room_router.worker), self.control_channel)
+        self._task = asyncio.ensure_future(self._control_loop())
+        if getattr(settings, 'DRAIN_ON_SIGTERM', True):
+            self.install_signal_handler()
+
+    async def _control_loop(self):
+        while True:
+            try:
+                message = await self.channel_layer.receive(self.control_channel)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Drain control channel failed: %s', e)
+                await asyncio.sleep(1)
+                continue
+            if message.get('type') == 'worker.drain':
+                await self.drain(message.get('window'))
+
+    async def drain(self, window=None):
+        """Hand off every room on this worker and send its clients elsewhere"""
+        if self.draining:
+            return
+        self.draining = True
+        window = self.window if window is None else window
+        logger.info('Draining worker %s over %ss', room_router.worker, window)
+
+        await room_router.stop()
+        document_ids = list(room_router.rooms)
+        for document_id in list(viewer_fanout.pending()):
+            await viewer_fanout.flush(document_id)
+        await edit_buffer.flush_all()
+        await anchor_tracker.flush_all()
+        for document_id in document_ids:
+            try:
+                await database_sync_to_async(flush_document)(document_id)
+            except Exception as e:
+                logger.warning('Flushing document %s failed: %s', document_id, e)
+        revisions = await database_sync_to_async(document_revisions)(document_ids)
+
+        await self.channel_layer.group_send(worker_clients_group(room_router.worker), {
+            'type': 'worker_drain',
+            'window': window,
+            'revisions': revisions,
+        })
+
+    def install_signal_handler(self, signum=signal.SIGTERM):
+        """
+        Drain on ``signum``, then hand the signal to the previous handler.
+
+        Installed after the server has set up its own handlers, so the
+        server still shuts down normally once clients have been told to
+        move, ``DRAIN_GRACE`` seconds later.
+        """
+        try:
+            previous = signal.getsignal(signum)
+
+            def handler(received, frame):
+                if self.draining or self.loop is None or self.loop.is_closed():
+                    self.chain(previous, received, frame)
+                    return
+                self.loop.call_soon_threadsafe(
+                    lambda: asyncio.ensure_future(self.drain_then_chain(previous, received, frame))
+                )
+
+            signal.signal(signum, handler)
+        except ValueError:
+            # Not the main thread; rely on the drain_worker command instead
+            logger.info('Not hooking signal %s outside the main thread', signum)
+
+    async def drain_then_chain(self, previous, received, frame):
+        try:
+            await self.drain()
+            await asyncio.sleep(getattr(settings, 'DRAIN_GRACE', 2))
+        finally:
+            self.chain(previous, received, frame)
+
+    @staticmethod
+    def chain(previous, received, frame):
+        if callable(previous):
+            previous(received, frame)
+        elif previous == signal.SIG_DFL:
+            signal.signal(received, signal.SIG_DFL)
+            os.kill(os.getpid(), received)
+
+
+drain_controller = DrainController()
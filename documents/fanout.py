@@ -0,0 +1,100 @@
+"""
+Read-only viewer fan-out tier.
+
+Viewers of a document do not join the editor room. They sit in a
+separate ``document_{id}_viewers`` group that receives coalesced content
+snapshots at most once per ``VIEWER_SNAPSHOT_INTERVAL`` seconds, so a
+document with thousands of readers adds one group_send per interval to
+the editing worker instead of one per edit and per cursor move.
+"""
+import asyncio
+import logging
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .frames import group_event
+
+logger = logging.getLogger(__name__)
+
+
+def viewer_group_name(document_id):
+    return f'document_{document_id}_viewers'
+
+
+class ViewerSnapshotThrottle:
+    """
+    Coalesces editor content into throttled viewer snapshots.
+
+    Only the most recent content per document is kept. The first edit after
+    a quiet period is flushed immediately; edits arriving within the
+    interval replace the pending snapshot and go out when it elapses.
+    """
+
+    def __init__(self, interval=None, channel_layer=None):
+        self._interval = interval
+        self._channel_layer = channel_layer
+        self._pending = {}
+        self._last_flush = {}
+        self._timers = {}
+
+    @property
+    def interval(self):
+        if self._interval is None:
+            return getattr(settings, 'VIEWER_SNAPSHOT_INTERVAL', 1.0)
+        return self._interval
+
+    @property
+    def channel_layer(self):
+        if self._channel_layer is None:
+            self._channel_layer = get_channel_layer()
+        return self._channel_layer
+
+    async def publish(self, document_id, content, **fields):
+        """Offer new content for the viewers of ``document_id``"""
+        self._pending[document_id] = dict(fields, content=content)
+        if document_id in self._timers:
+            return
+
+        elapsed = time.monotonic() - self._last_flush.get(document_id, 0)
+        if elapsed >= self.interval:
+            await self.flush(document_id)
+        else:
+            self._timers[document_id] = asyncio.get_running_loop().call_later(
+                self.interval - elapsed,
+                lambda: asyncio.ensure_future(self._flush_scheduled(document_id)),
+            )
+
+    async def _flush_scheduled(self, document_id):
+        self._timers.pop(document_id, None)
+        await self.flush(document_id)
+
+    async def flush(self, document_id):
+        """Send the pending snapshot for ``document_id``, if any"""
+        snapshot = self._pending.pop(document_id, None)
+        if snapshot is None:
+            return
+        self._last_flush[document_id] = time.monotonic()
+        try:
+            await self.channel_layer.group_send(
+                viewer_group_name(document_id),
+                group_event('viewer_snapshot', dict(snapshot, type='edit', snapshot=True)),
+            )
+        except Exception as e:
+            logger.warning('Viewer snapshot for document %s failed: %s', document_id, e)
+
+    def pending(self):
+        """Documents with a snapshot waiting to be flushed"""
+        return list(self._pending)
+
+    def forget(self, document_id):
+        """Drop all throttle state for ``document_id``"""
+        timer = self._timers.pop(document_id, None)
+        if timer is not None:
+            timer.cancel()
+        self._pending.pop(document_id, None)
+        self._last_flush.pop(document_id, None)
+
+
+viewer_fanout = ViewerSnapshotThrottle()
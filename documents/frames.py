@@ -0,0 +1,49 @@
+"""
+Outbound websocket frame encoding.
+
+Group events are serialized once by the sender and carried through the
+channel layer as ready-to-send text, so each room member only has to
+filter and forward the frame instead of rebuilding and re-encoding it.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+def _default(value):
+    """Fallback for values the stdlib encoder cannot handle (datetimes etc.)"""
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    def dumps(payload):
+        """Serialize ``payload`` to a JSON text frame"""
+        return orjson.dumps(payload, default=_default).decode('utf-8')
+else:
+    _encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=_default)
+
+    def dumps(payload):
+        """Serialize ``payload`` to a JSON text frame"""
+        return _encoder.encode(payload)
+
+
+def group_event(handler, payload, sender_id=None, **extra):
+    """
+    Build a channel layer group message carrying a pre-encoded frame.
+
+    ``handler`` is the consumer method name the layer dispatches to,
+    ``payload`` the client-facing dict and ``sender_id`` the originating
+    user so handlers can skip echoing the frame back when needed.
+    """
+    event = {
+        'type': handler,
+        'frame': dumps(payload),
+        'user_id': sender_id,
+    }
+    event.update(extra)
+    return event
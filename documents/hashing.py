@@ -0,0 +1,19 @@
+"""
+Canonical hashing of document content.
+
+Tiptap JSON is serialized with sorted keys and no insignificant whitespace
+before hashing, so two semantically identical trees always hash the same
+regardless of key order in the stored JSON.
+"""
+import hashlib
+import json
+
+
+def canonical_json(content):
+    """Serialize ``content`` to its canonical JSON text"""
+    return json.dumps(content, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def content_hash(content):
+    """Return the hex SHA-256 digest of the canonical form of ``content``"""
+    return hashlib.sha256(canonical_json(content).encode('utf-8')).hexdigest()
@@ -0,0 +1,336 @@
+"""
+Importing DOCX, PDF and plain text files as documents.
+
+An upload is streamed to a file under ``IMPORT_DIR`` and recorded as an
+``ImportJob``; the request returns at once and the client polls the job for
+progress. A ZIP upload imports every supported file in it as its own
+document (bulk mode).
+
+Jobs run on a background thread of the process that received them, and the
+parsing itself (``parsers``) in a pool of ``IMPORT_WORKERS`` processes, so
+a big PDF doesn't hold the GIL of a web worker. At most two files per
+worker are in flight, whatever the size of the ZIP. Parsed files are saved
+``IMPORT_BATCH_SIZE`` at a time, one transaction per batch, and the job's
+counters are written back every ``IMPORT_PROGRESS_INTERVAL`` seconds.
+
+Results are taken in archive order, so a job's ``checkpoint`` (saved in the
+same transaction as the documents) is exactly the files already done. A
+running job heartbeats at least every ``IMPORT_PROGRESS_INTERVAL``; if its
+process dies, ``python manage.py resume_imports`` queues it again once it
+has been silent for ``IMPORT_STALE_AFTER`` seconds and carries on from the
+checkpoint, without duplicating documents.
+
+``python manage.py import_documents`` runs the same pipeline on files
+already on the server, for migrations too large to upload.
+"""
+import logging
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+from datetime import timedelta
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from zipfile import BadZipFile, ZipFile
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+from . import blocks as block_storage
+from .models import Document, DocumentActivity, DocumentStats, ImportJob
+from .parsers import UnreadableFile, kind_of, parse_file, parse_member
+from .stats import word_count
+
+logger = logging.getLogger(__name__)
+
+
+def import_root():
+    return Path(getattr(settings, 'IMPORT_DIR', 'imports'))
+
+
+def upload_path(job):
+    # Server-side imports point at the file where it is
+    return Path(job.path) if os.path.isabs(job.path) else import_root() / job.path
+
+
+def safe_name(name):
+    name = os.path.basename(name.replace('\\', '/')).strip().lstrip('.')
+    return name[:200] or 'upload'
+
+
+def job_kind(name):
+    """'zip' or 'file' for an importable file name"""
+    if name.lower().endswith('.zip'):
+        return 'zip'
+    if kind_of(name) is None:
+        raise UnreadableFile(f'Unsupported file type: {name} (use .docx, .pdf, .txt or a .zip of them)')
+    return 'file'
+
+
+def create_job(owner, name, path):
+    kind = job_kind(name)
+    return ImportJob.objects.create(
+        owner=owner, kind=kind, filename=name[:255], path=str(path), total=1 if kind == 'file' else 0,
+    )
+
+
+def store_upload(owner, uploaded):
+    """Stream an uploaded file to ``IMPORT_DIR`` and queue its ImportJob"""
+    name = safe_name(uploaded.name)
+    limit = settings.IMPORT_MAX_UPLOAD_SIZE if job_kind(name) == 'zip' else settings.IMPORT_MAX_FILE_SIZE
+    if uploaded.size > limit:
+        raise UnreadableFile(f'{name} is larger than {limit} bytes')
+
+    relative = Path(uuid.uuid4().hex) / name
+    target = import_root() / relative
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with open(target, 'wb') as f:
+        for chunk in uploaded.chunks():
+            f.write(chunk)
+    return create_job(owner, name, relative)
+
+
+def members(path):
+    """Names of the importable files in a ZIP, in archive order"""
+    with ZipFile(path) as archive:
+        return [
+            info.filename for info in archive.infolist()
+            if not info.is_dir()
+            and not info.filename.startswith('__MACOSX/')
+            and not os.path.basename(info.filename).startswith(('.', '~$'))
+            and kind_of(info.filename) is not None
+        ]
+
+
+def save_documents(job, parsed):
+    """Create documents from (source name, title, content) tuples in one transaction"""
+    with transaction.atomic():
+        documents = [
+            Document.objects.create(owner_id=job.owner_id, title=title, content=content)
+            for _, title, content in parsed
+        ]
+        DocumentStats.objects.bulk_create([
+            DocumentStats(document=document, word_count=word_count(document.content))
+            for document in documents
+        ])
+        DocumentActivity.objects.bulk_create([
+            DocumentActivity(
+                document=document,
+                user_id=job.owner_id,
+                activity_type='edit',
+                description=f'Imported from {name}'[:255],
+            )
+            for document, (name, _, _) in zip(documents, parsed)
+        ])
+    for document in documents:
+        if len(document.content['content']) >= settings.IMPORT_BLOCK_STORAGE_MIN:
+            block_storage.convert_to_blocks(document)
+    return documents
+
+
+class Progress:
+    """
+    A job's counters and parsed files, saved in batches.
+
+    Files finish out of order; their outcomes are taken in archive order, so
+    everything before ``next`` is done and saving records it as the job's
+    checkpoint.
+    """
+
+    def __init__(self, job):
+        self.job = job
+        self.next = job.checkpoint
+        # index -> (name, (title, content) or None, error) of files finished early
+        self.finished = {}
+        self.parsed = []
+        self.saved_at = time.monotonic()
+
+    def succeeded(self, index, name, title, content):
+        self.finished[index] = (name, (title, content), None)
+        self.advance()
+
+    def failed(self, index, name, error):
+        logger.info('Import %s: %s failed: %s', self.job.id, name, error)
+        self.finished[index] = (name, None, error)
+        self.advance()
+
+    def advance(self):
+        job = self.job
+        while self.next in self.finished:
+            name, parsed, error = self.finished.pop(self.next)
+            self.next += 1
+            if parsed is not None:
+                self.parsed.append((name, *parsed))
+                continue
+            job.processed += 1
+            job.failed += 1
+            if len(job.errors) < settings.IMPORT_ERRORS_MAX:
+                job.errors.append({'file': name, 'error': str(error)[:500]})
+        if len(self.parsed) >= settings.IMPORT_BATCH_SIZE:
+            self.save()
+        else:
+            self.save_if_due()
+
+    def save_if_due(self):
+        """Save if the last save is older than IMPORT_PROGRESS_INTERVAL; doubles as the heartbeat"""
+        if time.monotonic() - self.saved_at >= settings.IMPORT_PROGRESS_INTERVAL:
+            self.save()
+
+    def save(self, **fields):
+        """Create the parsed documents and save the job, checkpoint included, in one transaction"""
+        job = self.job
+        with transaction.atomic():
+            if self.parsed:
+                documents = save_documents(job, self.parsed)
+                job.processed += len(documents)
+                job.created += len(documents)
+                if job.kind == 'file':
+                    job.document = documents[0]
+                self.parsed = []
+            job.checkpoint = self.next
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.save(update_fields=[
+                'processed', 'created', 'failed', 'errors', 'document', 'checkpoint', 'updated_at', *fields,
+            ])
+        self.saved_at = time.monotonic()
+
+
+def run_job(job_id, runner):
+    """Import one queued job; returns it, or None if it wasn't queued"""
+    if not ImportJob.objects.filter(id=job_id, status='queued').update(status='running', updated_at=timezone.now()):
+        return None
+    job = ImportJob.objects.get(id=job_id)
+    path = upload_path(job)
+    progress = Progress(job)
+    max_size = settings.IMPORT_MAX_FILE_SIZE
+    try:
+        if not path.exists():
+            raise UnreadableFile('The uploaded file is no longer available')
+        if job.kind == 'zip':
+            try:
+                names = members(path)
+            except BadZipFile as e:
+                raise UnreadableFile(f'Not a valid ZIP file ({e})')
+            if not names:
+                raise UnreadableFile('The ZIP has no .docx, .pdf or .txt files')
+            if len(names) > settings.IMPORT_MAX_ZIP_FILES:
+                raise UnreadableFile(f'The ZIP has {len(names)} files, more than {settings.IMPORT_MAX_ZIP_FILES}')
+            tasks = (
+                (index, name, parse_member, (str(path), name, max_size))
+                for index, name in enumerate(names) if index >= job.checkpoint
+            )
+            progress.save(total=len(names))
+        else:
+            if path.stat().st_size > max_size:
+                raise UnreadableFile(f'File is larger than {max_size} bytes')
+            tasks = iter([(0, job.filename, parse_file, (str(path), job.filename))][job.checkpoint:])
+
+        # Bounded window of files in flight: memory doesn't grow with the ZIP
+        window = max(settings.IMPORT_WORKERS, 1) * 2
+        pending = {}
+
+        def collect():
+            # Wake up at least every progress interval to heartbeat
+            done, _ = wait(pending, timeout=settings.IMPORT_PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                index, name, pool = pending.pop(future)
+                try:
+                    title, content = future.result()
+                except BrokenProcessPool:
+                    runner.reset(pool)
+                    progress.failed(index, name, 'The parser crashed on this file')
+                except UnreadableFile as e:
+                    progress.failed(index, name, e)
+                except Exception as e:
+                    logger.exception('Import %s: parsing %s failed', job.id, name)
+                    progress.failed(index, name, f'Could not read file ({type(e).__name__})')
+                else:
+                    progress.succeeded(index, name, title, content)
+            progress.save_if_due()
+
+        for index, name, parse, args in tasks:
+            while len(pending) >= window:
+                collect()
+            pool = runner.pool()
+            pending[pool.submit(parse, *args)] = (index, name, pool)
+        while pending:
+            collect()
+
+        progress.save()
+        status = 'failed' if job.total and not job.created else 'done'
+        progress.save(status=status, finished_at=timezone.now())
+    except Exception as e:
+        if isinstance(e, UnreadableFile):
+            error = str(e)
+        else:
+            logger.exception('Import %s failed', job.id)
+            error = f'Import failed ({type(e).__name__})'
+        if len(job.errors) < settings.IMPORT_ERRORS_MAX:
+            job.errors.append({'file': job.filename, 'error': error[:500]})
+        progress.save(status='failed', finished_at=timezone.now())
+    finally:
+        if not os.path.isabs(job.path):
+            shutil.rmtree(path.parent, ignore_errors=True)
+    return job
+
+
+def requeue_stale(stale_after=None):
+    """
+    Queue again the jobs whose process died: queued or running, without a
+    heartbeat for ``stale_after`` (default ``IMPORT_STALE_AFTER``) seconds.
+    Returns the ids this call claimed.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.IMPORT_STALE_AFTER if stale_after is None else stale_after)
+    stale = ImportJob.objects.filter(status__in=('queued', 'running'), updated_at__lt=cutoff)
+    claimed = []
+    for job_id in stale.values_list('id', flat=True):
+        # Conditional per job: of two sweepers, only one claims it
+        if stale.filter(id=job_id).update(status='queued', updated_at=timezone.now()):
+            logger.info('Import %s: resuming a stale job', job_id)
+            claimed.append(job_id)
+    return claimed
+
+
+class ImportRunner:
+    """The process pool parsing imports, and the threads running jobs on it"""
+
+    def __init__(self):
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def pool(self):
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a web worker would copy its sockets and threads
+                self._pool = ProcessPoolExecutor(
+                    max_workers=max(settings.IMPORT_WORKERS, 1),
+                    mp_context=multiprocessing.get_context('spawn'),
+                    max_tasks_per_child=settings.IMPORT_TASKS_PER_CHILD,
+                )
+            return self._pool
+
+    def reset(self, broken):
+        """Replace the pool ``broken`` by a crashed worker (once, if it is still the current one)"""
+        with self._lock:
+            if self._pool is not broken:
+                return
+            self._pool = None
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, job_id):
+        try:
+            return run_job(job_id, self)
+        finally:
+            connections.close_all()
+
+    def start(self, job_id):
+        """Run a job on a background thread"""
+        threading.Thread(target=self.run, args=(job_id,), name=f'import-{job_id}', daemon=True).start()
+
+
+import_runner = ImportRunner()
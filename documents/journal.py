@@ -0,0 +1,283 @@
+"""
+Append-only journal of accepted document edits.
+
+Edits that are buffered in memory (see ``buffering``) are appended here and
+only acknowledged once the record is durable, so a worker that crashes
+before writing its buffer to the database loses nothing: the next start
+replays the journal into ``Document``.
+
+The journal is a directory of segment files named after the sequence
+number of their first record. A record is an 8-byte header (payload length
+and CRC-32 of the payload, big-endian) followed by the JSON payload. A
+crash can leave a torn record at the end of the last segment; reading
+stops at the first record that is short or fails its checksum.
+
+Appends go to the page cache straight away; ``commit`` waits for an fsync.
+Commits arriving within ``fsync_interval`` seconds of each other share one
+fsync (group commit), which runs off the event loop. Segments roll over at
+``segment_bytes`` and are deleted once every record in them has been
+written to the database.
+"""
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import zlib
+from pathlib import Path
+
+from django.db import transaction
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .caching import invalidate_document
+from .frames import dumps
+from .models import Document
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('>II')
+SEGMENT_PREFIX = 'segment-'
+SEGMENT_SUFFIX = '.log'
+
+
+def segment_name(first_seq):
+    return f'{SEGMENT_PREFIX}{first_seq:016d}{SEGMENT_SUFFIX}'
+
+
+def segment_paths(directory):
+    """Segment files of a journal directory, oldest first"""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    return sorted(
+        path for path in directory.iterdir()
+        if path.name.startswith(SEGMENT_PREFIX) and path.name.endswith(SEGMENT_SUFFIX)
+    )
+
+
+def encode_record(record):
+    payload = dumps(record).encode('utf-8')
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def decode_records(data):
+    """Records in ``data`` (bytes or an mmap), up to the first torn or corrupt one"""
+    offset, end = 0, len(data)
+    while offset + HEADER.size <= end:
+        length, checksum = HEADER.unpack_from(data, offset)
+        start = offset + HEADER.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            logger.warning('Journal record at offset %s is torn or corrupt; ignoring the rest', offset)
+            return
+        yield json.loads(payload)
+        offset = start + length
+
+
+def read_segment(path, use_mmap=False):
+    """All intact records of a segment file"""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return []
+        if use_mmap:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return list(decode_records(data))
+        return list(decode_records(f.read()))
+
+
+class Segment:
+    __slots__ = ('path', 'first_seq', 'last_seq', 'size')
+
+    def __init__(self, path, first_seq, last_seq, size=0):
+        self.path = path
+        self.first_seq = first_seq
+        self.last_seq = last_seq
+        self.size = size
+
+
+class EditJournal:
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, fsync=True,
+                 fsync_interval=0.005, use_mmap=False):
+        self.directory = Path(directory)
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.use_mmap = use_mmap
+        # Closed segments, oldest first; records still needed for replay
+        self.segments = []
+        self.active = None
+        self.file = None
+        self.written_seq = 0
+        self.synced_seq = 0
+        self.fsyncs = 0
+        # (seq, future) of commits waiting for the next fsync
+        self.waiters = []
+        self._sync_task = None
+
+    def open(self):
+        """Pick up segments left from a previous run and start a new one"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for path in segment_paths(self.directory):
+            records = read_segment(path, self.use_mmap)
+            first_seq = int(path.name[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)])
+            last_seq = records[-1]['seq'] if records else first_seq - 1
+            self.segments.append(Segment(path, first_seq, last_seq, path.stat().st_size))
+            self.written_seq = max(self.written_seq, last_seq)
+        self.synced_seq = self.written_seq
+        self._start_segment()
+
+    def _start_segment(self):
+        first_seq = self.written_seq + 1
+        path = self.directory / segment_name(first_seq)
+        self.file = open(path, 'ab')
+        self.active = Segment(path, first_seq, first_seq - 1)
+
+    def append(self, record):
+        """Write ``record`` (a dict) and return its sequence number; not yet durable"""
+        seq = self.written_seq + 1
+        data = encode_record(dict(record, seq=seq))
+        self.file.write(data)
+        self.written_seq = self.active.last_seq = seq
+        self.active.size += len(data)
+        if self.active.size >= self.segment_bytes:
+            self.rotate()
+        return seq
+
+    def rotate(self):
+        """Close the active segment (durably) and start the next one"""
+        self.sync()
+        self.file.close()
+        self.segments.append(self.active)
+        self._start_segment()
+
+    def sync(self):
+        """Flush and fsync the active segment in the calling thread"""
+        self.file.flush()
+        if self.fsync:
+            os.fsync(self.file.fileno())
+            self.fsyncs += 1
+        self.synced_seq = self.written_seq
+
+    async def commit(self, seq):
+        """Wait until the record ``seq`` is durable"""
+        if seq <= self.synced_seq:
+            return
+        if not self.fsync:
+            self.file.flush()
+            self.synced_seq = self.written_seq
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append((seq, future))
+        if self._sync_task is None:
+            self._sync_task = asyncio.ensure_future(self._group_sync())
+        await future
+
+    async def _group_sync(self):
+        try:
+            await asyncio.sleep(self.fsync_interval)
+            while self.waiters:
+                target = self.written_seq
+                self.file.flush()
+                # A duplicate descriptor stays valid if the segment rotates meanwhile
+                fd = os.dup(self.file.fileno())
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, os.fsync, fd)
+                finally:
+                    os.close(fd)
+                self.fsyncs += 1
+                self.synced_seq = max(self.synced_seq, target)
+                waiting, self.waiters = self.waiters, []
+                for seq, future in waiting:
+                    if seq > self.synced_seq:
+                        self.waiters.append((seq, future))
+                    elif not future.done():
+                        future.set_result(seq)
+        except Exception as e:
+            logger.error('Journal fsync failed: %s', e)
+            waiting, self.waiters = self.waiters, []
+            for _, future in waiting:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self._sync_task = None
+
+    def trim(self, before_seq):
+        """Delete segments holding only records older than ``before_seq``"""
+        if self.active.size and self.active.last_seq < before_seq:
+            self.rotate()
+        keep = []
+        for segment in self.segments:
+            if segment.last_seq < before_seq:
+                try:
+                    segment.path.unlink()
+                except FileNotFoundError:
+                    pass
+            else:
+                keep.append(segment)
+        removed = len(self.segments) - len(keep)
+        self.segments = keep
+        return removed
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    def stats(self):
+        return {
+            'directory': str(self.directory),
+            'segments': len(self.segments) + 1,
+            'bytes': sum(segment.size for segment in self.segments) + self.active.size,
+            'written_seq': self.written_seq,
+            'synced_seq': self.synced_seq,
+            'fsyncs': self.fsyncs,
+        }
+
+
+def apply_record(record):
+    """
+    Write a journaled edit to its document unless the database moved on.
+
+    A record is applied only while the document still has the content the
+    buffered edits started from (``base_hash``): a newer write made through
+    another path (e.g. a version restore) wins over the journal.
+    """
+    with transaction.atomic():
+        updated = Document.objects.filter(
+            id=record['document_id'],
+            content_hash=record['base_hash'],
+            revision__lt=record['revision'],
+        ).update(
+            content=record['content'],
+            content_hash=record['hash'],
+            revision=Greatest('revision', record['revision']),
+            updated_at=timezone.now(),
+        )
+    if updated:
+        invalidate_document(record['document_id'])
+    return bool(updated)
+
+
+def replay_directory(directory, use_mmap=False):
+    """
+    Apply the journal in ``directory`` to the database and delete it.
+
+    Only the latest record of each document matters, since records carry
+    the whole content. Returns (records read, documents updated). Must not
+    run on the journal of a live worker.
+    """
+    paths = segment_paths(directory)
+    latest = {}
+    count = 0
+    for path in paths:
+        for record in read_segment(path, use_mmap):
+            latest[record['document_id']] = record
+            count += 1
+    applied = sum(1 for record in latest.values() if apply_record(record))
+    for path in paths:
+        path.unlink()
+    return count, applied
@@ -0,0 +1,24 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from documents.activity import archive_activity
+
+
+class Command(BaseCommand):
+    help = 'Move old activity rows into compressed per-document archive files (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.ACTIVITY_ARCHIVE_AFTER_DAYS,
+                            help='Archive activity older than this many days')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows per archive file')
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        documents, rows = archive_activity(cutoff, max(options['batch_size'], 1))
+        self.stdout.write(self.style.SUCCESS(
+            f'Archived {rows} activity rows of {documents} documents older than {cutoff:%Y-%m-%d %H:%M}'
+        ))
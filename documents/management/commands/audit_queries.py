@@ -0,0 +1,125 @@
+from types import SimpleNamespace
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client, override_settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, teardown_test_environment
+from django.urls import reverse
+
+from documents.consumers import DocumentConsumer
+from documents.models import (
+    Document, DocumentActivity, DocumentComment, DocumentPermission, DocumentVersion, UserPresence,
+)
+from documents.acl import rebuild
+from documents.query_audit import QueryAudit
+from documents.stats import recompute
+
+
+def seed(scale):
+    """A database where full scans and N+1 loops are visible in the plans"""
+    users = [User.objects.create_user(f'audit{i}', password='audit') for i in range(max(scale // 10, 3))]
+    owner, collaborator = users[0], users[1]
+    documents = Document.objects.bulk_create([
+        Document(owner=users[i % len(users)], title=f'Document {i}', content={'type': 'doc', 'content': []})
+        for i in range(scale)
+    ])
+    document = documents[0]
+    DocumentPermission.objects.bulk_create([
+        DocumentPermission(document=d, user=collaborator, permission='editor')
+        for d in documents if d.owner_id != collaborator.id
+    ][:scale // 2])
+    rebuild([d.id for d in documents])
+    DocumentVersion.objects.bulk_create([
+        DocumentVersion(document=d, content={'v': n}, created_by=owner, version_number=n)
+        for d in documents[:10] for n in range(1, scale // 5 + 1)
+    ])
+    DocumentComment.objects.bulk_create([
+        DocumentComment(document=d, user=users[n % len(users)], content=f'Comment {n}', position=n)
+        for d in documents[:10] for n in range(scale // 5)
+    ])
+    DocumentActivity.objects.bulk_create([
+        DocumentActivity(document=d, user=users[n % len(users)], activity_type='edit', description='edited')
+        for d in documents[:10] for n in range(scale // 2)
+    ])
+    UserPresence.objects.bulk_create([
+        UserPresence(document=document, user=user) for user in users[:5]
+    ])
+    recompute([d.id for d in documents])
+    return SimpleNamespace(owner=owner, collaborator=collaborator, document=document)
+
+
+def consumer_for(document, user):
+    consumer = DocumentConsumer()
+    consumer.document_id = str(document.id)
+    consumer.user = user
+    consumer.own_revisions = []
+    return consumer
+
+
+def audits(data):
+    """(name, query budget, callable, QueryAudit options) for every hot path"""
+    client = Client()
+    client.force_login(data.collaborator)
+    consumer = consumer_for(data.document, data.collaborator)
+    return [
+        # Shared documents come through the permission table, so they are sorted
+        ('view dashboard', 5, lambda: client.get(reverse('dashboard')), {'allow_sorts': True}),
+        ('view editor', 6, lambda: client.get(reverse('editor', args=[data.document.id])), {}),
+        ('view get_versions', 5, lambda: client.get(reverse('get_versions', args=[data.document.id])), {}),
+        ('view document_comments', 5, lambda: client.get(
+            reverse('document_comments', args=[data.document.id]), {'resolved': 'false', 'after': 5}
+        ), {}),
+        ('view document_activity', 6, lambda: client.get(
+            reverse('document_activity', args=[data.document.id]), {'limit': 5}
+        ), {}),
+        ('consumer get_access_level', 2, async_to_sync(consumer.get_access_level), {}),
+        ('consumer get_document_payload', 2, async_to_sync(consumer.get_document_payload), {}),
+        ('consumer get_active_users', 1, async_to_sync(consumer.get_active_users), {}),
+        ('consumer add_user_presence', 3, async_to_sync(consumer.add_user_presence), {}),
+        ('consumer update_cursor_position', 1,
+         lambda: async_to_sync(consumer.update_cursor_position)(3, 3, 3), {}),
+        # Includes the version and word count updates of DocumentStats
+        ('consumer save_document', 8, lambda: async_to_sync(consumer.save_document)(
+            {'type': 'doc', 'content': [{'type': 'paragraph'}]}
+        ), {}),
+        ('consumer save_comment', 2, lambda: async_to_sync(consumer.save_comment)('Looks good', 1), {}),
+        ('consumer log_activity', 1, lambda: async_to_sync(consumer.log_activity)('edit', 'edited'), {}),
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Check query counts, N+1 loops and full table scans of the hot ORM paths (for CI)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=200,
+                            help='Number of documents to seed the audit database with')
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        runner = DiscoverRunner(verbosity=0)
+        old_config = runner.setup_databases()
+        # Without DEBUG every view would answer with an HTTPS redirect after
+        # no queries at all, and pass
+        redirect = override_settings(SECURE_SSL_REDIRECT=False)
+        redirect.enable()
+        try:
+            data = seed(options['scale'])
+            failed = 0
+            for name, budget, run, options in audits(data):
+                with QueryAudit(name, budget, **options) as audit:
+                    result = run()
+                problems = audit.problems()
+                status = getattr(result, 'status_code', None)
+                if status is not None and status != 200:
+                    problems.insert(0, f'responded {status}, expected 200')
+                self.stdout.write(audit.report(problems))
+                failed += bool(problems)
+        finally:
+            redirect.disable()
+            runner.teardown_databases(old_config)
+            teardown_test_environment()
+        if failed:
+            raise CommandError(f'{failed} hot path(s) failed the query audit')
+        self.stdout.write(self.style.SUCCESS('All hot paths within budget'))
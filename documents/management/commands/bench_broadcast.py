@@ -0,0 +1,100 @@
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from documents.consumers import DocumentConsumer
+from documents.frames import group_event
+
+
+def sample_content(paragraphs):
+    """Build a Tiptap document roughly the size of a real working draft"""
+    return {
+        'type': 'doc',
+        'content': [
+            {
+                'type': 'paragraph',
+                'content': [{'type': 'text', 'text': f'Paragraph {i} ' + 'lorem ipsum dolor sit amet ' * 8}],
+            }
+            for i in range(paragraphs)
+        ],
+    }
+
+
+def make_member(user_id, sink):
+    """A DocumentConsumer wired to an in-memory sink instead of a socket"""
+    consumer = DocumentConsumer()
+    consumer.user = SimpleNamespace(id=user_id, username=f'user{user_id}')
+
+    async def send(text_data=None, bytes_data=None, close=False):
+        sink.append(text_data)
+
+    consumer.send = send
+    return consumer
+
+
+async def legacy_document_edit(consumer, event):
+    """The pre-encode-once handler: one json.dumps per member"""
+    await consumer.send(text_data=json.dumps({
+        'type': 'edit',
+        'content': event['content'],
+        'username': event['username'],
+        'user_id': event['user_id'],
+        'timestamp': event.get('timestamp'),
+    }))
+
+
+class Command(BaseCommand):
+    help = 'Measure CPU time per document_edit broadcast against room size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1,5,10,25,50,100',
+                            help='Comma separated room sizes to measure')
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--paragraphs', type=int, default=50,
+                            help='Number of paragraphs in the broadcast document')
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',') if s]
+        asyncio.run(self.run(sizes, options['iterations'], sample_content(options['paragraphs'])))
+
+    async def run(self, sizes, iterations, content):
+        self.stdout.write(f"{'members':>8} {'legacy ms':>10} {'encoded ms':>11} {'speedup':>8}")
+        for size in sizes:
+            sink = []
+            members = [make_member(i, sink) for i in range(size)]
+            raw_event = {
+                'type': 'document_edit',
+                'content': content,
+                'username': 'user0',
+                'user_id': 0,
+                'timestamp': timezone.now().isoformat(),
+            }
+
+            start = time.process_time()
+            for _ in range(iterations):
+                for member in members:
+                    await legacy_document_edit(member, raw_event)
+                sink.clear()
+            legacy = (time.process_time() - start) / iterations
+
+            start = time.process_time()
+            for _ in range(iterations):
+                # The sender encodes once; every member only forwards.
+                event = group_event('document_edit', {
+                    'type': 'edit',
+                    'content': content,
+                    'username': 'user0',
+                    'user_id': 0,
+                    'timestamp': raw_event['timestamp'],
+                }, sender_id=0)
+                for member in members:
+                    await member.document_edit(event)
+                sink.clear()
+            encoded = (time.process_time() - start) / iterations
+
+            speedup = legacy / encoded if encoded else float('inf')
+            self.stdout.write(f'{size:>8} {legacy * 1000:>10.3f} {encoded * 1000:>11.3f} {speedup:>7.1f}x')
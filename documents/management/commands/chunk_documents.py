@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Length, Cast
+from django.db.models import TextField
+
+from documents import blocks
+from documents.models import Document
+
+
+class Command(BaseCommand):
+    help = 'Move large documents to block storage (or back with --inline)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_ids', nargs='*', type=int)
+        parser.add_argument('--min-bytes', type=int, default=256 * 1024,
+                            help='Convert every inline document whose content is at least this large')
+        parser.add_argument('--inline', action='store_true',
+                            help='Convert the given block-mode documents back to inline storage')
+
+    def handle(self, *args, **options):
+        if options['inline']:
+            queryset = Document.objects.filter(storage_mode='blocks')
+            if options['document_ids']:
+                queryset = queryset.filter(id__in=options['document_ids'])
+            for document in queryset.defer('content'):
+                blocks.convert_to_inline(document)
+                self.stdout.write(f'Document {document.id}: inline')
+            return
+
+        queryset = Document.objects.filter(storage_mode='inline')
+        if options['document_ids']:
+            queryset = queryset.filter(id__in=options['document_ids'])
+        else:
+            queryset = queryset.annotate(
+                content_size=Length(Cast('content', TextField()))
+            ).filter(content_size__gte=options['min_bytes'])
+
+        for document_id in queryset.values_list('id', flat=True):
+            document = Document.objects.get(id=document_id)
+            if blocks.convert_to_blocks(document):
+                self.stdout.write(f'Document {document.id}: {document.blocks.count()} blocks')
+            else:
+                self.stdout.write(f'Document {document.id}: content is not Tiptap JSON, left inline')
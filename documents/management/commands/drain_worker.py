@@ -0,0 +1,22 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from documents.drain import drain_control_group
+
+
+class Command(BaseCommand):
+    help = 'Drain an ASGI worker before stopping it: hand off its rooms and move its clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('worker_id', help='WORKER_ID of the worker to drain')
+        parser.add_argument('--window', type=float, default=settings.DRAIN_RECONNECT_WINDOW,
+                            help='Seconds over which clients spread their reconnects')
+
+    def handle(self, *args, **options):
+        async_to_sync(get_channel_layer().group_send)(drain_control_group(options['worker_id']), {
+            'type': 'worker.drain',
+            'window': options['window'],
+        })
+        self.stdout.write(f"Drain requested for worker {options['worker_id']}")
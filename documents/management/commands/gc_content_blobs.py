@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from documents.cloning import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Release the shared content of edited document copies and delete unused content blobs'
+
+    def handle(self, *args, **options):
+        released, deleted = collect_garbage()
+        self.stdout.write(self.style.SUCCESS(
+            f'Released {released} edited copies, deleted {deleted} unused content blobs'
+        ))
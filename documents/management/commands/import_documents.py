@@ -0,0 +1,39 @@
+import os
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.importing import create_job, import_runner
+from documents.parsers import UnreadableFile
+
+
+class Command(BaseCommand):
+    help = 'Import .docx, .pdf and .txt files (or .zip archives of them) on this server as documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Files or ZIP archives to import (left in place)')
+        parser.add_argument('--owner', required=True, help='Username owning the imported documents')
+
+    def handle(self, *args, **options):
+        try:
+            owner = User.objects.get(username=options['owner'])
+        except User.DoesNotExist:
+            raise CommandError(f"No user named {options['owner']}")
+
+        for path in options['paths']:
+            path = os.path.abspath(path)
+            if not os.path.isfile(path):
+                self.stderr.write(f'{path}: not a file')
+                continue
+            try:
+                job = create_job(owner, os.path.basename(path), path)
+            except UnreadableFile as e:
+                self.stderr.write(f'{path}: {e}')
+                continue
+            job = import_runner.run(job.id)
+            for error in job.errors:
+                self.stderr.write(f"{error['file']}: {error['error']}")
+            style = self.style.SUCCESS if job.status == 'done' else self.style.ERROR
+            self.stdout.write(style(
+                f'{path}: {job.created} documents imported, {job.failed} files failed ({job.status})'
+            ))
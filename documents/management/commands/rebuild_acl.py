@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from documents.acl import rebuild
+from documents.models import Document
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the materialized document ACL from direct and group grants'
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_ids', nargs='*', type=int,
+                            help='Documents to rebuild (default: every document)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Documents rebuilt per transaction')
+
+    def handle(self, *args, **options):
+        ids = Document.objects.order_by('id').values_list('id', flat=True)
+        if options['document_ids']:
+            ids = ids.filter(id__in=options['document_ids'])
+        ids = list(ids)
+        batch_size = max(options['batch_size'], 1)
+
+        entries = 0
+        for start in range(0, len(ids), batch_size):
+            entries += rebuild(ids[start:start + batch_size])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt the ACL of {len(ids)} documents ({entries} entries)'))
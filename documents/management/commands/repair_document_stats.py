@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+
+from documents.models import Document, DocumentStats
+from documents.stats import FIELDS, compute, recompute
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-document counters (versions, comments, collaborators, words) in bulk'
+
+    def add_arguments(self, parser):
+        parser.add_argument('document_ids', nargs='*', type=int,
+                            help='Documents to repair (default: every document)')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Documents recomputed per query')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report documents whose stored counters are wrong')
+
+    def handle(self, *args, **options):
+        ids = Document.objects.order_by('id').values_list('id', flat=True)
+        if options['document_ids']:
+            ids = ids.filter(id__in=options['document_ids'])
+        ids = list(ids)
+        batch_size = max(options['batch_size'], 1)
+
+        checked = drifted = 0
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            if options['dry_run']:
+                stored = {
+                    row['document_id']: row
+                    for row in DocumentStats.objects.filter(document_id__in=batch).values('document_id', *FIELDS)
+                }
+                for stats in compute(batch):
+                    row = stored.get(stats.document_id)
+                    wrong = [f for f in FIELDS if row is None or row[f] != getattr(stats, f)]
+                    if wrong:
+                        drifted += 1
+                        self.stdout.write(f"Document {stats.document_id}: {', '.join(wrong)}")
+                checked += len(batch)
+            else:
+                checked += len(recompute(batch))
+
+        if options['dry_run']:
+            self.stdout.write(f'{drifted} of {checked} documents have wrong counters')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Recomputed stats of {checked} documents'))
@@ -0,0 +1,34 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.journal import replay_directory
+
+
+class Command(BaseCommand):
+    help = 'Apply the edit journals of stopped workers to the database and delete them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('worker_ids', nargs='*',
+                            help='WORKER_IDs whose journals to replay (default: every journal)')
+        parser.add_argument('--dir', default=settings.EDIT_JOURNAL_DIR,
+                            help='Journal root directory')
+        parser.add_argument('--mmap', action='store_true', default=settings.EDIT_JOURNAL_MMAP,
+                            help='Read segments through mmap')
+
+    def handle(self, *args, **options):
+        root = Path(options['dir'])
+        if options['worker_ids']:
+            directories = [root / worker for worker in options['worker_ids']]
+        elif root.is_dir():
+            directories = sorted(path for path in root.iterdir() if path.is_dir())
+        else:
+            directories = []
+        missing = [str(directory) for directory in directories if not directory.is_dir()]
+        if missing:
+            raise CommandError(f"No journal at {', '.join(missing)}")
+
+        for directory in directories:
+            records, applied = replay_directory(directory, options['mmap'])
+            self.stdout.write(f'{directory.name}: {records} records, {applied} documents updated')
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from documents.importing import import_runner, requeue_stale
+
+
+class Command(BaseCommand):
+    help = 'Resume import jobs whose process died (restart, deploy, drain), from where they stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=float, default=None,
+                            help='Seconds without a heartbeat before a job counts as stale '
+                                 '(default IMPORT_STALE_AFTER)')
+
+    def handle(self, *args, **options):
+        job_ids = requeue_stale(options['stale_after'])
+        for job_id in job_ids:
+            job = import_runner.run(job_id)
+            if job is None:
+                continue
+            style = self.style.SUCCESS if job.status == 'done' else self.style.ERROR
+            self.stdout.write(style(
+                f'{job.filename}: {job.created} documents imported, {job.failed} files failed ({job.status})'
+            ))
+        self.stdout.write(self.style.SUCCESS(f'Resumed {len(job_ids)} stale import jobs'))
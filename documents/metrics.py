@@ -0,0 +1,40 @@
+"""
+In-process counters for the worker.
+
+Deliberately tiny: counters are keyed by name plus optional labels and
+read back through ``snapshot()`` (exposed by the worker stats endpoint).
+They reset when the process restarts.
+"""
+import threading
+from collections import Counter
+
+
+class Metrics:
+    def __init__(self):
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name, labels):
+        if not labels:
+            return name
+        return name + '{' + ','.join(f'{k}={v}' for k, v in sorted(labels.items())) + '}'
+
+    def incr(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[self.key(name, labels)] += amount
+
+    def get(self, name, **labels):
+        with self._lock:
+            return self._counters[self.key(name, labels)]
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='storage_mode',
+            field=models.CharField(choices=[('inline', 'Inline'), ('blocks', 'Blocks')], default='inline', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='DocumentBlock',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block_id', models.CharField(max_length=32)),
+                ('position', models.IntegerField()),
+                ('content', models.JSONField()),
+                ('content_hash', models.CharField(max_length=64)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='blocks', to='documents.document')),
+            ],
+            options={
+                'ordering': ['position'],
+                'indexes': [models.Index(fields=['document', 'position'], name='documents_d_documen_fb3eba_idx')],
+                'unique_together': {('document', 'block_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:20
+
+from django.db import migrations, models
+
+from documents.hashing import content_hash
+
+
+def backfill_content_hashes(apps, schema_editor):
+    for model_name in ('Document', 'DocumentVersion'):
+        model = apps.get_model('documents', model_name)
+        rows = model.objects.filter(content_hash='').values_list('id', 'content')
+        for pk, content in rows.iterator(chunk_size=500):
+            model.objects.filter(id=pk).update(content_hash=content_hash(content))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_document_blocks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='documentversion',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='documentversion',
+            index=models.Index(fields=['document', 'content_hash'], name='documents_d_documen_28a0cd_idx'),
+        ),
+        migrations.RunPython(backfill_content_hashes, migrations.RunPython.noop),
+    ]
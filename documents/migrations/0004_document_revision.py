@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='revision',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
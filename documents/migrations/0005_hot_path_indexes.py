@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_document_revision'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['owner', '-updated_at'], name='doc_owner_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documentactivity',
+            index=models.Index(fields=['document', '-created_at'], name='activity_doc_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documentcomment',
+            index=models.Index(fields=['document', 'created_at'], name='comment_doc_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documentversion',
+            index=models.Index(fields=['document', '-version_number'], name='version_doc_number_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userpresence',
+            index=models.Index(fields=['last_seen'], name='presence_last_seen_idx'),
+        ),
+    ]
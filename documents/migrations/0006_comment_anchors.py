@@ -0,0 +1,22 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentcomment',
+            name='anchor_revision',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='documentcomment',
+            index=models.Index(fields=['document', 'resolved', 'id'], name='comment_doc_resolved_idx'),
+        ),
+    ]
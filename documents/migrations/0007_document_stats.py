@@ -0,0 +1,26 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_comment_anchors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentStats',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='documents.document')),
+                ('version_count', models.PositiveIntegerField(default=0)),
+                ('comment_count', models.PositiveIntegerField(default=0)),
+                ('unresolved_comment_count', models.PositiveIntegerField(default=0)),
+                ('collaborator_count', models.PositiveIntegerField(default=0)),
+                ('word_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
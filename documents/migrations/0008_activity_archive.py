@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 02:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0007_document_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=255)),
+                ('first_id', models.BigIntegerField()),
+                ('last_id', models.BigIntegerField()),
+                ('first_at', models.DateTimeField()),
+                ('last_at', models.DateTimeField()),
+                ('row_count', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-last_id'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='documentactivity',
+            index=models.Index(fields=['created_at'], name='activity_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='activityarchive',
+            name='document',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_archives', to='documents.document'),
+        ),
+        migrations.AddIndex(
+            model_name='activityarchive',
+            index=models.Index(fields=['document', '-last_id'], name='archive_doc_last_idx'),
+        ),
+    ]
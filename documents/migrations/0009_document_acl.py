@@ -0,0 +1,60 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_direct_grants(apps, schema_editor):
+    """Existing shares are all direct: each becomes an ACL row"""
+    DocumentPermission = apps.get_model('documents', 'DocumentPermission')
+    DocumentACL = apps.get_model('documents', 'DocumentACL')
+    DocumentACL.objects.bulk_create([
+        DocumentACL(
+            document_id=document_id,
+            user_id=user_id,
+            permission='viewer' if permission == 'viewer' else 'editor',
+        )
+        for document_id, user_id, permission in DocumentPermission.objects.values_list(
+            'document_id', 'user_id', 'permission'
+        ).iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('documents', '0008_activity_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentGroupPermission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('permission', models.CharField(choices=[('editor', 'Editor'), ('viewer', 'Viewer')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='group_permissions', to='documents.document')),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_permissions', to='auth.group')),
+            ],
+            options={
+                'unique_together': {('document', 'group')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DocumentACL',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('permission', models.CharField(choices=[('editor', 'Editor'), ('viewer', 'Viewer')], max_length=10)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='acl', to='documents.document')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='document_acl', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'document'], name='acl_user_doc_idx')],
+                'unique_together': {('document', 'user')},
+            },
+        ),
+        migrations.RunPython(copy_direct_grants, migrations.RunPython.noop),
+    ]
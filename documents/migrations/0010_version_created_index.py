@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0009_document_acl'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='documentversion',
+            index=models.Index(fields=['document', 'created_at'], name='version_doc_created_idx'),
+        ),
+    ]
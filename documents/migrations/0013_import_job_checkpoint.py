@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 03:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0012_content_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='checkpoint',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -1,21 +1,88 @@
 from django.db import models
-from django.contrib.auth.models import User
+from django.contrib.auth.models import Group, User
 from django.utils import timezone
 import json
+from .hashing import content_hash
 
-class Document(models.Model):
+
+class ContentHashMixin:
+    """Keeps `content_hash` in step with `content` on every save()"""
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        # A copy-on-write clone keeps the shared blob's hash until real content is set
+        shared = getattr(self, 'shares_content', False) and not self.content
+        if (update_fields is None or 'content' in update_fields) and not shared:
+            self.content_hash = content_hash(self.content)
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'content_hash'}
+        super().save(*args, **kwargs)
+
+class ContentBlob(models.Model):
+    """
+    Immutable content stored once under its canonical hash, shared by
+    copy-on-write clones and templates
+    """
+    hash = models.CharField(max_length=64, primary_key=True)
+    content = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return self.hash
+
+class Document(ContentHashMixin, models.Model):
+    STORAGE_MODES = [
+        ('inline', 'Inline'),
+        ('blocks', 'Blocks'),
+    ]
+    
     title = models.CharField(max_length=255, default='Untitled Document')
     content = models.JSONField(default=dict)  # Stores Tiptap JSON content
+    content_hash = models.CharField(max_length=64, blank=True)  # Canonical SHA-256 of content
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_documents')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_public = models.BooleanField(default=False)
+    # 'blocks': top-level nodes live in DocumentBlock and `content` is a
+    # periodically materialized copy kept for compatibility
+    storage_mode = models.CharField(max_length=10, choices=STORAGE_MODES, default='inline')
+    # Bumped by every write through documents.concurrency (compare-and-set)
+    revision = models.PositiveBigIntegerField(default=0)
+    # Copy-on-write clones: while content_hash is still the blob's hash the
+    # content is the blob's and `content` is left empty (see documents.cloning)
+    blob = models.ForeignKey(ContentBlob, on_delete=models.PROTECT, null=True, blank=True, related_name='+')
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Dashboard: a user's documents, most recently updated first
+            models.Index(fields=['owner', '-updated_at'], name='doc_owner_updated_idx'),
+        ]
     
     def __str__(self):
         return self.title
+    
+    @property
+    def shares_content(self):
+        """True while this clone hasn't been edited and reads its content from ``blob``"""
+        return self.blob_id is not None and self.blob_id == self.content_hash
+
+class DocumentBlock(models.Model):
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='blocks')
+    block_id = models.CharField(max_length=32)  # Stable across edits and moves
+    position = models.IntegerField()
+    content = models.JSONField()  # One top-level Tiptap node
+    content_hash = models.CharField(max_length=64)
+    
+    class Meta:
+        ordering = ['position']
+        unique_together = ('document', 'block_id')
+        indexes = [
+            models.Index(fields=['document', 'position']),
+        ]
+    
+    def __str__(self):
+        return f"{self.document.title} - block {self.position}"
 
 class DocumentPermission(models.Model):
     PERMISSION_CHOICES = [
@@ -35,9 +102,48 @@ class DocumentPermission(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.document.title} ({self.permission})"
 
-class DocumentVersion(models.Model):
+class DocumentGroupPermission(models.Model):
+    """A grant to every member of a group (team), resolved into DocumentACL"""
+    PERMISSION_CHOICES = [
+        ('editor', 'Editor'),
+        ('viewer', 'Viewer'),
+    ]
+    
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='group_permissions')
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='document_permissions')
+    permission = models.CharField(max_length=10, choices=PERMISSION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        unique_together = ('document', 'group')
+    
+    def __str__(self):
+        return f"{self.group.name} - {self.document.title} ({self.permission})"
+
+class DocumentACL(models.Model):
+    """
+    Effective access of each user to each document, materialized from
+    DocumentPermission and DocumentGroupPermission by documents.acl.
+    The owner and public access are not listed.
+    """
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='acl')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='document_acl')
+    permission = models.CharField(max_length=10, choices=DocumentGroupPermission.PERMISSION_CHOICES)
+    
+    class Meta:
+        unique_together = ('document', 'user')
+        indexes = [
+            # Dashboard: documents shared with a user
+            models.Index(fields=['user', 'document'], name='acl_user_doc_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.document_id} ({self.permission})"
+
+class DocumentVersion(ContentHashMixin, models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='versions')
     content = models.JSONField()
+    content_hash = models.CharField(max_length=64, blank=True)
     created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     version_number = models.IntegerField()
@@ -45,6 +151,13 @@ class DocumentVersion(models.Model):
     
     class Meta:
         ordering = ['-version_number']
+        indexes = [
+            models.Index(fields=['document', 'content_hash']),
+            # History listing and "latest version" lookups
+            models.Index(fields=['document', '-version_number'], name='version_doc_number_idx'),
+            # Playback seeks by time
+            models.Index(fields=['document', 'created_at'], name='version_doc_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.document.title} - v{self.version_number}"
@@ -54,11 +167,18 @@ class DocumentComment(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
     position = models.IntegerField()
+    # Document revision ``position`` was last rebased to (see anchors.py)
+    anchor_revision = models.PositiveBigIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     resolved = models.BooleanField(default=False)
     
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['document', 'created_at'], name='comment_doc_created_idx'),
+            # Keyset pages of a document's open or resolved comments
+            models.Index(fields=['document', 'resolved', 'id'], name='comment_doc_resolved_idx'),
+        ]
     
     def __str__(self):
         return f"Comment by {self.user.username} on {self.document.title}"
@@ -74,6 +194,10 @@ class UserPresence(models.Model):
     
     class Meta:
         unique_together = ('document', 'user')
+        indexes = [
+            # Stale presence sweep
+            models.Index(fields=['last_seen'], name='presence_last_seen_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} in {self.document.title}"
@@ -95,6 +219,106 @@ class DocumentActivity(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['document', '-created_at'], name='activity_doc_created_idx'),
+            # Archival: rows older than the cutoff, across documents
+            models.Index(fields=['created_at'], name='activity_created_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {self.activity_type} on {self.document.title}"
+
+class ActivityArchive(models.Model):
+    """A gzipped JSON-lines file of archived DocumentActivity rows (see activity.py)"""
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='activity_archives')
+    # Relative to ACTIVITY_ARCHIVE_DIR
+    path = models.CharField(max_length=255)
+    first_id = models.BigIntegerField()
+    last_id = models.BigIntegerField()
+    first_at = models.DateTimeField()
+    last_at = models.DateTimeField()
+    row_count = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-last_id']
+        indexes = [
+            models.Index(fields=['document', '-last_id'], name='archive_doc_last_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Activity {self.first_id}-{self.last_id} of {self.document_id}"
+
+class DocumentStats(models.Model):
+    """
+    Per-document counters, kept up to date by the write paths in
+    documents.stats instead of counting rows on every read
+    """
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    version_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    unresolved_comment_count = models.PositiveIntegerField(default=0)
+    collaborator_count = models.PositiveIntegerField(default=0)
+    word_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Stats of {self.document_id}"
+
+class ImportJob(models.Model):
+    """An uploaded file (or ZIP of files) being imported as documents"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    KIND_CHOICES = [
+        ('file', 'File'),
+        ('zip', 'ZIP archive'),
+    ]
+    
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='import_jobs')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default='file')
+    filename = models.CharField(max_length=255)
+    path = models.CharField(max_length=500)  # Upload, relative to IMPORT_DIR
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    created = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    # Files (in archive order) whose outcome is saved; a resumed job starts here
+    checkpoint = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)  # First IMPORT_ERRORS_MAX {file, error}
+    document = models.ForeignKey(Document, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['owner', '-created_at'], name='import_owner_created_idx'),
+            models.Index(fields=['status'], name='import_status_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Import {self.id} of {self.filename} ({self.status})"
+
+class DocumentTemplate(models.Model):
+    """Content documents can be created from, stored once as a ContentBlob"""
+    name = models.CharField(max_length=255)
+    description = models.CharField(max_length=255, blank=True)
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='document_templates')
+    blob = models.ForeignKey(ContentBlob, on_delete=models.PROTECT, related_name='+')
+    is_public = models.BooleanField(default=False)  # Usable by every user
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['name']
+        indexes = [
+            models.Index(fields=['owner', 'name'], name='template_owner_name_idx'),
+        ]
+    
+    def __str__(self):
+        return self.name
@@ -0,0 +1,189 @@
+"""
+Parsers turning uploaded DOCX, PDF and plain text files into Tiptap JSON.
+
+These run in the import process pool, so this module must not need Django:
+it only reads files and returns ``(title, content)``. Each format is read
+piece by piece (DOCX body elements, PDF pages, text lines) and the Tiptap
+nodes are built as it goes.
+"""
+import io
+import os
+import zipfile
+from functools import lru_cache
+
+SUPPORTED = {'.docx': 'docx', '.pdf': 'pdf', '.txt': 'txt', '.text': 'txt', '.md': 'txt'}
+
+# python-docx style names -> Tiptap list types
+LIST_STYLES = {'List Bullet': 'bulletList', 'List Number': 'orderedList'}
+
+
+class UnreadableFile(ValueError):
+    """A file that can't be imported; the message is shown to the user"""
+
+
+def kind_of(name):
+    return SUPPORTED.get(os.path.splitext(name)[1].lower())
+
+
+def title_of(name):
+    return os.path.splitext(os.path.basename(name))[0][:255] or 'Untitled Document'
+
+
+def text_node(text, marks=None):
+    node = {'type': 'text', 'text': text}
+    if marks:
+        node['marks'] = [{'type': mark} for mark in marks]
+    return node
+
+
+def paragraph(children):
+    node = {'type': 'paragraph'}
+    if children:
+        node['content'] = children
+    return node
+
+
+def text_blocks(lines):
+    """Paragraphs from lines of text: blank lines separate paragraphs"""
+    current = []
+    for line in lines:
+        line = line.rstrip('\r\n').replace('\x00', '')
+        if line.strip():
+            current.append(line.strip())
+        elif current:
+            yield paragraph([text_node(' '.join(current))])
+            current = []
+    if current:
+        yield paragraph([text_node(' '.join(current))])
+
+
+def parse_txt(stream):
+    reader = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace')
+    return list(text_blocks(reader))
+
+
+def docx_runs(paragraph_):
+    children = []
+    for run in paragraph_.runs:
+        if not run.text:
+            continue
+        marks = [mark for mark, on in (('bold', run.bold), ('italic', run.italic), ('underline', run.underline)) if on]
+        if children and children[-1].get('marks', []) == [{'type': mark} for mark in marks]:
+            # Word splits text into many runs of the same formatting
+            children[-1]['text'] += run.text
+        else:
+            children.append(text_node(run.text, marks))
+    return children
+
+
+def heading_level(style):
+    """Heading level of a paragraph style, or None"""
+    if style == 'Title':
+        return 1
+    level = style[len('Heading '):] if style.startswith('Heading ') else ''
+    return min(int(level), 6) if level.isdigit() and int(level) > 0 else None
+
+
+def docx_blocks(document):
+    from docx.table import Table
+    from docx.text.paragraph import Paragraph
+
+    body = document.element.body
+    open_list = None
+    for element in body.iterchildren():
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 'p':
+            item = Paragraph(element, document)
+            style = item.style.name if item.style is not None else ''
+            children = docx_runs(item)
+            list_type = LIST_STYLES.get(style.rstrip(' 0123456789')) if style.startswith('List') else None
+            if list_type:
+                if open_list is None or open_list['type'] != list_type:
+                    if open_list is not None:
+                        yield open_list
+                    open_list = {'type': list_type, 'content': []}
+                open_list['content'].append({'type': 'listItem', 'content': [paragraph(children)]})
+                continue
+            if open_list is not None:
+                yield open_list
+                open_list = None
+            level = heading_level(style)
+            if level and children:
+                yield {'type': 'heading', 'attrs': {'level': level}, 'content': children}
+            else:
+                yield paragraph(children)
+        elif tag == 'tbl':
+            if open_list is not None:
+                yield open_list
+                open_list = None
+            # The editor has no tables: one paragraph per row, cells separated by |
+            for row in Table(element, document).rows:
+                cells = [cell.text.strip() for cell in row.cells]
+                if any(cells):
+                    yield paragraph([text_node(' | '.join(cells))])
+    if open_list is not None:
+        yield open_list
+
+
+def parse_docx(stream):
+    import docx
+
+    try:
+        document = docx.Document(stream)
+    except (zipfile.BadZipFile, KeyError, ValueError) as e:
+        raise UnreadableFile(f'Not a valid DOCX file ({e})')
+    return list(docx_blocks(document))
+
+
+def parse_pdf(stream):
+    from PyPDF2 import PdfReader
+    from PyPDF2.errors import PdfReadError
+
+    try:
+        reader = PdfReader(stream)
+        if reader.is_encrypted:
+            raise UnreadableFile('Encrypted PDFs are not supported')
+        blocks = []
+        for page in reader.pages:
+            blocks.extend(text_blocks((page.extract_text() or '').splitlines()))
+    except PdfReadError as e:
+        raise UnreadableFile(f'Not a valid PDF file ({e})')
+    return blocks
+
+
+PARSERS = {'docx': parse_docx, 'pdf': parse_pdf, 'txt': parse_txt}
+
+
+def parse_stream(name, stream):
+    kind = kind_of(name)
+    if kind is None:
+        raise UnreadableFile(f'Unsupported file type: {name}')
+    return title_of(name), {'type': 'doc', 'content': PARSERS[kind](stream)}
+
+
+def parse_file(path, name):
+    """(title, Tiptap doc) of the file at ``path``, uploaded as ``name``"""
+    with open(path, 'rb') as stream:
+        return parse_stream(name, stream)
+
+
+@lru_cache(maxsize=4)
+def open_archive(path):
+    # Reading the central directory of a big ZIP is costly: each pool
+    # process does it once per archive, not once per member
+    return zipfile.ZipFile(path)
+
+
+def parse_member(path, name, max_size):
+    """(title, Tiptap doc) of the member ``name`` of the ZIP file at ``path``"""
+    archive = open_archive(path)
+    info = archive.getinfo(name)
+    if info.file_size > max_size:
+        raise UnreadableFile(f'File is larger than {max_size} bytes')
+    with archive.open(info) as member:
+        # DOCX and PDF parsers need to seek; read at most max_size, so a
+        # member lying about its size can't blow up memory
+        data = member.read(max_size + 1)
+    if len(data) > max_size:
+        raise UnreadableFile(f'File is larger than {max_size} bytes')
+    return parse_stream(name, io.BytesIO(data))
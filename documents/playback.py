@@ -0,0 +1,194 @@
+"""
+Time-travel playback of a document's history.
+
+A playback is a stream of newline-delimited JSON frames over a range of
+versions: a ``snapshot`` (the full content of the version the range starts
+at), then one ``delta`` per later version, and an ``end`` frame. Every
+``PLAYBACK_KEYFRAME_INTERVAL`` versions a ``keyframe`` with the full
+content takes the place of a delta, so a player can scrub to any point by
+starting from the nearest keyframe before it.
+
+A delta edits the previous version's top-level blocks, in order:
+``["retain", n]`` keeps the next n blocks, ``["delete", n]`` drops them and
+``["insert", [nodes]]`` adds new ones. After trimming the blocks both
+versions start and end with, blocks are matched on their content hashes
+like version diffs (see ``diffing``). Content that isn't a Tiptap document
+(legacy HTML) is sent whole as ``"content"`` instead of ``"ops"``.
+
+Versions are read in batches of ``PLAYBACK_BATCH_SIZE`` by version number
+through the (document, version number) index, and only the previous
+version's blocks are kept, so memory stays flat however long the history.
+The start of a range is found with one index seek, by version number or by
+time through the (document, created_at) index.
+"""
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from .blocks import split_blocks
+from .diffing import match
+from .frames import dumps
+from .hashing import content_hash
+from .models import DocumentVersion
+
+VERSION_FIELDS = ('version_number', 'created_at', 'created_by__username', 'change_summary', 'content')
+
+
+def block_ops(old_nodes, new_nodes):
+    """Retain/delete/insert operations turning the old blocks into the new ones"""
+    # Most versions change a few blocks: trim the common ends by plain
+    # equality and only hash what is left
+    head = 0
+    while head < len(old_nodes) and head < len(new_nodes) and old_nodes[head] == new_nodes[head]:
+        head += 1
+    tail = 0
+    while tail < len(old_nodes) - head and tail < len(new_nodes) - head \
+            and old_nodes[-1 - tail] == new_nodes[-1 - tail]:
+        tail += 1
+    old_hashes = [content_hash(node) for node in old_nodes[head:len(old_nodes) - tail]]
+    new_hashes = [content_hash(node) for node in new_nodes[head:len(new_nodes) - tail]]
+    middle = new_nodes[head:len(new_nodes) - tail]
+
+    matched = []
+    match(old_hashes, new_hashes, 0, len(old_hashes), 0, len(new_hashes), matched)
+    matched.append((len(old_hashes), len(new_hashes)))
+    ops = [['retain', head]] if head else []
+    old_at = new_at = 0
+    for i, j in matched:
+        if i > old_at:
+            ops.append(['delete', i - old_at])
+        if j > new_at:
+            ops.append(['insert', middle[new_at:j]])
+        if i < len(old_hashes):
+            if ops and ops[-1][0] == 'retain':
+                ops[-1][1] += 1
+            else:
+                ops.append(['retain', 1])
+        old_at, new_at = i + 1, j + 1
+    if tail:
+        if ops and ops[-1][0] == 'retain':
+            ops[-1][1] += tail
+        else:
+            ops.append(['retain', tail])
+    return ops
+
+
+class Playback:
+    """
+    The frames of one document's history between two points.
+
+    ``start`` and ``stop`` are version numbers, ``since`` and ``until``
+    datetimes; either pair may be left out. Iterate it from sync code or
+    ``async for`` it from async code; each batch of versions is read and
+    encoded in one go.
+    """
+
+    def __init__(self, document_id, start=None, stop=None, since=None, until=None, using=None,
+                 keyframe_interval=None, batch_size=None):
+        self.document_id = document_id
+        self.start = start
+        self.stop = stop
+        self.since = since
+        self.until = until
+        # Reads happen after the view returned, outside its replica routing
+        self.using = using or 'default'
+        self.keyframe_interval = max(keyframe_interval or settings.PLAYBACK_KEYFRAME_INTERVAL, 1)
+        self.batch_size = max(batch_size or settings.PLAYBACK_BATCH_SIZE, 1)
+        self.cursor = None   # version number of the last frame sent
+        self.nodes = None    # top-level blocks of that version, None for non-block content
+        self.sent = 0
+        self.done = False
+
+    def versions(self):
+        return DocumentVersion.objects.using(self.using).filter(document_id=self.document_id)
+
+    def seek(self):
+        """The version the playback starts from: the state at ``start``/``since``"""
+        versions = self.versions()
+        if self.start is not None:
+            versions = versions.filter(version_number__lte=self.start)
+        if self.since is not None:
+            before = versions.filter(created_at__lte=self.since).order_by('-created_at').values(*VERSION_FIELDS).first()
+            if before is not None:
+                return before
+            # Nothing yet at ``since``: start from the first version after it
+            return self.versions().order_by('version_number').values(*VERSION_FIELDS).first()
+        if self.start is not None:
+            row = versions.order_by('-version_number').values(*VERSION_FIELDS).first()
+            if row is not None:
+                return row
+        return self.versions().order_by('version_number').values(*VERSION_FIELDS).first()
+
+    def in_range(self, row):
+        if self.stop is not None and row['version_number'] > self.stop:
+            return False
+        return self.until is None or row['created_at'] <= self.until
+
+    def frame(self, kind, row, **fields):
+        return dumps({
+            'type': kind,
+            'version': row['version_number'],
+            'created_at': row['created_at'],
+            'created_by': row['created_by__username'],
+            'summary': row['change_summary'],
+            **fields,
+        }) + '\n'
+
+    def full_frame(self, kind, row):
+        self.nodes = split_blocks(row['content'])
+        return self.frame(kind, row, content=row['content'])
+
+    def delta_frame(self, row):
+        nodes = split_blocks(row['content'])
+        previous, self.nodes = self.nodes, nodes
+        if nodes is None or previous is None:
+            return self.frame('delta', row, content=row['content'])
+        return self.frame('delta', row, ops=block_ops(previous, nodes))
+
+    def next_chunk(self):
+        """Encoded frames of the next batch of versions, or '' when the playback is over"""
+        if self.done:
+            return ''
+        if self.cursor is None:
+            row = self.seek()
+            if row is None:
+                self.done = True
+                return dumps({'type': 'end', 'versions': 0}) + '\n'
+            self.cursor = row['version_number']
+            self.sent = 1
+            return self.full_frame('snapshot', row)
+
+        rows = list(
+            self.versions().filter(version_number__gt=self.cursor)
+            .order_by('version_number').values(*VERSION_FIELDS)[:self.batch_size]
+        )
+        frames = []
+        for row in rows:
+            if not self.in_range(row):
+                self.done = True
+                break
+            if self.sent % self.keyframe_interval == 0:
+                frames.append(self.full_frame('keyframe', row))
+            else:
+                frames.append(self.delta_frame(row))
+            self.cursor = row['version_number']
+            self.sent += 1
+        if len(rows) < self.batch_size:
+            self.done = True
+        if self.done:
+            frames.append(dumps({'type': 'end', 'versions': self.sent}) + '\n')
+        return ''.join(frames)
+
+    def __iter__(self):
+        while True:
+            chunk = self.next_chunk()
+            if not chunk:
+                return
+            yield chunk
+
+    async def __aiter__(self):
+        next_chunk = database_sync_to_async(self.next_chunk)
+        while True:
+            chunk = await next_chunk()
+            if not chunk:
+                return
+            yield chunk
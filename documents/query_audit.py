@@ -0,0 +1,111 @@
+"""
+Query auditing for the hot ORM paths.
+
+``QueryAudit`` records every statement a block of code runs and reports:
+
+- more queries than the path's budget
+- the same statement shape repeated ``repeat_limit`` times or more (an
+  N+1 loop over related objects)
+- SELECTs whose plan reads a whole table (``EXPLAIN QUERY PLAN`` on
+  SQLite, ``EXPLAIN`` on MySQL), apart from tables in ``allow_scans``
+- SELECTs that sort rows no index returns in order (a temporary B-tree on
+  SQLite, a filesort on MySQL), unless the path sets ``allow_sorts``
+
+The ``audit_queries`` management command runs the audits for the editor,
+dashboard, version history and consumer handlers against a throwaway test
+database and exits non-zero on any problem, so CI can run it.
+"""
+import re
+from collections import Counter
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# SQLite plan rows: "SCAN documents_document" is a full scan, "SCAN t USING
+# (COVERING) INDEX i" walks an index and "SEARCH t USING INDEX i" seeks one
+SQLITE_FULL_SCAN = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+
+
+def normalize(sql):
+    """Statement shape: literals and IN-lists collapsed so repeats compare equal"""
+    sql = re.sub(r"'[^']*'", '?', sql)
+    sql = re.sub(r'\b\d+\b', '?', sql)
+    return re.sub(r'IN \([^)]*\)', 'IN (...)', sql)
+
+
+def explain(connection, sql, params):
+    """
+    (tables read in full, whether rows are sorted without an index) for
+    ``sql``, according to the database's plan
+    """
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            details = [row[-1] for row in cursor.fetchall()]
+        scans = [match.group(1) for match in map(SQLITE_FULL_SCAN.match, details) if match]
+        return scans, any(detail.startswith('USE TEMP B-TREE FOR ORDER BY') for detail in details)
+    if connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}', params)
+            columns = [column[0] for column in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+        scans = [row['table'] for row in rows if row.get('type') == 'ALL' and row.get('table')]
+        return scans, any('Using filesort' in (row.get('Extra') or '') for row in rows)
+    return [], False
+
+
+class QueryAudit:
+    def __init__(self, name, max_queries, using=DEFAULT_DB_ALIAS, allow_scans=(), allow_sorts=False,
+                 repeat_limit=3):
+        self.name = name
+        self.max_queries = max_queries
+        self.connection = connections[using]
+        self.allow_scans = set(allow_scans)
+        self.allow_sorts = allow_sorts
+        self.repeat_limit = repeat_limit
+        self.queries = []
+        self._wrapper = None
+
+    def __enter__(self):
+        self._wrapper = self.connection.execute_wrapper(self.record)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+        self._wrapper = None
+
+    def record(self, execute, sql, params, many, context):
+        self.queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    def problems(self):
+        """Human-readable findings; empty if the path is within budget"""
+        found = []
+        if len(self.queries) > self.max_queries:
+            found.append(f'{len(self.queries)} queries, budget {self.max_queries}')
+
+        shapes = Counter(normalize(sql) for sql, _ in self.queries)
+        for shape, count in shapes.items():
+            if count >= self.repeat_limit:
+                found.append(f'repeated {count}x (N+1?): {shape[:160]}')
+
+        seen = set()
+        for sql, params in self.queries:
+            if not sql.lstrip().upper().startswith('SELECT') or normalize(sql) in seen:
+                continue
+            seen.add(normalize(sql))
+            scans, sorts = explain(self.connection, sql, params)
+            for table in scans:
+                if table not in self.allow_scans:
+                    found.append(f'full scan of {table}: {sql[:160]}')
+            if sorts and not self.allow_sorts:
+                found.append(f'sort without an index: {sql[:160]}')
+        return found
+
+    def report(self, problems=None):
+        if problems is None:
+            problems = self.problems()
+        status = 'FAIL' if problems else 'ok'
+        lines = [f'{status:4} {self.name}: {len(self.queries)}/{self.max_queries} queries']
+        lines.extend(f'     - {problem}' for problem in problems)
+        return '\n'.join(lines)
@@ -0,0 +1,97 @@
+"""
+Token-bucket rate limiting of websocket frames.
+
+Each message type has a per-connection limit (``WS_RATE_LIMITS``) and a
+per-room limit shared by every connection to a document on this worker
+(``WS_ROOM_RATE_LIMITS``), both given as ``(tokens per second, burst)``.
+A frame is admitted only if both buckets have a token; the consumer
+decides what to do with the rest (edits are coalesced, other frames are
+dropped).
+"""
+import time
+
+from django.conf import settings
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def has(self, tokens=1):
+        self.refill()
+        return self.tokens >= tokens
+
+    def take(self, tokens=1):
+        self.tokens -= tokens
+
+    def wait_time(self, tokens=1):
+        """Seconds until ``tokens`` are available"""
+        self.refill()
+        if self.tokens >= tokens or self.rate <= 0:
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class RateLimiter:
+    def __init__(self):
+        # (document_id, message_type) -> TokenBucket shared by the room
+        self.room_buckets = {}
+
+    @staticmethod
+    def limit(scope, message_type):
+        limits = getattr(settings, 'WS_ROOM_RATE_LIMITS' if scope == 'room' else 'WS_RATE_LIMITS', {})
+        return limits.get(message_type)
+
+    def connection_bucket(self, consumer, message_type):
+        buckets = consumer.__dict__.setdefault('rate_buckets', {})
+        if message_type not in buckets:
+            limit = self.limit('connection', message_type)
+            buckets[message_type] = TokenBucket(*limit) if limit else None
+        return buckets[message_type]
+
+    def room_bucket(self, document_id, message_type):
+        key = (document_id, message_type)
+        if key not in self.room_buckets:
+            limit = self.limit('room', message_type)
+            self.room_buckets[key] = TokenBucket(*limit) if limit else None
+        return self.room_buckets[key]
+
+    def buckets(self, consumer, message_type):
+        return [
+            bucket for bucket in (
+                self.connection_bucket(consumer, message_type),
+                self.room_bucket(consumer.document_id, message_type),
+            )
+            if bucket is not None
+        ]
+
+    def allow(self, consumer, message_type):
+        """Take a token from the connection and room buckets if both have one"""
+        buckets = self.buckets(consumer, message_type)
+        if not all(bucket.has() for bucket in buckets):
+            return False
+        for bucket in buckets:
+            bucket.take()
+        return True
+
+    def retry_after(self, consumer, message_type):
+        """Seconds until ``allow`` can next succeed"""
+        return max([bucket.wait_time() for bucket in self.buckets(consumer, message_type)] or [0.0])
+
+    def forget(self, document_id):
+        """Drop the room buckets of an evicted room"""
+        for key in [key for key in self.room_buckets if key[0] == document_id]:
+            del self.room_buckets[key]
+
+
+rate_limiter = RateLimiter()
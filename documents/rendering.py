@@ -0,0 +1,451 @@
+"""
+Server-side rendering of Tiptap JSON document content.
+
+Three output formats share one traversal model:
+
+* HTML, for public pages and previews
+* plain text, for TXT export and search
+* a layout model (a flat list of typed blocks with styled text runs),
+  which the PDF and DOCX exporters draw from
+
+Rendering is memoized per top-level block, keyed by the block's canonical
+content hash. Re-rendering a document after a small edit therefore only
+reprocesses the blocks that actually changed.
+"""
+import re
+import threading
+from collections import OrderedDict
+from html import escape, unescape
+from html.parser import HTMLParser
+
+from django.conf import settings
+
+from .hashing import content_hash
+
+# Block nodes that map one-to-one onto an HTML element
+BLOCK_TAGS = {
+    'paragraph': 'p',
+    'blockquote': 'blockquote',
+    'bulletList': 'ul',
+    'listItem': 'li',
+    'taskList': 'ul',
+    'table': 'table',
+    'tableRow': 'tr',
+    'tableCell': 'td',
+    'tableHeader': 'th',
+}
+
+# Marks that map one-to-one onto an inline HTML element
+MARK_TAGS = {
+    'bold': 'strong',
+    'italic': 'em',
+    'underline': 'u',
+    'strike': 's',
+    'code': 'code',
+    'highlight': 'mark',
+    'subscript': 'sub',
+    'superscript': 'sup',
+}
+
+SAFE_URL_SCHEMES = ('http:', 'https:', 'mailto:', 'tel:', '/', '#')
+
+TAG_RE = re.compile(r'<[^<]+?>')
+BLOCK_END_RE = re.compile(r'</(p|div|h[1-6]|li|blockquote|pre|tr)>|<br\s*/?>', re.IGNORECASE)
+
+
+def safe_url(url):
+    """Drop URLs with schemes that could execute script (javascript:, data: ...)"""
+    url = (url or '').strip()
+    if url.lower().startswith(SAFE_URL_SCHEMES) or ':' not in url.split('/', 1)[0]:
+        return url
+    return ''
+
+
+# Legacy HTML is reduced to these tags, with these attributes
+LEGACY_TAGS = {
+    *BLOCK_TAGS.values(), *MARK_TAGS.values(),
+    'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'ol', 'pre', 'div', 'span', 'br', 'hr',
+    'b', 'i', 'a', 'img', 'thead', 'tbody',
+}
+LEGACY_ATTRS = {'a': ('href',), 'img': ('src', 'alt')}
+LEGACY_URL_ATTRS = ('href', 'src')
+LEGACY_VOID_TAGS = {'br', 'hr', 'img'}
+# Elements dropped together with everything inside them
+LEGACY_DROPPED = {'script', 'style', 'template', 'iframe', 'object', 'embed', 'textarea', 'select', 'title', 'head'}
+
+
+class LegacyHtmlSanitizer(HTMLParser):
+    """Allowlist filter for HTML stored by older clients"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out = []
+        self.open = []
+        self.dropping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in LEGACY_DROPPED:
+            if tag not in LEGACY_VOID_TAGS:
+                self.dropping += 1
+            return
+        if self.dropping or tag not in LEGACY_TAGS:
+            return
+        kept = ''
+        for name, value in attrs:
+            if name in LEGACY_ATTRS.get(tag, ()):
+                value = safe_url(value) if name in LEGACY_URL_ATTRS else (value or '')
+                kept += f' {name}="{escape(value)}"'
+        self.out.append(f'<{tag}{kept}>')
+        if tag not in LEGACY_VOID_TAGS:
+            self.open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in LEGACY_VOID_TAGS:
+            self.handle_starttag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        if tag in LEGACY_DROPPED:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping or tag not in self.open:
+            return
+        # Close anything left open inside it, so the output stays balanced
+        while self.open:
+            open_tag = self.open.pop()
+            self.out.append(f'</{open_tag}>')
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if not self.dropping:
+            self.out.append(escape(data))
+
+    def sanitize(self, html):
+        self.feed(html)
+        self.close()
+        return ''.join(self.out) + ''.join(f'</{tag}>' for tag in reversed(self.open))
+
+
+def sanitize_legacy_html(html):
+    """Legacy HTML with only formatting tags and safe links/images left"""
+    return LegacyHtmlSanitizer().sanitize(html)
+
+
+def html_to_text(html):
+    """Plain text from legacy HTML content, keeping block boundaries as newlines"""
+    return unescape(TAG_RE.sub('', BLOCK_END_RE.sub('\n', html))).strip('\n')
+
+
+class BlockCache:
+    """Thread-safe LRU of rendered top-level blocks keyed by (format, hash)"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+
+block_cache = BlockCache(getattr(settings, 'RENDER_BLOCK_CACHE_SIZE', 5000))
+
+
+class TiptapRenderer:
+    """
+    Base class for Tiptap renderers.
+
+    Subclasses implement ``render_block`` for one top-level node and
+    ``join`` to combine rendered blocks; ``render`` handles memoization.
+    """
+    format = None
+
+    def __init__(self, cache=None):
+        self.cache = block_cache if cache is None else cache
+
+    def render(self, content):
+        if isinstance(content, str):
+            return self.render_legacy(content)
+        if not isinstance(content, dict):
+            return self.join([])
+        blocks = (content.get('content') or []) if content.get('type') == 'doc' else [content]
+        return self.join([self.render_cached(block) for block in blocks])
+
+    def render_cached(self, block):
+        key = (self.format, content_hash(block))
+        rendered = self.cache.get(key)
+        if rendered is None:
+            rendered = self.render_block(block)
+            self.cache.set(key, rendered)
+        return rendered
+
+    def render_block(self, node):
+        raise NotImplementedError
+
+    def render_legacy(self, html):
+        """Render content stored as an HTML string by older clients"""
+        raise NotImplementedError
+
+    def join(self, rendered_blocks):
+        raise NotImplementedError
+
+
+class HtmlRenderer(TiptapRenderer):
+    format = 'html'
+
+    def render_block(self, node):
+        return self.render_node(node)
+
+    def render_legacy(self, html):
+        return sanitize_legacy_html(html)
+
+    def join(self, rendered_blocks):
+        return ''.join(rendered_blocks)
+
+    def render_marks(self, text, marks):
+        html = escape(text)
+        for mark in marks or []:
+            mark_type = mark.get('type')
+            if mark_type in MARK_TAGS:
+                tag = MARK_TAGS[mark_type]
+                html = f'<{tag}>{html}</{tag}>'
+            elif mark_type == 'link':
+                href = escape(safe_url((mark.get('attrs') or {}).get('href')))
+                html = f'<a href="{href}" rel="noopener noreferrer nofollow">{html}</a>'
+        return html
+
+    def render_children(self, node):
+        return ''.join(self.render_node(child) for child in node.get('content') or [])
+
+    def render_node(self, node):
+        if not isinstance(node, dict):
+            return ''
+        node_type = node.get('type')
+        attrs = node.get('attrs') or {}
+
+        if node_type == 'text':
+            return self.render_marks(node.get('text', ''), node.get('marks'))
+        if node_type == 'hardBreak':
+            return '<br>'
+        if node_type == 'horizontalRule':
+            return '<hr>'
+        if node_type == 'image':
+            src = escape(safe_url(attrs.get('src')))
+            alt = escape(attrs.get('alt') or '')
+            return f'<img src="{src}" alt="{alt}">'
+        if node_type == 'heading':
+            level = heading_level(attrs)
+            return f'<h{level}>{self.render_children(node)}</h{level}>'
+        if node_type == 'orderedList':
+            start = attrs.get('start')
+            start_attr = f' start="{int(start)}"' if start not in (None, 1) else ''
+            return f'<ol{start_attr}>{self.render_children(node)}</ol>'
+        if node_type == 'codeBlock':
+            language = attrs.get('language')
+            class_attr = f' class="language-{escape(language)}"' if language else ''
+            return f'<pre><code{class_attr}>{escape(node_text(node))}</code></pre>'
+        if node_type == 'taskItem':
+            checked = ' checked' if attrs.get('checked') else ''
+            return f'<li><input type="checkbox" disabled{checked}> {self.render_children(node)}</li>'
+        if node_type in BLOCK_TAGS:
+            tag = BLOCK_TAGS[node_type]
+            return f'<{tag}>{self.render_children(node)}</{tag}>'
+        # Unknown nodes (and 'doc') render their children without a wrapper
+        return self.render_children(node)
+
+
+class LayoutRenderer(TiptapRenderer):
+    """
+    Flattens content into layout blocks for paginated exporters.
+
+    Each block is a dict with ``kind`` (heading, paragraph, list_item, code,
+    quote, rule, image), ``level`` (heading level or list depth), ``marker``
+    (bullet or number for list items) and ``runs``: a list of dicts with
+    ``text`` plus optional ``bold``/``italic``/``underline``/``strike``/
+    ``code``/``href`` styling.
+    """
+    format = 'layout'
+
+    def render_block(self, node):
+        blocks = []
+        self.collect(node, blocks, depth=0, quote=False)
+        # Cached values are shared between callers; keep them immutable
+        return tuple(blocks)
+
+    def render_legacy(self, html):
+        return [
+            {'kind': 'paragraph', 'level': 0, 'marker': None, 'runs': [{'text': line}]}
+            for line in html_to_text(html).split('\n')
+        ]
+
+    def join(self, rendered_blocks):
+        return [block for blocks in rendered_blocks for block in blocks]
+
+    def runs(self, node):
+        runs = []
+        for child in node.get('content') or []:
+            if not isinstance(child, dict):
+                continue
+            child_type = child.get('type')
+            if child_type == 'text':
+                run = {'text': child.get('text', '')}
+                for mark in child.get('marks') or []:
+                    mark_type = mark.get('type') if isinstance(mark, dict) else None
+                    if mark_type == 'link':
+                        run['href'] = safe_url((mark.get('attrs') or {}).get('href'))
+                    elif mark_type in MARK_TAGS:
+                        run[mark_type] = True
+                runs.append(run)
+            elif child_type == 'hardBreak':
+                runs.append({'text': '\n'})
+            else:
+                runs.extend(self.runs(child))
+        return runs
+
+    def collect(self, node, blocks, depth, quote, marker=None):
+        if not isinstance(node, dict):
+            return
+        node_type = node.get('type')
+        attrs = node.get('attrs') or {}
+
+        if node_type == 'heading':
+            blocks.append({'kind': 'heading', 'level': heading_level(attrs), 'marker': None, 'runs': self.runs(node)})
+        elif node_type == 'paragraph':
+            kind = 'list_item' if marker else ('quote' if quote else 'paragraph')
+            blocks.append({'kind': kind, 'level': depth, 'marker': marker, 'runs': self.runs(node)})
+        elif node_type == 'codeBlock':
+            blocks.append({'kind': 'code', 'level': 0, 'marker': None, 'runs': [{'text': node_text(node), 'code': True}]})
+        elif node_type == 'horizontalRule':
+            blocks.append({'kind': 'rule', 'level': 0, 'marker': None, 'runs': []})
+        elif node_type == 'image':
+            blocks.append({'kind': 'image', 'level': 0, 'marker': None, 'runs': [{'text': attrs.get('alt') or ''}]})
+        elif node_type in ('bulletList', 'orderedList', 'taskList'):
+            number = int(attrs.get('start') or 1)
+            for child in node.get('content') or []:
+                if not isinstance(child, dict):
+                    continue
+                if node_type == 'orderedList':
+                    item_marker = f'{number}.'
+                    number += 1
+                elif child.get('type') == 'taskItem':
+                    item_marker = '[x]' if (child.get('attrs') or {}).get('checked') else '[ ]'
+                else:
+                    item_marker = '•'
+                self.collect_item(child, blocks, depth + 1, quote, item_marker)
+        elif node_type == 'blockquote':
+            for child in node.get('content') or []:
+                self.collect(child, blocks, depth, True, marker)
+        elif node_type in ('table', 'tableRow'):
+            if node_type == 'tableRow':
+                cells = [
+                    ''.join(run['text'] for run in self.runs(cell))
+                    for cell in node.get('content') or [] if isinstance(cell, dict)
+                ]
+                blocks.append({'kind': 'paragraph', 'level': depth, 'marker': None, 'runs': [{'text': ' | '.join(cells)}]})
+            else:
+                for child in node.get('content') or []:
+                    self.collect(child, blocks, depth, quote)
+        else:
+            for child in node.get('content') or []:
+                self.collect(child, blocks, depth, quote, marker)
+
+    def collect_item(self, item, blocks, depth, quote, marker):
+        # Only the first paragraph of a list item carries the marker
+        for child in item.get('content') or []:
+            if not isinstance(child, dict):
+                continue
+            self.collect(child, blocks, depth, quote, marker)
+            marker = None if child.get('type') == 'paragraph' else marker
+
+
+class TextRenderer(TiptapRenderer):
+    format = 'text'
+
+    def __init__(self, cache=None):
+        super().__init__(cache)
+        self.layout = LayoutRenderer(self.cache)
+
+    def render_block(self, node):
+        return '\n'.join(layout_block_text(block) for block in self.layout.render_cached(node))
+
+    def render_legacy(self, html):
+        return html_to_text(html)
+
+    def join(self, rendered_blocks):
+        return '\n'.join(rendered_blocks)
+
+
+def heading_level(attrs):
+    try:
+        level = int(attrs.get('level') or 1)
+    except (TypeError, ValueError):
+        level = 1
+    return min(max(level, 1), 6)
+
+
+def node_text(node):
+    """Concatenated raw text of ``node``'s descendants"""
+    if not isinstance(node, dict):
+        return ''
+    if node.get('type') == 'text':
+        return node.get('text', '')
+    return ''.join(node_text(child) for child in node.get('content') or [])
+
+
+def layout_block_text(block):
+    text = ''.join(run['text'] for run in block['runs'])
+    if block['kind'] == 'rule':
+        return '-' * 40
+    if block['marker']:
+        return '  ' * max(block['level'] - 1, 0) + f"{block['marker']} {text}"
+    if block['kind'] == 'quote':
+        return f'> {text}'
+    return text
+
+
+html_renderer = HtmlRenderer()
+text_renderer = TextRenderer()
+layout_renderer = LayoutRenderer()
+
+
+def render_html(content):
+    """
+    Render stored document content to HTML.
+
+    ``Document.content`` normally holds a Tiptap JSON tree, but older
+    clients stored the editor's innerHTML directly; such strings are
+    reduced to an allowlist of formatting tags.
+    """
+    return html_renderer.render(content)
+
+
+def render_text(content):
+    """Render stored document content (Tiptap JSON or legacy HTML) to plain text"""
+    return text_renderer.render(content)
+
+
+def render_layout(content):
+    """Render stored document content to a list of layout blocks"""
+    return layout_renderer.render(content)
@@ -0,0 +1,203 @@
+"""
+Read replica routing.
+
+Views decorated with ``replica_reads`` (and code inside ``replica_reads()``
+used as a context manager) send their reads to one of the
+``DATABASE_REPLICAS``; everything else, every write and every read inside a
+transaction stays on the primary. One replica is picked per request, so a
+page never mixes two replicas' views of the data.
+
+The primary is used instead when:
+
+- the user wrote something in the last ``REPLICA_READ_YOUR_WRITES``
+  seconds (HTTP writes are marked by ``RecentWriteMiddleware``, websocket
+  edits by the consumer), so people always see their own changes. The
+  marks live in the cache, which must be shared by all processes
+- every replica lags more than ``REPLICA_MAX_LAG`` seconds, or its lag
+  can't be determined; lag is checked at most every
+  ``REPLICA_LAG_CHECK_INTERVAL`` seconds per process
+
+To try it locally with two SQLite files, point ``REPLICA_DATABASE_URLS``
+at ``sqlite:///replica.sqlite3``, ``migrate --database replica_1`` and copy
+rows across as needed. Test databases of replicas mirror the primary,
+except with ``doccollab.replica_settings``, whose separate replica the
+routing tests in ``documents.tests`` check reads against.
+"""
+import contextvars
+import logging
+import random
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+from .affinity import PROCESS_LOCAL_CACHES
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Replica alias reads are routed to in the current request, or None
+_read_alias = contextvars.ContextVar('replica_read_alias', default=None)
+
+# alias -> (checked_at, lag in seconds or None)
+_lag = {}
+# user_id -> when this process last marked a write, to skip redundant cache sets
+_marked = {}
+
+
+def recent_write_key(user_id):
+    return f'recent_write:{user_id}'
+
+
+def mark_write(user_id):
+    """Record that ``user_id`` just wrote, so their reads stay on the primary for a while"""
+    if user_id is None or not getattr(settings, 'DATABASE_REPLICAS', []):
+        return
+    window = getattr(settings, 'REPLICA_READ_YOUR_WRITES', 10)
+    now = time.monotonic()
+    if now - _marked.get(user_id, -window) < 1:
+        return
+    _marked[user_id] = now
+    cache.set(recent_write_key(user_id), True, window)
+
+
+def wrote_recently(user_id):
+    return user_id is not None and bool(cache.get(recent_write_key(user_id)))
+
+
+def check_shared_cache():
+    """Refuse to start with replicas and a cache the other processes can't see"""
+    if not getattr(settings, 'DATABASE_REPLICAS', []):
+        return
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        raise ImproperlyConfigured(
+            f'DATABASE_REPLICAS needs a cache shared by all processes (set CACHE_REDIS_URL), not {backend}: '
+            'writes marked by the websocket process would be invisible to the HTTP workers, '
+            'so users could read from a replica that hasn\'t caught up with their edits'
+        )
+
+
+def measure_lag(alias):
+    """Replication delay of ``alias`` in seconds, or None if it isn't replicating"""
+    connection = connections[alias]
+    if connection.vendor != 'mysql':
+        # No replication status to ask for (e.g. local SQLite copies)
+        return 0.0
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute('SHOW REPLICA STATUS')
+        except DatabaseError:
+            cursor.execute('SHOW SLAVE STATUS')
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        status = dict(zip((column[0] for column in cursor.description), row))
+    lag = status.get('Seconds_Behind_Source', status.get('Seconds_Behind_Master'))
+    return None if lag is None else float(lag)
+
+
+def replica_lag(alias):
+    checked_at, lag = _lag.get(alias, (None, None))
+    if checked_at is None or time.monotonic() - checked_at >= getattr(settings, 'REPLICA_LAG_CHECK_INTERVAL', 5):
+        try:
+            lag = measure_lag(alias)
+        except Exception as e:
+            logger.warning('Checking lag of replica %s failed: %s', alias, e)
+            lag = None
+        _lag[alias] = (time.monotonic(), lag)
+    return lag
+
+
+def healthy_replicas():
+    max_lag = getattr(settings, 'REPLICA_MAX_LAG', 2)
+    healthy = []
+    for alias in getattr(settings, 'DATABASE_REPLICAS', []):
+        lag = replica_lag(alias)
+        if lag is not None and lag <= max_lag:
+            healthy.append(alias)
+    return healthy
+
+
+def pick_replica(user_id=None):
+    """Replica alias to read from for ``user_id``, or None for the primary"""
+    if not getattr(settings, 'DATABASE_REPLICAS', []):
+        return None
+    if wrote_recently(user_id):
+        metrics.incr('replica_fallbacks', reason='recent_write')
+        return None
+    healthy = healthy_replicas()
+    if not healthy:
+        metrics.incr('replica_fallbacks', reason='lag')
+        return None
+    alias = random.choice(healthy)
+    metrics.incr('replica_reads', alias=alias)
+    return alias
+
+
+@contextmanager
+def reading_from(alias):
+    token = _read_alias.set(alias)
+    try:
+        yield alias
+    finally:
+        _read_alias.reset(token)
+
+
+def replica_reads(view=None, user_id=None):
+    """
+    Route a view's reads to a replica (decorator), or those of a block
+    (``with replica_reads(user_id=...)``).
+    """
+    if view is None:
+        return reading_from(pick_replica(user_id))
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        with reading_from(pick_replica(getattr(request.user, 'id', None))):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = _read_alias.get()
+        if alias is None:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            # Related objects come from where their parent was read
+            return instance._state.db
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            # Reads inside a transaction must see its writes
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, 'DATABASE_REPLICAS', [])}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class RecentWriteMiddleware:
+    """Mark users who made a (non-GET) request as having written"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and getattr(request, 'user', None) is not None \
+                and request.user.is_authenticated:
+            mark_write(request.user.id)
+        return response
@@ -0,0 +1,186 @@
+"""
+Room lifecycle on one worker.
+
+Every document with a connected socket is *hot*. When its last member
+leaves the room turns *warm*: its per-room state (viewer snapshot
+throttle, block materialization clock, ...) is kept in case someone
+comes straight back. Warm rooms idle for ``ROOM_IDLE_TTL`` seconds, or the
+oldest ones beyond ``ROOM_MAX_WARM``, are flushed and *evicted*: every
+registered per-room cache drops its entry. Memory therefore scales with
+the number of rooms in use, not with every document ever opened.
+
+The periodic sweep also refreshes ``UserPresence.last_seen`` for members
+connected here and deletes presence rows nobody has refreshed for
+``PRESENCE_STALE_AFTER`` seconds, which is what is left behind when a
+worker dies without running ``disconnect``.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter, OrderedDict
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from . import blocks as block_storage
+from .affinity import room_router
+from .anchors import anchor_tracker
+from .buffering import edit_buffer
+from .drain import flush_document
+from .fanout import viewer_fanout
+from .models import UserPresence
+from .ratelimit import rate_limiter
+from .scheduler import room_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class RoomState:
+    __slots__ = ('members', 'last_active')
+
+    def __init__(self):
+        # user_id (None for viewers) -> number of sockets
+        self.members = Counter()
+        self.last_active = time.monotonic()
+
+    @property
+    def hot(self):
+        return sum(self.members.values()) > 0
+
+
+def refresh_presence(members):
+    """Bump last_seen for (document_id, user_id) pairs still connected"""
+    if not members:
+        return 0
+    condition = reduce(or_, (Q(document_id=document_id, user_id=user_id) for document_id, user_id in members))
+    return UserPresence.objects.filter(condition).update(last_seen=timezone.now())
+
+
+def sweep_stale_presence(stale_after):
+    """Delete presence rows no live worker has refreshed"""
+    cutoff = timezone.now() - timedelta(seconds=stale_after)
+    deleted, _ = UserPresence.objects.filter(last_seen__lt=cutoff).delete()
+    return deleted
+
+
+class RoomLifecycleManager:
+    def __init__(self):
+        # document_id -> RoomState, least recently active first
+        self.rooms = OrderedDict()
+        self.evicted = 0
+        self.evict_hooks = [
+            viewer_fanout.forget,
+            block_storage.forget,
+            room_router.forget,
+            rate_limiter.forget,
+            room_scheduler.forget,
+            edit_buffer.forget,
+            anchor_tracker.forget,
+        ]
+        self._task = None
+
+    @property
+    def idle_ttl(self):
+        return getattr(settings, 'ROOM_IDLE_TTL', 300)
+
+    @property
+    def max_warm(self):
+        return getattr(settings, 'ROOM_MAX_WARM', 1000)
+
+    @property
+    def interval(self):
+        return getattr(settings, 'ROOM_SWEEP_INTERVAL', 60)
+
+    def register(self, hook):
+        """Call ``hook(document_id)`` whenever a room is evicted"""
+        self.evict_hooks.append(hook)
+
+    def touch(self, document_id):
+        state = self.rooms.get(document_id)
+        if state is None:
+            state = self.rooms[document_id] = RoomState()
+        state.last_active = time.monotonic()
+        self.rooms.move_to_end(document_id)
+        return state
+
+    async def enter(self, document_id, user_id=None):
+        self.start()
+        self.touch(document_id).members[user_id] += 1
+
+    async def leave(self, document_id, user_id=None):
+        state = self.touch(document_id)
+        state.members[user_id] -= 1
+        if state.members[user_id] <= 0:
+            del state.members[user_id]
+
+    def counts(self):
+        hot = sum(1 for state in self.rooms.values() if state.hot)
+        return {'hot': hot, 'warm': len(self.rooms) - hot, 'evicted': self.evicted}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._sweep_loop())
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning('Room sweep failed: %s', e)
+
+    async def sweep(self):
+        """Evict idle warm rooms, refresh live presence, drop stale presence"""
+        now = time.monotonic()
+        warm = [document_id for document_id, state in self.rooms.items() if not state.hot]
+        excess = len(warm) - self.max_warm
+        for document_id in warm:
+            idle = now - self.rooms[document_id].last_active
+            if idle >= self.idle_ttl or excess > 0:
+                await self.evict(document_id)
+                excess -= 1
+
+        members = [
+            (document_id, user_id)
+            for document_id, state in self.rooms.items()
+            for user_id in state.members
+            if user_id is not None
+        ]
+        await database_sync_to_async(refresh_presence)(members)
+        stale = await database_sync_to_async(sweep_stale_presence)(
+            getattr(settings, 'PRESENCE_STALE_AFTER', self.interval * 3)
+        )
+        if stale:
+            logger.info('Removed %s stale presence rows', stale)
+
+    async def evict(self, document_id):
+        """Flush and forget a room's state on this worker"""
+        state = self.rooms.get(document_id)
+        if state is None or state.hot:
+            return
+        await viewer_fanout.flush(document_id)
+        try:
+            await edit_buffer.flush(document_id)
+            await anchor_tracker.flush(document_id)
+            await database_sync_to_async(flush_document)(document_id)
+        except Exception as e:
+            logger.warning('Flushing document %s before eviction failed: %s', document_id, e)
+        # A member may have come back while flushing: the room keeps its
+        # rate limits, throttles and affinity state
+        state = self.rooms.get(document_id)
+        if state is None or state.hot:
+            return
+        del self.rooms[document_id]
+        self.evicted += 1
+        for hook in self.evict_hooks:
+            hook(document_id)
+
+
+room_lifecycle = RoomLifecycleManager()
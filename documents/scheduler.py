@@ -0,0 +1,176 @@
+"""
+Fair scheduling of per-room work on a worker.
+
+All rooms share one event loop and the single thread
+``database_sync_to_async`` runs queries on, which serves callers in
+arrival order: one busy room with dozens of typists would otherwise put
+every quiet room's save behind its backlog.
+
+``RoomScheduler`` gives each room its own FIFO queue and runs at most one
+job per room at a time, which also keeps a room's saves in order. Rooms
+with queued work take turns round-robin, and at most
+``SCHEDULER_DB_CONCURRENCY`` jobs run at once, so the database thread
+never holds more than that many queued calls. A quiet room's job therefore
+waits for at most one job of each busy room, however long their queues
+are.
+
+Jobs must not schedule further work on their own room and wait for it;
+that job could never start.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    __slots__ = ('func', 'args', 'kwargs', 'future', 'enqueued', 'key')
+
+    def __init__(self, func, args, kwargs, key=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.key = key
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+
+class LatencyStats:
+    """Recent queue-wait and run times of one room, in seconds"""
+
+    def __init__(self, size=512):
+        self.waits = deque(maxlen=size)
+        self.runs = deque(maxlen=size)
+        self.jobs = 0
+
+    def record(self, wait, run):
+        self.waits.append(wait)
+        self.runs.append(run)
+        self.jobs += 1
+
+    @staticmethod
+    def percentile(samples, fraction):
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    def summary(self):
+        return {
+            'jobs': self.jobs,
+            'wait_p50_ms': round(self.percentile(self.waits, 0.5) * 1000, 2),
+            'wait_p95_ms': round(self.percentile(self.waits, 0.95) * 1000, 2),
+            'run_p50_ms': round(self.percentile(self.runs, 0.5) * 1000, 2),
+            'run_p95_ms': round(self.percentile(self.runs, 0.95) * 1000, 2),
+        }
+
+
+class RoomScheduler:
+    def __init__(self, concurrency=None):
+        self._concurrency = concurrency
+        # document_id -> deque of queued jobs
+        self.queues = {}
+        # Rooms with queued jobs and nothing running, in turn order
+        self.ready = deque()
+        self._ready_set = set()
+        self.running = set()
+        self.latency = {}
+        self.overall = LatencyStats(size=2048)
+
+    @property
+    def concurrency(self):
+        if self._concurrency is None:
+            return getattr(settings, 'SCHEDULER_DB_CONCURRENCY', 4)
+        return self._concurrency
+
+    async def run(self, document_id, func, *args, **kwargs):
+        """Run ``await func(*args, **kwargs)`` in ``document_id``'s turn and return its result"""
+        return await self._enqueue(document_id, Job(func, args, kwargs))
+
+    def submit(self, document_id, func, *args, key=None, **kwargs):
+        """
+        Queue background work for ``document_id`` without waiting for it.
+
+        A queued job with the same ``key`` is replaced rather than queued
+        twice (e.g. successive cursor positions of one connection).
+        """
+        queue = self.queues.get(document_id)
+        if key is not None and queue:
+            for job in queue:
+                if job.key == key:
+                    job.func, job.args, job.kwargs = func, args, kwargs
+                    return job.future
+        future = self._enqueue(document_id, Job(func, args, kwargs, key))
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning('Background room job failed: %s', future.exception())
+
+    def _enqueue(self, document_id, job):
+        self.queues.setdefault(document_id, deque()).append(job)
+        if document_id not in self.running and document_id not in self._ready_set:
+            self.ready.append(document_id)
+            self._ready_set.add(document_id)
+        self._dispatch()
+        return job.future
+
+    def _dispatch(self):
+        while self.ready and len(self.running) < self.concurrency:
+            document_id = self.ready.popleft()
+            self._ready_set.discard(document_id)
+            queue = self.queues[document_id]
+            job = queue.popleft()
+            if not queue:
+                del self.queues[document_id]
+            self.running.add(document_id)
+            asyncio.ensure_future(self._execute(document_id, job))
+
+    async def _execute(self, document_id, job):
+        started = time.monotonic()
+        try:
+            result = await job.func(*job.args, **job.kwargs)
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            wait, run = started - job.enqueued, time.monotonic() - started
+            self.latency.setdefault(document_id, LatencyStats()).record(wait, run)
+            self.overall.record(wait, run)
+            self.running.discard(document_id)
+            if document_id in self.queues:
+                # Back of the line: every other waiting room goes first
+                self.ready.append(document_id)
+                self._ready_set.add(document_id)
+            self._dispatch()
+
+    def stats(self, top=10):
+        """Overall latency plus the ``top`` rooms with the slowest p95 queue wait"""
+        rooms = sorted(
+            ((document_id, stats.summary()) for document_id, stats in self.latency.items()),
+            key=lambda item: item[1]['wait_p95_ms'],
+            reverse=True,
+        )[:top]
+        return {
+            'concurrency': self.concurrency,
+            'running': len(self.running),
+            'queued': sum(len(queue) for queue in self.queues.values()),
+            'overall': self.overall.summary(),
+            'rooms': {str(document_id): summary for document_id, summary in rooms},
+        }
+
+    def forget(self, document_id):
+        """Drop latency stats of an evicted room"""
+        self.latency.pop(document_id, None)
+
+
+room_scheduler = RoomScheduler()
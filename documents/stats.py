@@ -0,0 +1,122 @@
+"""
+Denormalized per-document counters (``DocumentStats``).
+
+The dashboard, editor and version history read these numbers instead of
+counting versions, comments and permissions on every request. Each write
+path bumps its counter in the same place it writes the row it counts:
+
+- ``versions.create_version``: versions
+- ``DocumentConsumer.save_comment``: comments and unresolved comments
+- ``acl.rebuild``: collaborators (users in the document's ACL)
+- content writes (consumer saves, buffered flushes, restores): word count
+
+A document without a stats row gets one computed from its tables the first
+time it is bumped or shown. Writes that bypass these paths (the admin, a
+shell) can make the counters drift; ``repair_document_stats`` recomputes
+them in bulk.
+"""
+import logging
+
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from . import blocks as block_storage
+from .models import Document, DocumentACL, DocumentComment, DocumentStats, DocumentVersion
+from .rendering import render_text
+
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('version_count', 'comment_count', 'unresolved_comment_count', 'collaborator_count')
+FIELDS = COUNTERS + ('word_count',)
+
+
+def word_count(content):
+    return len(render_text(content).split())
+
+
+def count_of(queryset):
+    """Correlated COUNT(*) of ``queryset`` rows per outer document, 0 if none"""
+    counts = queryset.filter(document_id=OuterRef('pk')).order_by().values('document_id').annotate(
+        n=Count('*')
+    ).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+
+
+def compute(document_ids):
+    """Fresh ``DocumentStats`` (unsaved) for ``document_ids``, counted from the tables"""
+    documents = Document.objects.filter(id__in=document_ids).annotate(
+        version_count=count_of(DocumentVersion.objects.all()),
+        comment_count=count_of(DocumentComment.objects.all()),
+        unresolved_comment_count=count_of(DocumentComment.objects.filter(resolved=False)),
+        collaborator_count=count_of(DocumentACL.objects.all()),
+    ).values_list('id', 'storage_mode', block_storage.inline_content(), *COUNTERS)
+    stats = []
+    for document_id, storage_mode, content, *counts in documents.iterator(chunk_size=100):
+        if storage_mode == 'blocks':
+            content = block_storage.current_content(document_id, storage_mode)
+        stats.append(DocumentStats(
+            document_id=document_id,
+            word_count=word_count(content),
+            updated_at=timezone.now(),
+            **dict(zip(COUNTERS, counts)),
+        ))
+    return stats
+
+
+def recompute(document_ids):
+    """Recompute and upsert the stats of ``document_ids``; returns the rows written"""
+    stats = compute(document_ids)
+    DocumentStats.objects.bulk_create(
+        stats,
+        update_conflicts=True,
+        unique_fields=['document'],
+        update_fields=[*FIELDS, 'updated_at'],
+    )
+    return stats
+
+
+def bump(document_id, **deltas):
+    """Add ``deltas`` (e.g. ``comment_count=1``) to a document's counters"""
+    updated = DocumentStats.objects.filter(document_id=document_id).update(
+        updated_at=timezone.now(),
+        **{field: Greatest(F(field) + delta, 0) for field, delta in deltas.items()}
+    )
+    if not updated:
+        # Counted after the caller's write, so the delta is already included
+        recompute([document_id])
+
+
+def set_word_count(document_id, content):
+    updated = DocumentStats.objects.filter(document_id=document_id).update(
+        word_count=word_count(content), updated_at=timezone.now()
+    )
+    if not updated:
+        recompute([document_id])
+
+
+def record(action, document_id, *args, **kwargs):
+    """Run a stats update after a write without failing the write itself"""
+    try:
+        action(document_id, *args, **kwargs)
+    except Exception as e:
+        logger.warning('Updating stats of document %s failed: %s', document_id, e)
+
+
+def attach_stats(documents):
+    """
+    ``documents`` (fetched with ``select_related('stats')``) as a list, with
+    stats computed for the ones that have no row yet
+    """
+    documents = list(documents)
+    missing = []
+    for document in documents:
+        try:
+            document.stats
+        except DocumentStats.DoesNotExist:
+            missing.append(document)
+    if missing:
+        computed = {stats.document_id: stats for stats in recompute([d.id for d in missing])}
+        for document in missing:
+            document.stats = computed.get(document.id)
+    return documents
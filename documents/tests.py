@@ -0,0 +1,187 @@
+import asyncio
+from unittest import skipUnless
+
+from channels.layers import InMemoryChannelLayer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connections
+from django.test import Client, SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import replicas
+from .channel_layers import MEMBERSHIP_MESSAGE, HybridChannelLayer, RedisMembershipStore
+from .models import Document, DocumentStats
+
+
+class FakeRedis:
+    """The set commands ``RedisMembershipStore`` uses, in memory"""
+
+    def __init__(self):
+        self.sets = {}
+
+    async def sadd(self, key, member):
+        self.sets.setdefault(key, set()).add(member.encode('utf-8'))
+
+    async def srem(self, key, member):
+        self.sets.get(key, set()).discard(member.encode('utf-8'))
+
+    async def smembers(self, key):
+        return set(self.sets.get(key, ()))
+
+    async def expire(self, key, seconds):
+        pass
+
+
+class RecordingLayer(InMemoryChannelLayer):
+    """The network layer of the tests, recording what is published on it"""
+
+    def __init__(self):
+        super().__init__()
+        self.published = []
+
+    async def group_send(self, group, message):
+        if message['type'] != MEMBERSHIP_MESSAGE:
+            self.published.append((group, message))
+        await super().group_send(group, message)
+
+
+class HybridChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        self.network = RecordingLayer()
+        self.redis = FakeRedis()
+
+    def process(self):
+        """A layer as one process would have it, sharing the network and Redis"""
+        return HybridChannelLayer(
+            inner=self.network,
+            membership_store=RedisMembershipStore(client=self.redis),
+            membership_cache_ttl=60,
+        )
+
+    async def receive(self, layer, channel):
+        return await asyncio.wait_for(layer.receive(channel), 1)
+
+    async def assert_nothing_received(self, layer, channel):
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(layer.receive(channel), 0.1)
+
+    async def test_local_members_only_skip_the_network(self):
+        layer = self.process()
+        first, second = await layer.new_channel(), await layer.new_channel()
+        await layer.group_add('room', first)
+        await layer.group_add('room', second)
+
+        await layer.group_send('room', {'type': 'chat.message', 'text': 'hi'})
+
+        self.assertEqual((await self.receive(layer, first))['text'], 'hi')
+        self.assertEqual((await self.receive(layer, second))['text'], 'hi')
+        self.assertEqual(self.network.published, [])
+        await layer.flush()
+
+    async def test_remote_members_get_group_messages(self):
+        here, there = self.process(), self.process()
+        local, remote = await here.new_channel(), await there.new_channel()
+        await here.group_add('room', local)
+        await there.group_add('room', remote)
+
+        await here.group_send('room', {'type': 'chat.message', 'text': 'hi'})
+
+        self.assertEqual((await self.receive(here, local))['text'], 'hi')
+        received = await self.receive(there, remote)
+        self.assertEqual(received, {'type': 'chat.message', 'text': 'hi'})
+        self.assertEqual(len(self.network.published), 1)
+        await here.flush()
+        await there.flush()
+
+    async def test_each_member_gets_a_message_once(self):
+        here, there = self.process(), self.process()
+        local = [await here.new_channel() for _ in range(2)]
+        remote = [await there.new_channel() for _ in range(2)]
+        for channel in local:
+            await here.group_add('room', channel)
+        for channel in remote:
+            await there.group_add('room', channel)
+
+        await here.group_send('room', {'type': 'chat.message', 'text': 'one'})
+        await there.group_send('room', {'type': 'chat.message', 'text': 'two'})
+
+        for layer, channels in ((here, local), (there, remote)):
+            for channel in channels:
+                texts = {(await self.receive(layer, channel))['text'] for _ in range(2)}
+                self.assertEqual(texts, {'one', 'two'})
+                await self.assert_nothing_received(layer, channel)
+        await here.flush()
+        await there.flush()
+
+    async def test_publish_only_process_reaches_members_that_join_later(self):
+        here, there = self.process(), self.process()
+        await here.group_send('room', {'type': 'chat.message', 'text': 'before'})
+        remote = await there.new_channel()
+        await there.group_add('room', remote)
+
+        await here.group_send('room', {'type': 'chat.message', 'text': 'after'})
+
+        self.assertEqual((await self.receive(there, remote))['text'], 'after')
+        await here.flush()
+        await there.flush()
+
+    async def test_process_stops_publishing_when_remote_members_leave(self):
+        here, there = self.process(), self.process()
+        local, remote = await here.new_channel(), await there.new_channel()
+        await here.group_add('room', local)
+        await there.group_add('room', remote)
+        await there.group_discard('room', remote)
+        # Leaving isn't announced: it is seen when the cached lookup expires
+        here.remote_cache.clear()
+
+        await here.group_send('room', {'type': 'chat.message', 'text': 'hi'})
+
+        self.assertEqual((await self.receive(here, local))['text'], 'hi')
+        self.assertEqual(self.network.published, [])
+        await here.flush()
+        await there.flush()
+
+
+HAS_REPLICA = 'replica_1' in settings.DATABASES
+
+
+@skipUnless(HAS_REPLICA, 'needs a replica: run with --settings=doccollab.replica_settings')
+@override_settings(SECURE_SSL_REDIRECT=False)
+class ReplicaRoutingTests(TransactionTestCase):
+    # Not TestCase: reads inside a transaction always stay on the primary
+    databases = {'default', 'replica_1'} if HAS_REPLICA else {'default'}
+
+    def setUp(self):
+        cache.clear()
+        replicas._marked.clear()
+        replicas._lag.clear()
+        # The same document on both databases, with a title telling them apart
+        for alias, title in (('default', 'On the primary'), ('replica_1', 'On the replica')):
+            user = User.objects.db_manager(alias).create_user('alice', password='x', id=1)
+            document = Document.objects.using(alias).create(id=1, owner=user, title=title, content={})
+            DocumentStats.objects.using(alias).create(document=document)
+        self.client = Client()
+        self.client.force_login(User.objects.get(id=1))
+
+    def test_routed_reads_go_to_the_replica(self):
+        with CaptureQueriesContext(connections['replica_1']) as queries:
+            response = self.client.get('/documents/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'On the replica')
+        self.assertNotContains(response, 'On the primary')
+        self.assertTrue(queries.captured_queries)
+
+    def test_reads_after_a_write_go_to_the_primary(self):
+        self.client.post('/documents/create/', {'title': 'New'})
+        with CaptureQueriesContext(connections['replica_1']) as queries:
+            response = self.client.get('/documents/dashboard/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'On the primary')
+        self.assertNotContains(response, 'On the replica')
+        self.assertEqual(queries.captured_queries, [])
+
+    def test_reads_go_back_to_the_replica_after_the_window(self):
+        self.client.post('/documents/create/', {'title': 'New'})
+        cache.delete(replicas.recent_write_key(1))
+        self.assertContains(self.client.get('/documents/dashboard/'), 'On the replica')
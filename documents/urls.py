@@ -8,11 +8,23 @@ urlpatterns = [
     path('dashboard/', views.dashboard, name='dashboard'),
     path('create/', views.create_document, name='create_document'),
     path('editor/<int:document_id>/', views.editor, name='editor'),
+    path('public/<int:document_id>/', views.public_document, name='public_document'),
     path('api/share/<int:document_id>/', views.share_document, name='share_document'),
+    path('api/share-bulk/', views.share_documents_bulk, name='share_documents_bulk'),
     path('api/toggle-public/<int:document_id>/', views.toggle_public, name='toggle_public'),
     path('api/delete/<int:document_id>/', views.delete_document, name='delete_document'),
     path('api/save-version/<int:document_id>/', views.save_version, name='save_version'),
     path('api/versions/<int:document_id>/', views.get_versions, name='get_versions'),
+    path('api/diff/<int:document_id>/', views.document_diff, name='document_diff'),
+    path('api/playback/<int:document_id>/', views.document_playback, name='document_playback'),
+    path('api/import/', views.import_document, name='import_document'),
+    path('api/import/<int:job_id>/', views.import_status, name='import_status'),
+    path('api/clone/<int:document_id>/', views.clone_document, name='clone_document'),
+    path('api/templates/', views.document_templates, name='document_templates'),
+    path('api/templates/<int:template_id>/documents/', views.create_from_template, name='create_from_template'),
+    path('api/comments/<int:document_id>/', views.document_comments, name='document_comments'),
+    path('api/activity/<int:document_id>/', views.document_activity, name='document_activity'),
     path('api/restore/<int:document_id>/<int:version_id>/', views.restore_version, name='restore_version'),
     path('api/download/<int:document_id>/', views.download_document, name='download_document'),
+    path('api/worker-stats/', views.worker_stats, name='worker_stats'),
 ]
@@ -0,0 +1,37 @@
+"""
+Version snapshot helpers shared by the consumer and the HTTP views.
+"""
+from .hashing import content_hash
+from .models import DocumentVersion
+from .stats import bump, record
+
+
+def create_version(document_id, content, user, summary='', digest=None):
+    """
+    Snapshot ``content`` as the next version of ``document_id``.
+
+    Identical consecutive snapshots are skipped: if the latest version
+    already has this content hash, no row is written. Returns a tuple of
+    (version_number, created). The version number comes from the latest
+    row through the (document, -version_number) index, never a count.
+    """
+    digest = digest or content_hash(content)
+    latest = DocumentVersion.objects.filter(document_id=document_id).values_list(
+        'version_number', 'content_hash'
+    ).first()
+    if latest is not None and latest[1] == digest:
+        return latest[0], False
+
+    version_number = (latest[0] if latest else 0) + 1
+    version = DocumentVersion(
+        document_id=document_id,
+        content=content,
+        created_by=user,
+        version_number=version_number,
+        change_summary=summary,
+    )
+    version.content_hash = digest
+    # bulk_create bypasses save(), so the known hash isn't recomputed
+    DocumentVersion.objects.bulk_create([version])
+    record(bump, document_id, version_count=1)
+    return version_number, True
@@ -1,12 +1,45 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import authenticate, login, logout
-from django.contrib.auth.models import User
-from django.http import JsonResponse, HttpResponse
+from django.contrib.auth.models import Group, User
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
+from django.conf import settings
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.db import router, transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 import json
-from .models import Document, DocumentPermission, UserPresence, DocumentVersion, DocumentComment, DocumentActivity
+from .models import Document, DocumentPermission, UserPresence, DocumentVersion, DocumentComment, DocumentActivity, DocumentStats, DocumentTemplate, ImportJob
+from .blocks import split_blocks, save_blocks, drop_blocks, current_content
+from .acl import access, grant
+from .activity import drop_archives, feed
+from .affinity import room_router
+from .anchors import anchor_tracker
+from .backends.pool import pool_stats
+from .buffering import edit_buffer
+from .cloning import clone, instantiate, save_template
+from .drain import drain_controller
+from .metrics import metrics
+from .playback import Playback
+from .rooms import room_lifecycle
+from .scheduler import room_scheduler
+from .stats import attach_stats, record, set_word_count
+from .concurrency import update_with_retry, RevisionConflict
+from .diffing import cached_diff
+from .caching import get_public_meta, set_public_meta, invalidate_document, get_rendered_html, get_or_render_html
+from .hashing import content_hash
+from .importing import import_runner, store_upload
+from .parsers import UnreadableFile
+from .replicas import replica_reads
+from .rendering import render_html, render_text, render_layout, block_cache
+from .versions import create_version
 from docx import Document as DocxDocument
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
@@ -53,9 +86,17 @@ def logout_view(request):
     return redirect('login')
 
 @login_required(login_url='login')
+@replica_reads
 def dashboard(request):
-    owned_documents = Document.objects.filter(owner=request.user)
-    shared_documents = Document.objects.filter(permissions__user=request.user).distinct()
+    # The cards only show titles and dates: never load document content here
+    # Counts come from the precomputed DocumentStats row, joined in
+    owned_documents = attach_stats(
+        Document.objects.filter(owner=request.user).defer('content').select_related('stats')
+    )
+    # Shared directly or through a group: one row per document in the ACL
+    shared_documents = attach_stats(Document.objects.filter(acl__user=request.user).defer(
+        'content'
+    ).select_related('owner', 'stats'))
     
     context = {
         'owned_documents': owned_documents,
@@ -72,33 +113,227 @@ def create_document(request):
             owner=request.user,
             content={"type": "doc", "content": []}
         )
+        DocumentStats.objects.create(document=document)
         return redirect('editor', document_id=document.id)
     
-    return render(request, 'create_document.html')
+    return render(request, 'create_document.html', {'templates': usable_templates(request.user)})
+
+def usable_templates(user):
+    """Templates ``user`` may create documents from: their own and public ones"""
+    return DocumentTemplate.objects.filter(Q(owner=user) | Q(is_public=True)).select_related('owner')
+
+@login_required(login_url='login')
+@require_http_methods(["POST"])
+def clone_document(request, document_id):
+    """Copy a document (copy-on-write: the content is shared until the copy is edited)"""
+    document = get_object_or_404(Document.objects.defer('content'), id=document_id)
+    
+    if access(document, request.user) is None:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    try:
+        data = json.loads(request.body or '{}')
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    
+    copy = clone(document, request.user, data.get('title'))
+    return JsonResponse({
+        'success': True,
+        'document_id': copy.id,
+        'title': copy.title,
+        'url': reverse('editor', args=[copy.id]),
+    })
 
 @login_required(login_url='login')
+@require_http_methods(["GET", "POST"])
+def document_templates(request):
+    """
+    GET: the templates the user can use. POST ``{"document_id", "name",
+    "description", "is_public"}``: save a document's current content as a
+    template.
+    """
+    if request.method == 'GET':
+        return JsonResponse({'templates': [
+            {
+                'id': template.id,
+                'name': template.name,
+                'description': template.description,
+                'owner': template.owner.username,
+                'is_public': template.is_public,
+                'created_at': template.created_at,
+            }
+            for template in usable_templates(request.user)
+        ]})
+    
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    name = (data.get('name') or '').strip()
+    if not name:
+        return JsonResponse({'error': 'name is required'}, status=400)
+    document = get_object_or_404(Document.objects.defer('content'), id=data.get('document_id'))
+    if access(document, request.user) is None:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    template = save_template(
+        document, request.user, name, data.get('description', ''), bool(data.get('is_public', False)),
+    )
+    return JsonResponse({'success': True, 'template_id': template.id}, status=201)
+
+@login_required(login_url='login')
+@require_http_methods(["POST"])
+def create_from_template(request, template_id):
+    """
+    Create documents from a template in one transaction.
+    
+    Body: ``{"titles": [...]}``, one document per title, at most
+    ``TEMPLATE_BULK_MAX``. The documents share the template's content until
+    they are edited, so creating hundreds costs no content copies.
+    """
+    template = get_object_or_404(usable_templates(request.user), id=template_id)
+    
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    titles = data.get('titles') or [template.name]
+    if not isinstance(titles, list) or not all(isinstance(title, str) and title.strip() for title in titles):
+        return JsonResponse({'error': 'titles must be a list of non-empty strings'}, status=400)
+    if len(titles) > settings.TEMPLATE_BULK_MAX:
+        return JsonResponse({'error': f'At most {settings.TEMPLATE_BULK_MAX} documents per request'}, status=400)
+    
+    documents = instantiate(template, request.user, [title.strip() for title in titles])
+    return JsonResponse({
+        'success': True,
+        'documents': [
+            {'id': document.id, 'title': document.title, 'url': reverse('editor', args=[document.id])}
+            for document in documents
+        ],
+    }, status=201)
+
+@login_required(login_url='login')
+@require_http_methods(["POST"])
+def import_document(request):
+    """
+    Import an uploaded .docx, .pdf or .txt file, or a .zip of them (one
+    document per file). The upload is queued and parsed in the background:
+    poll ``import_status`` with the returned job id.
+    """
+    uploaded = request.FILES.get('file')
+    if uploaded is None:
+        return JsonResponse({'error': 'No file uploaded'}, status=400)
+    
+    try:
+        job = store_upload(request.user, uploaded)
+    except UnreadableFile as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    transaction.on_commit(lambda: import_runner.start(job.id))
+    
+    return JsonResponse({
+        'job': job.id,
+        'status_url': reverse('import_status', args=[job.id]),
+    }, status=202)
+
+@login_required(login_url='login')
+@require_http_methods(["GET"])
+def import_status(request, job_id):
+    job = get_object_or_404(ImportJob, id=job_id, owner=request.user)
+    return JsonResponse({
+        'job': job.id,
+        'filename': job.filename,
+        'kind': job.kind,
+        'status': job.status,
+        'total': job.total,
+        'processed': job.processed,
+        'created': job.created,
+        'failed': job.failed,
+        'errors': job.errors,
+        'document_url': reverse('editor', args=[job.document_id]) if job.document_id else None,
+        'finished_at': job.finished_at,
+    })
+
+@login_required(login_url='login')
+@replica_reads
 def editor(request, document_id):
-    document = get_object_or_404(Document, id=document_id)
+    # Content arrives over the websocket, not with the page
+    document = get_object_or_404(Document.objects.defer('content').select_related('stats'), id=document_id)
+    document, = attach_stats([document])
+    level = access(document, request.user)
     
     # Check permissions
-    if document.owner != request.user and not document.is_public:
-        if not document.permissions.filter(user=request.user).exists():
-            return redirect('dashboard')
+    if level is None:
+        return redirect('dashboard')
     
     active_users = UserPresence.objects.filter(document=document).select_related('user')
-    comments = DocumentComment.objects.filter(document=document)
-    activities = DocumentActivity.objects.filter(document=document)[:20]
     
     context = {
         'document': document,
+        'stats': document.stats,
         'active_users': active_users,
-        'comments': comments,
-        'activities': activities,
-        'is_owner': document.owner == request.user,
-        'can_edit': document.owner == request.user or document.permissions.filter(user=request.user, permission='editor').exists(),
+        'is_owner': level == 'owner',
+        'can_edit': level in ('owner', 'editor'),
+        # Worker owning the live room; the websocket URL carries it as a routing hint
+        'room_worker': room_router.owner(document.id) if room_router.enabled else '',
     }
     return render(request, 'editor.html', context)
 
+def load_public_meta(document_id):
+    """Cache metadata and rendered HTML of a public document, read from the database"""
+    row = Document.objects.filter(id=document_id, is_public=True).values(
+        'title', 'content_hash', 'storage_mode', 'updated_at'
+    ).first()
+    if row is None:
+        raise Http404('Document not found')
+    # Content is only read when this hash has never been rendered
+    digest = row['content_hash']
+    body = get_or_render_html(digest, lambda: render_html(current_content(document_id, row['storage_mode'])))
+    meta = {
+        'title': row['title'],
+        'digest': digest,
+        'etag': f'"{content_hash([row["title"], digest])}"',
+        'last_modified': int(row['updated_at'].timestamp()),
+    }
+    set_public_meta(document_id, meta)
+    return meta, body
+
+@require_http_methods(["GET", "HEAD"])
+def public_document(request, document_id):
+    """
+    Read-only, cacheable HTML rendering of a public document.
+
+    Anonymous and CDN friendly: no session access, a strong ETag derived from
+    the content hash, Last-Modified from updated_at, and 304 responses for
+    conditional requests. Within PUBLIC_DOCUMENT_CACHE_TTL, requests are served
+    from cached metadata and rendered HTML without any database query.
+    """
+    meta, body = get_public_meta(document_id), None
+    if meta is None:
+        meta, body = load_public_meta(document_id)
+    
+    max_age = settings.PUBLIC_DOCUMENT_CACHE_TTL
+    response = get_conditional_response(
+        request, etag=meta['etag'], last_modified=meta['last_modified']
+    )
+    if response is None:
+        if body is None:
+            body = get_rendered_html(meta['digest'])
+        if body is None:
+            # Rendered HTML was evicted independently of the metadata (or
+            # the cache doesn't keep it): render it from the database
+            invalidate_document(document_id)
+            meta, body = load_public_meta(document_id)
+        response = render(request, 'public_document.html', {
+            'title': meta['title'],
+            'body': body,
+        })
+        # Rendered and sanitized server-side; never let it run script anyway
+        response['Content-Security-Policy'] = "script-src 'none'; object-src 'none'"
+    response['ETag'] = meta['etag']
+    response['Last-Modified'] = http_date(meta['last_modified'])
+    patch_cache_control(response, public=True, max_age=max_age, s_maxage=max_age)
+    return response
+
 
 """
 @login_required(login_url='login')
@@ -142,57 +377,87 @@ def share_document(request, document_id):
     data = json.loads(request.body)
     username = data.get('username')
     permission = data.get('permission', 'editor')
+    if permission not in ('editor', 'viewer'):
+        return JsonResponse({'error': 'permission must be editor or viewer'}, status=400)
     
-    # DEBUG: Print all users for testing
-    all_users = User.objects.all().values('username', 'email')
-    print("All registered users:", list(all_users))
+    # Case-insensitive lookup of just this user
+    user = User.objects.filter(username__iexact=username).first() if username else None
+    if user is None:
+        return JsonResponse({'error': f'User "{username}" not found'}, status=404)
     
-    try:
-        # FIX 1: Case-insensitive lookup or exact match
-        user = User.objects.get(username__iexact=username)  # Case-insensitive
-        
-        # FIX 2: Check if trying to share with yourself
-        if user == request.user:
-            return JsonResponse({'error': 'Cannot share document with yourself'}, status=400)
-        
-        # FIX 3: Check if user already has permission
-        existing_permission = DocumentPermission.objects.filter(
-            document=document, 
-            user=user
-        ).first()
-        
-        if existing_permission:
-            return JsonResponse({
-                'error': f'Document already shared with {username}'
-            }, status=400)
-        
-        # Create permission
-        DocumentPermission.objects.create(
-            document=document,
-            user=user,
-            permission=permission
-        )
-        
-        # Log activity
-        DocumentActivity.objects.create(
-            document=document,
-            user=request.user,
-            activity_type='share',
-            description=f'Shared with {username} ({permission})'
-        )
-        
+    if user == request.user:
+        return JsonResponse({'error': 'Cannot share document with yourself'}, status=400)
+    
+    if DocumentPermission.objects.filter(document=document, user=user).exists():
         return JsonResponse({
-            'success': True,
-            'message': f'Document successfully shared with {username}'
-        })
-        
-    except User.DoesNotExist:
-        # FIX 4: Better error reporting
+            'error': f'Document already shared with {user.username}'
+        }, status=400)
+    
+    grant([document], request.user, users=[user], permission=permission)
+    
+    return JsonResponse({
+        'success': True,
+        'message': f'Document successfully shared with {user.username}'
+    })
+
+@login_required(login_url='login')
+@require_http_methods(["POST"])
+def share_documents_bulk(request):
+    """
+    Grant many users and groups access to many documents in one request.
+    
+    Body: ``{"document_ids": [...], "usernames": [...], "groups": [...],
+    "permission": "editor"|"viewer"}``. All grants are written in one
+    transaction; existing grants are updated to ``permission``. Every
+    document must be owned by the requester, and every user and group must
+    exist, or nothing is granted.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    if not isinstance(data, dict):
+        return JsonResponse({'error': 'Expected a JSON object'}, status=400)
+    document_ids = data.get('document_ids') or []
+    if not isinstance(document_ids, list) or not all(
+        isinstance(document_id, int) and not isinstance(document_id, bool) for document_id in document_ids
+    ):
+        return JsonResponse({'error': 'document_ids must be a list of integers'}, status=400)
+    names = {'usernames': data.get('usernames') or [], 'groups': data.get('groups') or []}
+    for field, value in names.items():
+        if not isinstance(value, list) or not all(isinstance(name, str) for name in value):
+            return JsonResponse({'error': f'{field} must be a list of strings'}, status=400)
+    document_ids = set(document_ids)
+    usernames = set(names['usernames'])
+    group_names = set(names['groups'])
+    permission = data.get('permission', 'editor')
+    if permission not in ('editor', 'viewer'):
+        return JsonResponse({'error': 'permission must be editor or viewer'}, status=400)
+    if not document_ids or not (usernames or group_names):
+        return JsonResponse({'error': 'document_ids and usernames or groups are required'}, status=400)
+    max_grants = settings.SHARE_BULK_MAX
+    if len(document_ids) * (len(usernames) + len(group_names)) > max_grants:
+        return JsonResponse({'error': f'At most {max_grants} grants per request'}, status=400)
+    
+    documents = list(Document.objects.filter(id__in=document_ids, owner=request.user).only('id', 'owner_id'))
+    if len(documents) != len(document_ids):
+        denied = sorted(document_ids - {document.id for document in documents})
+        return JsonResponse({'error': 'Permission denied', 'document_ids': denied}, status=403)
+    
+    # One query each, for only the names asked for
+    users = list(User.objects.filter(username__in=usernames).only('id', 'username'))
+    groups = list(Group.objects.filter(name__in=group_names))
+    missing_users = sorted(usernames - {user.username for user in users})
+    missing_groups = sorted(group_names - {group.name for group in groups})
+    if missing_users or missing_groups:
         return JsonResponse({
-            'error': f'User "{username}" not found. Available users: {list(User.objects.values_list("username", flat=True))}'
+            'error': 'Unknown users or groups',
+            'usernames': missing_users,
+            'groups': missing_groups,
         }, status=404)
-
-
+    
+    granted = grant(documents, request.user, users=users, groups=groups, permission=permission)
+    return JsonResponse({'success': True, 'granted': granted})
 
 
 @login_required(login_url='login')
@@ -203,9 +468,16 @@ def toggle_public(request, document_id):
     if document.owner != request.user:
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
-    document.is_public = not document.is_public
-    document.save()
-    return JsonResponse({'is_public': document.is_public})
+    # Conditional update of just this flag: a concurrent toggle can't be
+    # lost, and the content columns a live editor is writing are untouched
+    is_public = not document.is_public
+    updated = Document.objects.filter(id=document.id, is_public=document.is_public).update(
+        is_public=is_public
+    )
+    if not updated:
+        return JsonResponse({'error': 'Document was changed concurrently, please retry'}, status=409)
+    invalidate_document(document.id)
+    return JsonResponse({'is_public': is_public})
 
 @login_required(login_url='login')
 @require_http_methods(["DELETE"])
@@ -216,6 +488,7 @@ def delete_document(request, document_id):
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
     document.delete()
+    drop_archives(document_id)
     return JsonResponse({'success': True})
 
 @login_required(login_url='login')
@@ -223,46 +496,247 @@ def delete_document(request, document_id):
 def save_version(request, document_id):
     document = get_object_or_404(Document, id=document_id)
     
-    if document.owner != request.user and not document.permissions.filter(user=request.user, permission='editor').exists():
+    if access(document, request.user) not in ('owner', 'editor'):
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
     data = json.loads(request.body)
-    version_count = DocumentVersion.objects.filter(document=document).count()
+    content = current_content(document.id, document.storage_mode)
     
-    DocumentVersion.objects.create(
-        document=document,
-        content=document.content,
-        created_by=request.user,
-        version_number=version_count + 1,
-        change_summary=data.get('summary', 'Manual save')
+    # Unchanged content (e.g. the periodic auto-save) reuses the latest version
+    version_number, created = create_version(
+        document.id,
+        content,
+        request.user,
+        summary=data.get('summary', 'Manual save'),
+        digest=document.content_hash or None,
     )
     
-    return JsonResponse({'success': True, 'version': version_count + 1})
+    return JsonResponse({'success': True, 'version': version_number, 'unchanged': not created})
 
 @login_required(login_url='login')
+@replica_reads
 def get_versions(request, document_id):
-    document = get_object_or_404(Document, id=document_id)
+    document = get_object_or_404(Document.objects.defer('content').select_related('stats'), id=document_id)
+    
+    if access(document, request.user) is None:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
     
-    if document.owner != request.user and not document.is_public:
-        if not document.permissions.filter(user=request.user).exists():
-            return JsonResponse({'error': 'Permission denied'}, status=403)
+    try:
+        before = int(request.GET['before']) if 'before' in request.GET else None
+        limit = int(request.GET.get('limit', settings.VERSIONS_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'before and limit must be integers'}, status=400)
+    limit = min(max(limit, 1), settings.VERSIONS_PAGE_MAX)
     
-    versions = DocumentVersion.objects.filter(document=document).values(
+    # Newest first, keyset paged by version number: ``next`` is the
+    # ``before`` of the following page
+    versions = DocumentVersion.objects.filter(document=document)
+    if before is not None:
+        versions = versions.filter(version_number__lt=before)
+    page = list(versions.values(
         'id', 'version_number', 'created_by__username', 'created_at', 'change_summary'
+    )[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
+    
+    document, = attach_stats([document])
+    return JsonResponse({
+        'versions': page,
+        'count': document.stats.version_count,
+        'next': page[-1]['version_number'] if has_more else None,
+    })
+
+@login_required(login_url='login')
+@require_http_methods(['GET'])
+@replica_reads
+def document_playback(request, document_id):
+    """
+    Stream a document's history as newline-delimited JSON: a snapshot, then
+    a delta per version (with periodic keyframes), then an end frame.
+    
+    The range is ``from``/``to`` (version numbers) and/or ``since``/``until``
+    (ISO datetimes); playback starts from the state at ``from``/``since``.
+    """
+    document = get_object_or_404(Document.objects.only('owner_id', 'is_public'), id=document_id)
+    
+    if access(document, request.user) is None:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    try:
+        start = int(request.GET['from']) if 'from' in request.GET else None
+        stop = int(request.GET['to']) if 'to' in request.GET else None
+        since = parse_timestamp(request.GET['since']) if 'since' in request.GET else None
+        until = parse_timestamp(request.GET['until']) if 'until' in request.GET else None
+    except ValueError:
+        return JsonResponse({'error': 'from and to must be version numbers, since and until ISO datetimes'},
+                            status=400)
+    
+    playback = Playback(
+        document.id, start=start, stop=stop, since=since, until=until,
+        using=router.db_for_read(DocumentVersion),
     )
+    # Under ASGI a sync iterator would be read to the end before sending
+    frames = playback.__aiter__() if isinstance(request, ASGIRequest) else iter(playback)
+    response = StreamingHttpResponse(frames, content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+def parse_timestamp(value):
+    moment = parse_datetime(value)
+    if moment is None:
+        raise ValueError(value)
+    return timezone.make_aware(moment) if timezone.is_naive(moment) else moment
+
+@login_required(login_url='login')
+@require_http_methods(['GET'])
+@replica_reads
+def document_diff(request, document_id):
+    """
+    What changed between two versions, or a version and the current content.
+    
+    ``from`` and ``to`` are version ids, or ``current``. Only the content
+    hashes are read up front: a diff already cached for the pair is returned
+    without loading either content.
+    """
+    document = get_object_or_404(
+        Document.objects.only('owner_id', 'is_public', 'content_hash', 'storage_mode'), id=document_id
+    )
+    
+    if access(document, request.user) is None:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    def side(ref):
+        """(metadata, content hash, content loader) of one side, or None"""
+        if ref == 'current':
+            load = lambda: current_content(document.id, document.storage_mode)
+            return {'version': 'current'}, document.content_hash, load
+        try:
+            version_id = int(ref)
+        except (TypeError, ValueError):
+            return None
+        row = DocumentVersion.objects.filter(document_id=document.id, id=version_id).values(
+            'id', 'version_number', 'content_hash', 'created_at'
+        ).first()
+        if row is None:
+            raise Http404('No such version')
+        load = lambda: DocumentVersion.objects.values_list('content', flat=True).get(id=version_id)
+        return {'version': row['id'], 'version_number': row['version_number'], 'created_at': row['created_at']}, \
+            row['content_hash'], load
+    
+    old_side = side(request.GET.get('from'))
+    new_side = side(request.GET.get('to', 'current'))
+    if old_side is None or new_side is None:
+        return JsonResponse({'error': "from and to must be version ids or 'current'"}, status=400)
+    
+    (old_meta, old_hash, load_old), (new_meta, new_hash, load_new) = old_side, new_side
+    if not old_hash or not new_hash:
+        # Rows written before hashes were stored: hash the content itself
+        old_content, new_content = load_old(), load_new()
+        old_hash, new_hash = content_hash(old_content), content_hash(new_content)
+        load_old, load_new = (lambda: old_content), (lambda: new_content)
+    
+    diff = cached_diff(old_hash, new_hash, load_old, load_new)
+    return JsonResponse({'from': old_meta, 'to': new_meta, **diff})
+
+@login_required(login_url='login')
+@require_http_methods(['GET'])
+@replica_reads
+def document_comments(request, document_id):
+    """
+    A page of a document's comments, oldest first.
+    
+    Keyset pagination: ``after`` is the ``next`` of the previous page (the
+    last comment id), so every page is an index seek however deep it is.
+    ``resolved=true|false`` filters by status and ``limit`` caps the page
+    at ``COMMENTS_PAGE_MAX``. Positions are the server-side rebased anchors.
+    """
+    document = get_object_or_404(Document.objects.only('owner_id', 'is_public'), id=document_id)
     
-    return JsonResponse({'versions': list(versions)})
+    if access(document, request.user) is None:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    try:
+        after = int(request.GET.get('after', 0))
+        limit = int(request.GET.get('limit', settings.COMMENTS_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'after and limit must be integers'}, status=400)
+    limit = min(max(limit, 1), settings.COMMENTS_PAGE_MAX)
+    resolved = request.GET.get('resolved')
+    
+    comments = DocumentComment.objects.filter(document_id=document_id, id__gt=after)
+    if resolved is not None:
+        if resolved not in ('true', 'false'):
+            return JsonResponse({'error': 'resolved must be true or false'}, status=400)
+        comments = comments.filter(resolved=resolved == 'true')
+    page = list(comments.order_by('id').values(
+        'id', 'user__username', 'content', 'position', 'anchor_revision', 'resolved', 'created_at'
+    )[:limit + 1])
+    
+    has_more = len(page) > limit
+    page = page[:limit]
+    for comment in page:
+        comment['username'] = comment.pop('user__username')
+        # Anchors moved by edits on this worker and not yet written back
+        comment['position'] = anchor_tracker.position(str(document_id), comment['id'], comment['position'])
+    
+    return JsonResponse({
+        'comments': page,
+        'next': page[-1]['id'] if has_more else None,
+    })
+
+@login_required(login_url='login')
+@require_http_methods(['GET'])
+@replica_reads
+def document_activity(request, document_id):
+    """
+    A page of a document's activity feed, newest first.
+    
+    ``before`` is the ``next`` of the previous page. Runs of the same
+    user's activity are folded into one entry unless ``aggregate=false``.
+    Archived activity is read from the archive files once the table runs out.
+    """
+    document = get_object_or_404(Document.objects.only('owner_id', 'is_public'), id=document_id)
+    
+    if access(document, request.user) is None:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    try:
+        before = int(request.GET['before']) if 'before' in request.GET else None
+        limit = int(request.GET.get('limit', settings.ACTIVITY_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'before and limit must be integers'}, status=400)
+    limit = min(max(limit, 1), settings.ACTIVITY_PAGE_MAX)
+    aggregate = request.GET.get('aggregate', 'true') != 'false'
+    
+    entries, next_cursor = feed(document_id, before, limit, aggregate)
+    return JsonResponse({'activity': entries, 'next': next_cursor})
 
 @login_required(login_url='login')
 def restore_version(request, document_id, version_id):
     document = get_object_or_404(Document, id=document_id)
     version = get_object_or_404(DocumentVersion, id=version_id, document=document)
     
-    if document.owner != request.user and not document.permissions.filter(user=request.user, permission='editor').exists():
+    if access(document, request.user) not in ('owner', 'editor'):
         return JsonResponse({'error': 'Permission denied'}, status=403)
     
-    document.content = version.content
-    document.save()
+    # A restore replaces the content outright, so it applies on top of
+    # whatever revision is current; open editors get a conflict on their
+    # next edit and resync to the restored content
+    fields = {'content': version.content, 'content_hash': content_hash(version.content)}
+    try:
+        with transaction.atomic():
+            blocks = split_blocks(version.content) if document.storage_mode == 'blocks' else None
+            if blocks is not None:
+                save_blocks(document.id, blocks, fields['content_hash'])
+            elif document.storage_mode == 'blocks':
+                drop_blocks(document.id)
+                fields['storage_mode'] = 'inline'
+            revision = update_with_retry(document.id, **fields)
+    except RevisionConflict:
+        return JsonResponse({'error': 'Document is being edited, please retry'}, status=409)
+    invalidate_document(document.id)
+    record(set_word_count, document.id, version.content)
     
     DocumentActivity.objects.create(
         document=document,
@@ -271,7 +745,33 @@ def restore_version(request, document_id, version_id):
         description=f'Restored to version {version.version_number}'
     )
     
-    return JsonResponse({'success': True})
+    return JsonResponse({'success': True, 'revision': revision})
+
+@login_required(login_url='login')
+@require_http_methods(["GET"])
+def worker_stats(request):
+    """Room and cache counters of the worker process serving this request (staff only)"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
+    
+    return JsonResponse({
+        'worker': room_router.worker,
+        'rooms': room_lifecycle.counts(),
+        'draining': drain_controller.draining,
+        'room_affinity': {
+            'enabled': room_router.enabled,
+            'ring': sorted(room_router.ring.nodes) if room_router.ring else [],
+            'forwarded_rooms': len(room_router.remote),
+        },
+        'render_block_cache': {
+            'hits': block_cache.hits,
+            'misses': block_cache.misses,
+        },
+        'counters': metrics.snapshot(),
+        'scheduler': room_scheduler.stats(),
+        'edit_buffer': edit_buffer.stats(),
+        'db_pools': pool_stats(),
+    })
 
 """
 @csrf_exempt
@@ -412,9 +912,8 @@ def generate_docx(content, title):
 def download_document(request, document_id):
     document = get_object_or_404(Document, id=document_id)
     
-    if document.owner != request.user and not document.is_public:
-        if not document.permissions.filter(user=request.user).exists():
-            return JsonResponse({'error': 'Permission denied'}, status=403)
+    if access(document, request.user) is None:
+        return JsonResponse({'error': 'Permission denied'}, status=403)
     
     file_format = request.GET.get('format', 'txt')
     
@@ -497,12 +996,14 @@ def extract_text_from_node(node):
 
 
 @csrf_exempt
+@replica_reads
 def download_document(request, document_id):
     from .models import Document
     
     try:
-        document = get_object_or_404(Document, id=document_id)
+        document = get_object_or_404(Document.objects.defer('content'), id=document_id)
         format_type = request.GET.get('format', 'txt')
+        etag = None
         
         # Get content from request or use saved content
         if request.method == 'POST':
@@ -511,69 +1012,87 @@ def download_document(request, document_id):
                 content = data.get('content', '')
                 title = data.get('title', document.title)
             except:
-                content = document.content
+                content = current_content(document.id, document.storage_mode)
                 title = document.title
         else:
-            content = document.content
+            # Saved content: the content hash is the export's ETag, so a
+            # repeat download is answered with a 304 before loading content
+            etag = f'"{content_hash([document.title, document.content_hash, format_type])}"'
+            response = get_conditional_response(request, etag=etag)
+            if response is not None:
+                return response
+            content = current_content(document.id, document.storage_mode)
             title = document.title
         
         if format_type == 'txt':
-            return generate_txt(content, title)
+            response = generate_txt(content, title)
         elif format_type == 'pdf':
-            return generate_pdf(content, title)
+            response = generate_pdf(content, title)
         elif format_type == 'docx':
-            return generate_docx(content, title)
+            response = generate_docx(content, title)
         else:
             return JsonResponse({'error': 'Unsupported format'}, status=400)
+        
+        if etag and response.status_code == 200:
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
             
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
 def generate_txt(content, title):
     """Generate plain text file"""
-    # Simple HTML to text conversion
-    import re
-    from html import unescape
-    
-    # Remove HTML tags
-    text = re.sub('<[^<]+?>', '', content)
-    text = unescape(text)
+    text = render_text(content)
     
     response = HttpResponse(f"{title}\n\n{text}", content_type='text/plain')
     response['Content-Disposition'] = f'attachment; filename="{title}.txt"'
     return response
 
+PDF_HEADING_SIZES = {1: 18, 2: 16, 3: 14}
+
 def generate_pdf(content, title):
-    """Generate PDF file - Simple version"""
+    """Generate PDF file from the layout model"""
     try:
         from reportlab.pdfgen import canvas
         from reportlab.lib.pagesizes import letter
+        from reportlab.lib.utils import simpleSplit
         
         buffer = io.BytesIO()
         p = canvas.Canvas(buffer, pagesize=letter)
+        width, height = letter
         
         # Add title
         p.setFont("Helvetica-Bold", 16)
         p.drawString(100, 750, title)
         
-        # Convert HTML to text
-        import re
-        from html import unescape
-        text = re.sub('<[^<]+?>', '', content)
-        text = unescape(text)
-        
-        # Add content
-        p.setFont("Helvetica", 12)
         y = 700
-        lines = text.split('\n')
-        
-        for line in lines:
-            if y < 100:  # New page if needed
-                p.showPage()
-                p.setFont("Helvetica", 12)
-                y = 750
-            p.drawString(50, y, line[:80])  # Limit line length
-            y -= 20
+        for block in render_layout(content):
+            text = ''.join(run['text'] for run in block['runs'])
+            if block['kind'] == 'heading':
+                font, size = "Helvetica-Bold", PDF_HEADING_SIZES.get(block['level'], 12)
+            elif block['kind'] == 'code':
+                font, size = "Courier", 10
+            elif block['kind'] == 'quote':
+                font, size = "Helvetica-Oblique", 12
+            else:
+                font, size = "Helvetica", 12
+            if block['kind'] == 'rule':
+                text = '_' * 60
+            indent = 50 + 18 * max(block['level'] - 1, 0) if block['marker'] else 50
+            if block['marker']:
+                text = f"{block['marker']} {text}"
+            
+            lines = []
+            for raw_line in text.split('\n') or ['']:
+                lines.extend(simpleSplit(raw_line, font, size, width - indent - 50) or [''])
+            for line in lines:
+                if y < 100:  # New page if needed
+                    p.showPage()
+                    y = 750
+                p.setFont(font, size)
+                p.drawString(indent, y, line)
+                y -= size + 8
         
         p.save()
         buffer.seek(0)
@@ -588,25 +1107,37 @@ def generate_pdf(content, title):
         return JsonResponse({'error': f'PDF generation failed: {str(e)}'}, status=500)
 
 def generate_docx(content, title):
-    """Generate DOCX file - Simple version"""
+    """Generate DOCX file from the layout model"""
     try:
         from docx import Document
-        from docx.shared import Inches
         
         doc = Document()
         doc.add_heading(title, 0)
         
-        # Convert HTML to text
-        import re
-        from html import unescape
-        text = re.sub('<[^<]+?>', '', content)
-        text = unescape(text)
-        
-        # Add content
-        lines = text.split('\n')
-        for line in lines:
-            if line.strip():
-                doc.add_paragraph(line)
+        for block in render_layout(content):
+            if block['kind'] == 'heading':
+                paragraph = doc.add_heading(level=block['level'])
+            elif block['kind'] == 'list_item':
+                style = 'List Number' if block['marker'][0].isdigit() else 'List Bullet'
+                paragraph = doc.add_paragraph(style=style)
+            elif block['kind'] == 'quote':
+                paragraph = doc.add_paragraph(style='Quote')
+            elif block['kind'] == 'rule':
+                paragraph = doc.add_paragraph('_' * 40)
+            else:
+                if not any(run['text'].strip() for run in block['runs']):
+                    continue
+                paragraph = doc.add_paragraph()
+            
+            for run in block['runs']:
+                docx_run = paragraph.add_run(run['text'])
+                docx_run.bold = run.get('bold')
+                docx_run.italic = run.get('italic')
+                docx_run.underline = run.get('underline')
+                if run.get('strike'):
+                    docx_run.font.strike = True
+                if run.get('code'):
+                    docx_run.font.name = 'Courier New'
         
         buffer = io.BytesIO()
         doc.save(buffer)
@@ -622,5 +1153,4 @@ def generate_docx(content, title):
     except ImportError:
         return JsonResponse({'error': 'DOCX generation requires python-docx package'}, status=500)
     except Exception as e:
-        return JsonResponse({'error': f'DOCX generation failed: {str(e)}'}, status=500)
-
+        return JsonResponse({'error': f'DOCX generation failed: {str(e)}'}, status=500)
\ No newline at end of file